@@ -0,0 +1,276 @@
+import argparse
+import csv
+import json
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from cpu_runtime import box_iou, xywh2xyxy
+from predict_stream import dynamic_batches, result_rows, select_device, start_decoder
+from yolo_io import IMAGE_EXTS, place_file, write_atomic
+
+# Pseudo-labelling loop over a pool of unlabeled images (e.g. new_car_images).
+#
+# Every round only scores images that are not in <work>/scored.jsonl yet (or
+# whose size/mtime changed), so a round costs as much as the new images, not
+# the whole pool. Per image it records the predicted boxes and an uncertainty
+# score, the max of:
+#   - 1 - margin for every box, margin = conf - conf of the best overlapping
+#     box of another class (low conf and "close second class" both show here)
+#   - the highest candidate conf below --min-conf (a sign that may be missed)
+#   - with --flip-tta, the fraction of boxes without a same-class match in the
+#     horizontally flipped prediction. Classes whose meaning flips with the
+#     image (keep_right by default) are left out of that comparison.
+# Images whose boxes all clear --accept-conf with no doubt left are written to
+# a pseudo split (<dest>/images|labels/pseudo); the rest go to the review
+# queue (<work>/review_queue.csv, most uncertain first, with pre-annotations
+# in <work>/review/labels).
+#
+# Decisions are made once, when an image is scored; records keep the boxes,
+# so the queue can be re-ranked without running the model again. A re-scored
+# image that lands in review loses its earlier pseudo label, and the
+# pre-annotations are rewritten every round to match the current queue.
+
+MANIFEST = "scored.jsonl"
+PSEUDO_SPLIT = "pseudo"
+
+
+def _sig(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_manifest(work_dir):
+    """{image path: record}; the manifest is append-only and the last record wins."""
+    records = {}
+    path = Path(work_dir) / MANIFEST
+    if path.exists():
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    records[rec["image"]] = rec
+    return records
+
+
+def pending_images(pool_dir, records):
+    """Images in pool_dir that are new or changed since they were scored."""
+    out = []
+    with os.scandir(pool_dir) as it:
+        for e in it:
+            if not e.is_file() or os.path.splitext(e.name)[1].lower() not in IMAGE_EXTS:
+                continue
+            path = os.path.abspath(e.path)
+            st = e.stat()
+            rec = records.get(path)
+            if rec is None or rec["sig"] != [st.st_size, st.st_mtime_ns]:
+                out.append(path)
+    return sorted(out)
+
+
+def class_margins(cls, xyxy, conf, iou_thres=0.5):
+    """Per box: conf minus the best conf of an overlapping box of another class."""
+    if not len(cls):
+        return np.zeros(0, np.float32)
+    iou = box_iou(xyxy, xyxy)
+    rival = (iou > iou_thres) & (cls[:, None] != cls[None, :])
+    best_rival = np.where(rival, conf[None, :], 0.0).max(1)
+    return conf - best_rival
+
+
+def flip_disagreement(a, b, exclude=(), iou_thres=0.5):
+    """
+    Fraction of boxes (in either view) without a same-class match in the other.
+    a, b are (cls, xyxy) in normalized coords, b already un-flipped.
+    """
+    (ca, ba), (cb, bb) = a, b
+    ma, mb = ~np.isin(ca, list(exclude)), ~np.isin(cb, list(exclude))
+    ca, ba, cb, bb = ca[ma], ba[ma], cb[mb], bb[mb]
+    n = len(ca) + len(cb)
+    if n == 0:
+        return 0.0
+    if not len(ca) or not len(cb):
+        return 1.0
+    hit = (box_iou(ba, bb) > iou_thres) & (ca[:, None] == cb[None, :])
+    return float((~hit.any(1)).sum() + (~hit.any(0)).sum()) / n
+
+
+def score_image(cls, xywhn, conf, min_conf, flip=None, flip_exclude=()):
+    """Uncertainty metrics for one image from low-threshold predictions."""
+    xyxy = xywh2xyxy(xywhn)
+    margin = class_margins(cls, xyxy, conf)
+    keep = conf >= min_conf
+    below = conf[~keep]
+    u_box = float((1 - margin[keep].clip(0, 1)).max()) if keep.any() else 0.0
+    u_missed = float(below.max()) if len(below) else 0.0
+    disagree = 0.0
+    if flip is not None:
+        fcls, fxywhn, fconf = flip
+        fk = fconf >= min_conf
+        fxyxy = xywh2xyxy(fxywhn[fk])
+        fxyxy[:, [0, 2]] = 1 - fxyxy[:, [2, 0]]
+        disagree = flip_disagreement((cls[keep], xyxy[keep]), (fcls[fk], fxyxy), flip_exclude)
+    return {
+        "boxes": [[int(c), *[round(float(v), 6) for v in box], round(float(p), 5)]
+                  for c, box, p in zip(cls[keep], xywhn[keep], conf[keep])],
+        "max_conf": round(float(conf[keep].max()), 5) if keep.any() else 0.0,
+        "min_margin": round(float(margin[keep].min()), 5) if keep.any() else 0.0,
+        "missed": round(u_missed, 5),
+        "disagree": round(disagree, 4),
+        "score": round(max(u_box, u_missed, disagree), 5),
+    }
+
+
+def decide(rec, accept_conf, accept_margin, accept_empty=False):
+    boxes = rec["boxes"]
+    if not boxes:
+        return "accepted" if accept_empty and rec["missed"] == 0 else "review"
+    ok = (min(b[5] for b in boxes) >= accept_conf and rec["min_margin"] >= accept_margin
+          and rec["disagree"] == 0 and rec["missed"] == 0)
+    return "accepted" if ok else "review"
+
+
+def write_pseudo(rec, dest, mode="link"):
+    img = Path(rec["image"])
+    img_dir = Path(dest) / "images" / PSEUDO_SPLIT
+    lbl_dir = Path(dest) / "labels" / PSEUDO_SPLIT
+    img_dir.mkdir(parents=True, exist_ok=True)
+    lbl_dir.mkdir(parents=True, exist_ok=True)
+    place_file(img, img_dir / img.name, mode)
+    write_atomic(lbl_dir / f"{img.stem}.txt",
+                 "".join(f"{b[0]} {' '.join(f'{v:.6f}' for v in b[1:5])}\n" for b in rec["boxes"]))
+
+
+def remove_pseudo(rec, dest):
+    """Drop an image from the pseudo split (it was accepted in an earlier round)."""
+    img = Path(rec["image"])
+    for p in (Path(dest) / "images" / PSEUDO_SPLIT / img.name,
+              Path(dest) / "labels" / PSEUDO_SPLIT / f"{img.stem}.txt"):
+        p.unlink(missing_ok=True)
+
+
+def write_review(records, work_dir, names):
+    """
+    Review queue CSV (most uncertain first) plus pre-annotation txt files,
+    rewritten from the current records; files of images no longer queued are removed.
+    """
+    work_dir = Path(work_dir)
+    lbl_dir = work_dir / "review" / "labels"
+    lbl_dir.mkdir(parents=True, exist_ok=True)
+    queue = sorted((r for r in records.values() if r["status"] == "review"),
+                   key=lambda r: -r["score"])
+    queued = {Path(r["image"]).stem for r in queue}
+    for old in lbl_dir.glob("*.txt"):
+        if old.stem not in queued:
+            old.unlink()
+    with open(work_dir / "review_queue.csv", "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["rank", "image", "score", "max_conf", "min_margin", "missed", "disagree",
+                    "classes"])
+        for i, r in enumerate(queue, 1):
+            classes = sorted({names[b[0]] for b in r["boxes"]})
+            w.writerow([i, r["image"], r["score"], r["max_conf"], r["min_margin"], r["missed"],
+                        r["disagree"], " ".join(classes)])
+            write_atomic(lbl_dir / f"{Path(r['image']).stem}.txt", "".join(
+                f"{b[0]} {' '.join(f'{v:.6f}' for v in b[1:5])} {b[5]:.5f}\n"
+                for b in r["boxes"]))
+    return len(queue)
+
+
+def run_round(model, pool_dir, work_dir, dest, min_conf=0.25, cand_conf=0.05,
+              accept_conf=0.7, accept_margin=0.3, accept_empty=False, flip_tta=False,
+              flip_exclude=(), imgsz=640, device=None, batch=16, threads=4, mode="link"):
+    """Score the new images of the pool, append them to the manifest. Returns counts."""
+    work_dir = Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    records = load_manifest(work_dir)
+    todo = pending_images(pool_dir, records)
+    print(f"🔎 {len(todo)} new images to score ({len(records)} already in the manifest)")
+    counts = {"scored": 0, "accepted": 0, "review": 0}
+    if not todo:
+        return records, counts
+
+    device = select_device(device)
+    # the decoder yields stems; map them back to paths
+    by_stem = {Path(p).stem: p for p in todo}
+    q = start_decoder(todo, threads=threads, max_queue=batch * 4)
+    with open(work_dir / MANIFEST, "a") as mf:
+        for items in dynamic_batches(q, max_batch=batch):
+            ims = [im for _, im, _ in items]
+            if flip_tta:
+                ims = ims + [cv2.flip(im, 1) for im in ims]
+            results = model.predict(ims, conf=cand_conf, imgsz=imgsz, device=device,
+                                    verbose=False)
+            for k, (stem, _, _) in enumerate(items):
+                cls, xywhn, conf = result_rows(results[k])
+                flip = result_rows(results[k + len(items)]) if flip_tta else None
+                rec = score_image(cls, xywhn, conf, min_conf, flip, flip_exclude)
+                path = by_stem[stem]
+                rec.update({"image": path, "sig": _sig(path)})
+                rec["status"] = decide(rec, accept_conf, accept_margin, accept_empty)
+                if rec["status"] == "accepted":
+                    write_pseudo(rec, dest, mode)
+                elif records.get(path, {}).get("status") == "accepted":
+                    remove_pseudo(rec, dest)
+                mf.write(json.dumps(rec) + "\n")
+                records[path] = rec
+                counts["scored"] += 1
+                counts[rec["status"]] += 1
+            mf.flush()
+    return records, counts
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Incremental pseudo-labelling with uncertainty ranking.")
+    ap.add_argument("--model", required=True, help="Path to best.pt")
+    ap.add_argument("--pool", required=True, help="Folder of unlabeled images (e.g. new_car_images)")
+    ap.add_argument("--work", default=None, help="Work folder (default: runs/active/<pool name>)")
+    ap.add_argument("--dest", default=None,
+                    help="Dataset root that receives images|labels/pseudo (default: <work>)")
+    ap.add_argument("--min-conf", type=float, default=0.25, help="Boxes below this are not labels")
+    ap.add_argument("--accept-conf", type=float, default=0.7, help="Every box must reach this conf")
+    ap.add_argument("--accept-margin", type=float, default=0.3,
+                    help="Min gap to the best overlapping box of another class")
+    ap.add_argument("--accept-empty", action="store_true",
+                    help="Auto-accept images with no detections as background")
+    ap.add_argument("--flip-tta", action="store_true", help="Also score flip disagreement")
+    ap.add_argument("--flip-exclude", nargs="*", default=["keep_right"],
+                    help="Class names left out of the flip comparison")
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--batch", type=int, default=16)
+    ap.add_argument("--threads", type=int, default=min(8, os.cpu_count() or 1))
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--copy", action="store_true", help="Copy accepted images instead of linking")
+    args = ap.parse_args()
+
+    from ultralytics import YOLO
+
+    model = YOLO(args.model)
+    names = model.names
+    work = Path(args.work) if args.work else Path("runs/active") / Path(args.pool).name
+    dest = Path(args.dest) if args.dest else work
+    name_to_id = {v: k for k, v in names.items()}
+    unknown = [n for n in args.flip_exclude if n not in name_to_id]
+    if unknown:
+        print(f"[WARN] --flip-exclude names not in the model: {unknown}")
+    exclude = [name_to_id[n] for n in args.flip_exclude if n in name_to_id]
+
+    records, counts = run_round(
+        model, args.pool, work, dest, min_conf=args.min_conf, accept_conf=args.accept_conf,
+        accept_margin=args.accept_margin, accept_empty=args.accept_empty,
+        flip_tta=args.flip_tta, flip_exclude=exclude, imgsz=args.imgsz, device=args.device,
+        batch=args.batch, threads=args.threads, mode="copy" if args.copy else "link")
+    n_review = write_review(records, work, names)
+    n_acc = sum(r["status"] == "accepted" for r in records.values())
+
+    print(f"\nThis round: {counts['scored']} scored, {counts['accepted']} accepted, "
+          f"{counts['review']} to review")
+    print(f"Total: {n_acc} in {dest / 'images' / PSEUDO_SPLIT}, {n_review} in the review queue")
+    print(f"✅ Review queue: {work / 'review_queue.csv'}")
+    print("[NOTE] To train on the pseudo split, add its image folder to 'train' in data.yaml.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+
+from label_index import build_index
+from yolo_io import detect_layout, load_names, split_dirs
+
+# Class-balanced sampling at load time, instead of physically duplicating
+# train files (merge_and_oversample.py --oversample). Every epoch draws a
+# weighted sample of `epoch_len` images with replacement:
+#
+#   repeat-factor sampling (LVIS): f_c = fraction of images containing class c,
+#   r_c = max(1, sqrt(t / f_c)) * class_weight[c], and an image's weight is the
+#   max r_c over the classes it contains (1 for background images),
+#   multiplied by a per-source weight picked by filename prefix (e.g. "f1_").
+#
+# Rare classes like speedLimit25/finish get more exposure without extra disk,
+# extra cache entries or longer epochs.
+#
+# Limits: only the sampled index goes through the weights. Mosaic/mixup pull
+# their extra partner images uniformly from the dataset, so with mosaic on,
+# 3 of every 4 tiles are unbalanced and the effective boost is much smaller
+# than expected_exposure() reports (it is exact with mosaic=0 / close_mosaic
+# epochs). Multi-GPU (DDP) runs fall back to the stock shuffled sampler with
+# a warning, since the weighted draw is not sharded across ranks.
+
+
+def presence_matrix(cls_per_image, nc):
+    """(n_images, nc) bool from a list of per-image class-id arrays."""
+    counts = np.array([len(c) for c in cls_per_image])
+    rows = np.repeat(np.arange(len(cls_per_image)), counts)
+    cols = np.concatenate([np.asarray(c, dtype=np.int64).ravel() for c in cls_per_image]) \
+        if len(rows) else np.zeros(0, np.int64)
+    pres = np.zeros((len(cls_per_image), nc), dtype=bool)
+    ok = (cols >= 0) & (cols < nc)
+    pres[rows[ok], cols[ok]] = True
+    return pres
+
+
+def image_weights(presence, names=None, threshold=0.1, class_weights=None,
+                  source_weights=None):
+    """
+    Sampling weight per image. `class_weights` is {class id: factor},
+    `source_weights` is {filename prefix: factor} and needs `names`
+    (file names or paths, in the same order as `presence`).
+    """
+    n, nc = presence.shape
+    freq = presence.sum(0) / max(n, 1)
+    r_c = np.where(freq > 0, np.maximum(1.0, np.sqrt(threshold / np.maximum(freq, 1e-12))), 1.0)
+    for c, w in (class_weights or {}).items():
+        r_c[int(c)] *= w
+    w = np.where(presence.any(1), (presence * r_c).max(1), 1.0)
+    if source_weights:
+        base = [os.path.basename(str(x)) for x in names]
+        for prefix, sw in source_weights.items():
+            w *= np.where([b.startswith(prefix) for b in base], sw, 1.0)
+    return w
+
+
+def expected_exposure(presence, weights, epoch_len):
+    """Expected number of sampled images containing each class per epoch."""
+    p = weights / weights.sum()
+    return (presence * p[:, None]).sum(0) * epoch_len
+
+
+class WeightedEpochSampler:
+    """
+    torch-compatible sampler: a fresh weighted draw of `num_samples` indices
+    each time it is iterated (i.e. every epoch).
+    """
+
+    def __init__(self, weights, num_samples=None, seed=0):
+        self.p = np.asarray(weights, dtype=np.float64) / np.sum(weights)
+        self.num_samples = int(num_samples or len(self.p))
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1
+        return iter(rng.choice(len(self.p), self.num_samples, replace=True, p=self.p).tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+
+class BalancedTrainerMixin:
+    """
+    Replaces the shuffled train dataloader with one driven by
+    WeightedEpochSampler. Settings come from class attributes set by make_trainer().
+    """
+
+    sampler_cfg = {}
+
+    def get_dataloader(self, dataset_path, batch_size=16, rank=0, mode="train"):
+        from ultralytics.utils import RANK
+
+        if mode != "train":
+            return super().get_dataloader(dataset_path, batch_size, rank, mode)
+        if RANK != -1:
+            print("[WARN] balanced sampling is single-process only; DDP run uses the stock shuffled sampler")
+            return super().get_dataloader(dataset_path, batch_size, rank, mode)
+        import torch
+        from ultralytics.data.build import InfiniteDataLoader, seed_worker
+
+        dataset = self.build_dataset(dataset_path, mode, batch_size)
+        cfg = self.sampler_cfg
+        pres = presence_matrix([lb["cls"] for lb in dataset.labels], len(self.data["names"]))
+        w = image_weights(pres, names=dataset.im_files, threshold=cfg.get("threshold", 0.1),
+                          class_weights=cfg.get("class_weights"),
+                          source_weights=cfg.get("source_weights"))
+        epoch_len = cfg.get("epoch_len") or len(dataset)
+        sampler = WeightedEpochSampler(w, epoch_len, seed=self.args.seed)
+
+        exp = expected_exposure(pres, w, epoch_len)
+        names = self.data["names"]
+        print("Balanced sampling, expected images per class per epoch: " +
+              ", ".join(f"{names[c]}={exp[c]:.0f}" for c in range(len(exp))))
+        if self.args.mosaic > 0:
+            print("[NOTE] mosaic partners are drawn uniformly, so real exposure of rare classes is lower")
+
+        generator = torch.Generator()
+        generator.manual_seed(6148914691236517205 + RANK)
+        nw = min(os.cpu_count() or 1, self.args.workers)
+        return InfiniteDataLoader(dataset=dataset, batch_size=batch_size, shuffle=False,
+                                  num_workers=nw, sampler=sampler, pin_memory=False,
+                                  collate_fn=getattr(dataset, "collate_fn", None),
+                                  worker_init_fn=seed_worker, generator=generator)
+
+
+def make_trainer(threshold=0.1, class_weights=None, source_weights=None, epoch_len=None,
+                 base=None):
+    """
+    Trainer class for model.train(trainer=...). `base` lets it stack on another
+    custom trainer, e.g. build_image_cache.make_trainer(shard_dir).
+    """
+    if base is None:
+        from ultralytics.models.yolo.detect import DetectionTrainer
+        base = DetectionTrainer
+    cfg = {"threshold": threshold, "class_weights": class_weights,
+           "source_weights": source_weights, "epoch_len": epoch_len}
+    return type("BalancedTrainer", (BalancedTrainerMixin, base), {"sampler_cfg": cfg})
+
+
+def train_balanced(model, sampler_kwargs=None, **train_kwargs):
+    return model.train(trainer=make_trainer(**(sampler_kwargs or {})), **train_kwargs)
+
+
+def parse_weights(items, key_type=str):
+    out = {}
+    for item in items or []:
+        k, v = item.split("=", 1)
+        out[key_type(k)] = float(v)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Preview class-balanced sampling weights for a split.")
+    ap.add_argument("--root", required=True, help="Dataset root")
+    ap.add_argument("--split", default="train")
+    ap.add_argument("--threshold", type=float, default=0.1, help="Repeat-factor threshold t")
+    ap.add_argument("--class-weight", nargs="+", default=None, metavar="NAME=W",
+                    help="Extra per-class factors, e.g. speedLimit25=2")
+    ap.add_argument("--source-weight", nargs="+", default=None, metavar="PREFIX=W",
+                    help="Per-source factors by filename prefix, e.g. f1_=2")
+    ap.add_argument("--epoch-len", type=int, default=None, help="Images per epoch (default: split size)")
+    args = ap.parse_args()
+
+    root = Path(args.root)
+    names, _ = load_names(root / "data.yaml")
+    _, lbl_dir = split_dirs(root, args.split, detect_layout(root))
+    index, _ = build_index(lbl_dir)
+    pres = np.zeros((len(index), len(names)), dtype=bool)
+    ok = index.cls < len(names)
+    pres[index.row_image()[ok], index.cls[ok]] = True
+
+    cw = {names.index(k): v for k, v in parse_weights(args.class_weight).items()}
+    sw = parse_weights(args.source_weight)
+    w = image_weights(pres, names=index.stems, threshold=args.threshold,
+                      class_weights=cw, source_weights=sw)
+    epoch_len = args.epoch_len or len(index)
+    before = pres.sum(0) * epoch_len / max(len(index), 1)
+    after = expected_exposure(pres, w, epoch_len)
+
+    print(f"{len(index)} labelled images, epoch length {epoch_len}\n")
+    print(f"{'class':<16}{'uniform':>10}{'balanced':>10}")
+    for c, n in enumerate(names):
+        print(f"{n:<16}{before[c]:>10.0f}{after[c]:>10.0f}")
+    print("\n[NOTE] counts assume mosaic=0; mosaic partners are drawn uniformly and dilute the balancing.")
+    print("\nUse it in training with:")
+    print("  from balanced_sampler import train_balanced")
+    print(f"  train_balanced(model, dict(threshold={args.threshold}, class_weights={cw or None}, source_weights={sw or None}), data=..., ...)")
+
+
+if __name__ == "__main__":
+    main()
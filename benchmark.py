@@ -0,0 +1,451 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from yolo_io import (LAYOUT_FLAT, LAYOUT_SPLIT, detect_layout, find_splits, format_rows, list_images,
+                     list_labels, parse_rows, place_file, split_dirs, write_atomic, write_data_yaml)
+
+# Benchmarks for the dataset tools and the CPU predict path.
+#
+#   python benchmark.py gen /tmp/bench_10k --images 10000 --layout split --polygon-frac 0.3
+#   python benchmark.py run /tmp/bench_10k --out bench/base.json --model best.onnx
+#   python benchmark.py compare bench/base.json bench/new.json --threshold 0.1
+#
+# gen writes a synthetic dataset (tiny shared JPEG payloads, random box and
+# polygon rows, a fraction of unlabeled images) in either layout, in parallel,
+# so 1M-image trees take minutes rather than hours.
+#
+# run times, on a fresh work copy each repeat (labels copied, images
+# hardlinked; the copy is not timed):
+#   tool/*   the tools end to end: filter_split, remap_split (both layouts),
+#            copy_split, cleanup_split, dataset_engine, label_index (cold/warm)
+#   stage/*  the shared steps they are made of: listing, reading, parsing,
+#            formatting + atomic writes, copying / linking images
+#   infer/*  CPU inference (.onnx / OpenVINO via cpu_runtime, .pt via
+#            ultralytics) for every --imgsz x --batch, p50/p99 per batch, img/s
+# Each entry keeps the per-repeat times and its median; results go to JSON
+# together with the machine, git revision and dataset description.
+#
+# compare flags entries whose median got slower than the baseline by more
+# than --threshold and exits non-zero if there are any.
+
+NAMES = ["stop", "yield", "no_through", "keep_right", "speedLimit25", "finish"]
+SPLIT_FRACS = {"train": 0.8, "valid": 0.15, "test": 0.05}
+
+
+# ---- gen --------------------------------------------------------------------
+
+def synth_jpeg(size, seed=0):
+    rng = np.random.default_rng(seed)
+    im = cv2.GaussianBlur(rng.integers(0, 255, (size, size, 3), dtype=np.uint8), (7, 7), 0)
+    return cv2.imencode(".jpg", im, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+
+
+def synth_label(rng, nc, max_boxes, polygon_frac):
+    rows = []
+    for _ in range(rng.integers(1, max_boxes + 1)):
+        c = int(rng.integers(0, nc))
+        cx, cy = rng.uniform(0.1, 0.9, 2)
+        w, h = rng.uniform(0.02, 0.2, 2)
+        if rng.random() < polygon_frac:
+            k = int(rng.integers(4, 12))
+            a = np.sort(rng.uniform(0, 2 * np.pi, k))
+            pts = np.stack([cx + w / 2 * np.cos(a), cy + h / 2 * np.sin(a)], 1).clip(0, 1)
+            rows.append((c, [f"{v:.6f}" for v in pts.ravel()]))
+        else:
+            rows.append((c, [f"{v:.6f}" for v in (cx, cy, w, h)]))
+    return format_rows(rows)
+
+
+def _gen_chunk(task):
+    img_dir, lbl_dir, prefix, start, n, seed, nc, max_boxes, polygon_frac, unlabeled_frac, jpg = task
+    rng = np.random.default_rng([seed, start])
+    for i in range(start, start + n):
+        stem = f"{prefix}{i:07d}"
+        with open(img_dir / f"{stem}.jpg", "wb") as f:
+            f.write(jpg)
+        if rng.random() >= unlabeled_frac:
+            with open(lbl_dir / f"{stem}.txt", "w") as f:
+                f.write(synth_label(rng, nc, max_boxes, polygon_frac))
+    return n
+
+
+def gen_dataset(out, n_images, layout=LAYOUT_FLAT, nc=6, max_boxes=4, polygon_frac=0.0,
+                unlabeled_frac=0.02, img_size=64, seed=0, workers=None, chunk=2000):
+    out = Path(out)
+    jpg = synth_jpeg(img_size, seed)
+    tasks = []
+    for sp, frac in SPLIT_FRACS.items():
+        n = max(1, int(round(n_images * frac)))
+        img_dir, lbl_dir = split_dirs(out, sp, layout)
+        img_dir.mkdir(parents=True, exist_ok=True)
+        lbl_dir.mkdir(parents=True, exist_ok=True)
+        tasks += [(img_dir, lbl_dir, f"{sp}_", s, min(chunk, n - s), seed, nc, max_boxes,
+                   polygon_frac, unlabeled_frac, jpg) for s in range(0, n, chunk)]
+    with Pool(workers or os.cpu_count() or 1) as pool:
+        total = sum(pool.imap_unordered(_gen_chunk, tasks))
+    names = NAMES if nc == len(NAMES) else [f"c{i}" for i in range(nc)]
+    write_data_yaml(out, {}, layout, list(SPLIT_FRACS), names)
+    meta = {"images": total, "layout": layout, "nc": nc, "max_boxes": max_boxes,
+            "polygon_frac": polygon_frac, "unlabeled_frac": unlabeled_frac, "img_size": img_size,
+            "seed": seed}
+    with open(out / "bench_meta.json", "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+# ---- work copies ------------------------------------------------------------
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def prepare_copy(src, dst, layout):
+    """dst = src in `layout`; labels are real copies (tools rewrite them), images hardlinks."""
+    src, dst = Path(src), Path(dst)
+    if dst.exists():
+        shutil.rmtree(dst)
+    src_layout = detect_layout(src)
+    for sp in find_splits(src, src_layout):
+        si, sl = split_dirs(src, sp, src_layout)
+        di, dl = split_dirs(dst, sp, layout)
+        di.mkdir(parents=True, exist_ok=True)
+        dl.mkdir(parents=True, exist_ok=True)
+        for e in os.scandir(si):
+            _link_or_copy(e.path, di / e.name)
+        for e in os.scandir(sl):
+            if e.name.endswith(".txt"):
+                shutil.copyfile(e.path, dl / e.name)
+    if (src / "data.yaml").exists():
+        shutil.copyfile(src / "data.yaml", dst / "data.yaml")
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null), contextlib.redirect_stderr(null):
+        yield
+
+
+def timed(fn, repeat=3, setup=None):
+    """Per-repeat seconds of fn(), with setup() run untimed before each repeat."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with quiet():
+            t = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t)
+    return times
+
+
+def entry(times, items=None, **extra):
+    med = float(np.median(times))
+    out = {"median_s": round(med, 5), "min_s": round(min(times), 5),
+           "runs": [round(t, 5) for t in times]}
+    if items:
+        out["items"] = items
+        out["items_per_s"] = round(items / med, 1) if med else None
+    out.update(extra)
+    return out
+
+
+# ---- tools ------------------------------------------------------------------
+
+def bench_tools(data, work, tools, repeat=3, workers=None):
+    """tool/<name> entries, each run on a fresh work copy in the layout the tool expects."""
+    from dataset_engine import build_ops, transform_dataset
+    from filter_yolo_dataset import ensure_dirs, filter_split
+    from label_index import build_index, index_dir_for
+    from merge_and_oversample import copy_split
+    import ramap_ids_difformat
+    import remap_ids
+    from remove_unlabeled import cleanup_split
+
+    data, work = Path(data), Path(work)
+    layout = detect_layout(data)
+    splits = find_splits(data, layout)
+    n = sum(len(list_images(split_dirs(data, sp, layout)[0])) for sp in splits)
+    src, out = work / "src", work / "out"
+
+    def reset(lay):
+        def setup():
+            prepare_copy(data, src, lay)
+            if out.exists():
+                shutil.rmtree(out)
+        return setup
+
+    def run_filter():
+        ensure_dirs(out, splits)
+        for sp in splits:
+            filter_split(src, out, sp, {0, 1})
+
+    def run_copy():
+        for sp in splits:
+            copy_split(str(src), str(out), sp, oversample=2)
+
+    def run_engine():
+        ops, _ = build_ops(NAMES, remap=remap_ids.OLD_TO_NEW, new_names=remap_ids.NEW_CLASS_NAMES,
+                           to_bbox=True)
+        transform_dataset(src, ops, workers=workers)
+
+    def drop_index():
+        for sp in splits:
+            shutil.rmtree(index_dir_for(split_dirs(src, sp, LAYOUT_FLAT)[1]), ignore_errors=True)
+
+    def run_index():
+        for sp in splits:
+            build_index(split_dirs(src, sp, LAYOUT_FLAT)[1], workers=workers, verbose=False)
+
+    table = {
+        "filter": (LAYOUT_SPLIT, run_filter),
+        "remap": (LAYOUT_FLAT, lambda: [remap_ids.remap_split(src, sp) for sp in splits]),
+        "remap_difformat": (LAYOUT_SPLIT, lambda: [ramap_ids_difformat.remap_split(src, sp) for sp in splits]),
+        "copy": (LAYOUT_SPLIT, run_copy),
+        "cleanup": (LAYOUT_SPLIT, lambda: [cleanup_split(src, sp) for sp in splits]),
+        "engine": (layout, run_engine),
+        "index_cold": (LAYOUT_FLAT, run_index),
+    }
+    results = {}
+    for name in tools:
+        if name == "index_warm":
+            prepare_copy(data, src, LAYOUT_FLAT)
+            with quiet():
+                run_index()
+            times = timed(run_index, repeat)
+        elif name == "index_cold":
+            prepare_copy(data, src, LAYOUT_FLAT)
+            times = timed(run_index, repeat, setup=drop_index)
+        else:
+            lay, fn = table[name]
+            times = timed(fn, repeat, setup=reset(lay))
+        results[f"tool/{name}"] = entry(times, n)
+        print(f"  tool/{name:<16} {np.median(times):8.3f} s  ({n / np.median(times):,.0f} img/s)")
+    shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+# ---- stages -----------------------------------------------------------------
+
+def bench_stages(data, work, repeat=3, max_files=20000):
+    """stage/<name> entries for the steps the tools share."""
+    data, work = Path(data), Path(work)
+    layout = detect_layout(data)
+    splits = find_splits(data, layout)
+    dirs = [split_dirs(data, sp, layout) for sp in splits]
+    lbl_files = [p for _, ld in dirs for p in list_labels(ld).values()][:max_files]
+    img_files = [p for idir, _ in dirs for p in list_images(idir).values()][:max_files]
+    texts = []
+
+    def read():
+        texts[:] = [Path(p).read_text() for p in lbl_files]
+
+    read()
+    parsed = [parse_rows(t) for t in texts]
+    wdir = work / "stage"
+
+    def fresh():
+        shutil.rmtree(wdir, ignore_errors=True)
+        wdir.mkdir(parents=True)
+
+    def write():
+        for i, rows in enumerate(parsed):
+            write_atomic(wdir / f"{i}.txt", format_rows(rows))
+
+    def place(mode):
+        def fn():
+            for i, p in enumerate(img_files):
+                place_file(p, wdir / f"{i}{Path(p).suffix}", mode)
+        return fn
+
+    stages = {
+        "list": (lambda: [(list_images(i), list_labels(ld)) for i, ld in dirs], None,
+                 sum(len(list_images(i)) for i, _ in dirs)),
+        "read_labels": (read, None, len(lbl_files)),
+        "parse": (lambda: [parse_rows(t) for t in texts], None, len(texts)),
+        "format_write": (write, fresh, len(parsed)),
+        "place_copy": (place("copy"), fresh, len(img_files)),
+        "place_link": (place("link"), fresh, len(img_files)),
+    }
+    results = {}
+    for name, (fn, setup, n) in stages.items():
+        times = timed(fn, repeat, setup)
+        results[f"stage/{name}"] = entry(times, n)
+        print(f"  stage/{name:<15} {np.median(times):8.3f} s  ({n / np.median(times):,.0f} files/s)")
+    shutil.rmtree(wdir, ignore_errors=True)
+    return results
+
+
+# ---- inference --------------------------------------------------------------
+
+def bench_inference(model_path, imgsz_list, batch_list, iters=20, warmup=3, images=None, device="cpu"):
+    """infer/<model>/<imgsz>/b<batch> entries; times are per batch."""
+    if images:
+        from predict_stream import list_source
+        _, files = list_source(images)
+        frames = [cv2.imread(f) for f in files[:max(batch_list)]]
+    else:
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 255, (720, 1280, 3), dtype=np.uint8) for _ in range(max(batch_list))]
+
+    if Path(model_path).suffix == ".pt":
+        from ultralytics import YOLO
+        model = YOLO(model_path)
+    else:
+        from cpu_runtime import load_detector
+        model = load_detector(model_path)
+    from tiled_predict import run_detector
+
+    results = {}
+    tag = Path(model_path).name
+    for imgsz in imgsz_list:
+        for b in batch_list:
+            ims = [frames[i % len(frames)] for i in range(b)]
+            key = f"infer/{tag}/{imgsz}/b{b}"
+            try:
+                for _ in range(warmup):
+                    run_detector(model, ims, 0.25, imgsz, device)
+                lat = []
+                for _ in range(iters):
+                    t = time.perf_counter()
+                    run_detector(model, ims, 0.25, imgsz, device)
+                    lat.append(time.perf_counter() - t)
+            except Exception as e:
+                results[key] = {"error": f"{type(e).__name__}: {e}"}
+                print(f"  {key:<32} [WARN] {type(e).__name__}")
+                continue
+            ms = np.array(lat) * 1000
+            results[key] = entry(lat, b, p50_ms=round(float(np.percentile(ms, 50)), 2),
+                                 p99_ms=round(float(np.percentile(ms, 99)), 2),
+                                 images_per_s=round(b * len(lat) / sum(lat), 2))
+            print(f"  {key:<32} p50 {np.percentile(ms, 50):8.1f} ms  {results[key]['images_per_s']:8.1f} img/s")
+    return results
+
+
+# ---- run / compare ----------------------------------------------------------
+
+def machine_info():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        rev = None
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpu": platform.processor() or platform.machine(), "cpus": os.cpu_count(),
+            "git": rev, "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def compare(base, cur, threshold=0.1):
+    """Rows (key, base median, current median, ratio, flag) for keys in both files."""
+    rows = []
+    for key in sorted(base["results"].keys() & cur["results"].keys()):
+        b, c = base["results"][key], cur["results"][key]
+        if "median_s" not in b or "median_s" not in c:
+            continue
+        ratio = c["median_s"] / b["median_s"] if b["median_s"] else float("inf")
+        flag = "REGRESSION" if ratio > 1 + threshold else ("faster" if ratio < 1 - threshold else "")
+        rows.append((key, b["median_s"], c["median_s"], ratio, flag))
+    return rows
+
+
+TOOLS = ["filter", "remap", "remap_difformat", "copy", "cleanup", "engine", "index_cold", "index_warm"]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmarks for the dataset tools and CPU inference.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    g = sub.add_parser("gen", help="Generate a synthetic YOLO dataset")
+    g.add_argument("out")
+    g.add_argument("--images", type=int, default=10000)
+    g.add_argument("--layout", choices=[LAYOUT_FLAT, LAYOUT_SPLIT], default=LAYOUT_FLAT)
+    g.add_argument("--nc", type=int, default=len(NAMES))
+    g.add_argument("--max-boxes", type=int, default=4, help="Rows per label file: 1..N")
+    g.add_argument("--polygon-frac", type=float, default=0.0, help="Fraction of polygon rows")
+    g.add_argument("--unlabeled-frac", type=float, default=0.02)
+    g.add_argument("--img-size", type=int, default=64, help="Side of the shared JPEG payload")
+    g.add_argument("--seed", type=int, default=0)
+    g.add_argument("--workers", type=int, default=None)
+
+    r = sub.add_parser("run", help="Time tools, stages and inference")
+    r.add_argument("data", nargs="?", default=None, help="Dataset root (from gen)")
+    r.add_argument("--out", required=True, help="Results JSON")
+    r.add_argument("--tools", nargs="*", default=TOOLS, choices=TOOLS)
+    r.add_argument("--no-stages", action="store_true")
+    r.add_argument("--repeat", type=int, default=3)
+    r.add_argument("--work", default=None, help="Scratch folder (default: <data>_bench_work)")
+    r.add_argument("--workers", type=int, default=None)
+    r.add_argument("--model", nargs="*", default=[], help=".onnx / *_openvino_model / .pt to time")
+    r.add_argument("--imgsz", type=int, nargs="+", default=[320, 480, 640])
+    r.add_argument("--batch", type=int, nargs="+", default=[1, 4, 8])
+    r.add_argument("--iters", type=int, default=20)
+    r.add_argument("--images", default=None, help="Real images for inference (default: random frames)")
+    r.add_argument("--device", default="cpu")
+
+    c = sub.add_parser("compare", help="Flag regressions against a baseline")
+    c.add_argument("baseline")
+    c.add_argument("current")
+    c.add_argument("--threshold", type=float, default=0.1, help="Allowed slowdown (0.1 = 10%%)")
+    args = ap.parse_args()
+
+    if args.cmd == "gen":
+        t = time.perf_counter()
+        meta = gen_dataset(args.out, args.images, args.layout, args.nc, args.max_boxes, args.polygon_frac,
+                           args.unlabeled_frac, args.img_size, args.seed, args.workers)
+        print(f"✅ {meta['images']} images ({args.layout}) in {time.perf_counter() - t:.1f}s -> {args.out}")
+        return
+
+    if args.cmd == "compare":
+        with open(args.baseline, "r") as f:
+            base = json.load(f)
+        with open(args.current, "r") as f:
+            cur = json.load(f)
+        rows = compare(base, cur, args.threshold)
+        print(f"{'benchmark':<36} {'base s':>10} {'now s':>10} {'ratio':>7}")
+        for key, b, n, ratio, flag in rows:
+            print(f"{key:<36} {b:10.4f} {n:10.4f} {ratio:7.2f}  {flag}")
+        bad = [row for row in rows if row[4] == "REGRESSION"]
+        if base.get("dataset") != cur.get("dataset"):
+            print("[WARN] the two runs used different datasets")
+        if bad:
+            print(f"\n[WARN] {len(bad)} regression(s) over {args.threshold:.0%}")
+            raise SystemExit(1)
+        print("\n✅ No regressions")
+        return
+
+    os.environ.setdefault("TQDM_DISABLE", "1")
+    results, dataset = {}, None
+    if args.data:
+        data = Path(args.data)
+        meta_path = data / "bench_meta.json"
+        dataset = json.loads(meta_path.read_text()) if meta_path.exists() else {"root": str(data)}
+        work = Path(args.work) if args.work else data.with_name(data.name + "_bench_work")
+        if args.tools:
+            results.update(bench_tools(data, work, args.tools, args.repeat, args.workers))
+        if not args.no_stages:
+            results.update(bench_stages(data, work, args.repeat))
+    for m in args.model:
+        results.update(bench_inference(m, args.imgsz, args.batch, args.iters, images=args.images,
+                                       device=args.device))
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({"machine": machine_info(), "dataset": dataset, "results": results}, f, indent=2)
+    print(f"\n✅ Results in {out}")
+
+
+if __name__ == "__main__":
+    main()
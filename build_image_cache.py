@@ -0,0 +1,212 @@
+import argparse
+import json
+import math
+import os
+from multiprocessing import Pool
+from pathlib import Path
+
+import cv2
+import numpy as np
+import yaml
+from tqdm import tqdm
+from ultralytics.data import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+
+from label_cache import get_img_files
+
+# Decodes every training/validation image once, resized for the training imgsz,
+# and stores the pixels in a few large uint8 shard files that are memory-mapped
+# at train time. Each epoch then reads raw pixels instead of decoding and
+# resizing ~6.5k JPEGs again (model/args.yaml: cache: false, workers: 0).
+#
+# Images are resized exactly like the trainer's own load_image() (long side to
+# imgsz, INTER_LINEAR, BGR), so mosaic/letterbox/augmentations downstream see
+# the same input they would have produced themselves.
+#
+# Layout of <out>/:
+#   shard_00000.bin ...   raw HxWx3 uint8 pixels back to back
+#   index.npz             im_files, shard, offset, h, w, h0, w0 per image
+#   meta.json             imgsz, shard count
+#
+# Training with it:
+#   from build_image_cache import train_with_shards
+#   train_with_shards(YOLO("yolov8n.pt"), "<out>", data=DATA_YAML, imgsz=640, ...)
+
+SHARD_BYTES = 1 << 30
+
+
+def load_resized(path, imgsz):
+    """Same resize as ultralytics BaseDataset.load_image(rect_mode=True)."""
+    im = cv2.imread(path)
+    if im is None:
+        return path, None, None
+    h0, w0 = im.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = (min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz))
+        im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    return path, np.ascontiguousarray(im), (h0, w0)
+
+
+def _load_task(args):
+    return load_resized(*args)
+
+
+def build_shards(im_files, out_dir, imgsz=640, workers=None, shard_bytes=SHARD_BYTES):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for old in out_dir.glob("shard_*.bin"):
+        old.unlink()
+
+    cols = {k: [] for k in ("im_files", "shard", "offset", "h", "w", "h0", "w0")}
+    shard, offset, f = 0, 0, None
+    skipped = 0
+    try:
+        f = open(out_dir / f"shard_{shard:05d}.bin", "wb")
+        with Pool(workers or os.cpu_count() or 1) as pool:
+            it = pool.imap(_load_task, [(p, imgsz) for p in im_files], chunksize=16)
+            for path, im, hw0 in tqdm(it, total=len(im_files), desc="decoding"):
+                if im is None:
+                    skipped += 1
+                    continue
+                if offset and offset + im.nbytes > shard_bytes:
+                    f.close()
+                    shard, offset = shard + 1, 0
+                    f = open(out_dir / f"shard_{shard:05d}.bin", "wb")
+                f.write(im.tobytes())
+                for k, v in (("im_files", path), ("shard", shard), ("offset", offset),
+                             ("h", im.shape[0]), ("w", im.shape[1]),
+                             ("h0", hw0[0]), ("w0", hw0[1])):
+                    cols[k].append(v)
+                offset += im.nbytes
+    finally:
+        if f:
+            f.close()
+
+    np.savez(out_dir / "index.npz",
+             im_files=np.array(cols["im_files"], dtype=str),
+             shard=np.array(cols["shard"], dtype=np.int32),
+             offset=np.array(cols["offset"], dtype=np.int64),
+             **{k: np.array(cols[k], dtype=np.int32) for k in ("h", "w", "h0", "w0")})
+    with open(out_dir / "meta.json", "w") as fm:
+        json.dump({"imgsz": imgsz, "n_shards": shard + 1, "n_images": len(cols["im_files"])}, fm)
+    return len(cols["im_files"]), skipped
+
+
+class ShardStore:
+    """Read-only view of a shard directory. Shards are memory-mapped lazily."""
+
+    def __init__(self, shard_dir):
+        self.shard_dir = Path(shard_dir)
+        with open(self.shard_dir / "meta.json", "r") as f:
+            self.meta = json.load(f)
+        z = np.load(self.shard_dir / "index.npz")
+        self.shard, self.offset = z["shard"], z["offset"]
+        self.h, self.w, self.h0, self.w0 = z["h"], z["w"], z["h0"], z["w0"]
+        self.pos = {str(p): i for i, p in enumerate(z["im_files"])}
+        self._maps = {}
+
+    @property
+    def imgsz(self):
+        return self.meta["imgsz"]
+
+    def __getstate__(self):
+        # dataloader workers re-open their own memmaps
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+    def get(self, j):
+        """(image copy, (h0, w0)). A copy, because the augmentations write in place."""
+        s = int(self.shard[j])
+        mm = self._maps.get(s)
+        if mm is None:
+            mm = self._maps[s] = np.memmap(self.shard_dir / f"shard_{s:05d}.bin",
+                                           dtype=np.uint8, mode="r")
+        h, w = int(self.h[j]), int(self.w[j])
+        a = int(self.offset[j])
+        im = np.array(mm[a:a + h * w * 3]).reshape(h, w, 3)
+        return im, (int(self.h0[j]), int(self.w0[j]))
+
+
+class ShardedYOLODataset(YOLODataset):
+    """YOLODataset whose load_image() reads from a ShardStore when it can."""
+
+    @classmethod
+    def wrap(cls, dataset, store):
+        # swap the class of the dataset the trainer already built, rather
+        # than re-implementing build_yolo_dataset's argument list here
+        dataset.__class__ = cls
+        dataset.shards = store
+        return dataset
+
+    def load_image(self, i, rect_mode=True):
+        j = self.shards.pos.get(self.im_files[i]) if rect_mode else None
+        if j is None or self.ims[i] is not None:
+            return super().load_image(i, rect_mode)
+        im, hw0 = self.shards.get(j)
+        if self.augment:
+            self.buffer.append(i)
+            if len(self.buffer) >= self.max_buffer_length:
+                self.buffer.pop(0)
+        return im, hw0, im.shape[:2]
+
+
+class ShardTrainer(DetectionTrainer):
+    shard_dir = None
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        dataset = super().build_dataset(img_path, mode, batch)
+        store = ShardStore(self.shard_dir)
+        if store.imgsz != dataset.imgsz:
+            print(f"[WARN] shards were built for imgsz={store.imgsz}, training uses "
+                  f"{dataset.imgsz}; decoding images as usual.")
+            return dataset
+        return ShardedYOLODataset.wrap(dataset, store)
+
+
+def make_trainer(shard_dir):
+    """DetectionTrainer subclass bound to a shard directory, for model.train(trainer=...)."""
+    return type("ShardTrainer", (ShardTrainer,), {"shard_dir": str(shard_dir)})
+
+
+def train_with_shards(model, shard_dir, **train_kwargs):
+    return model.train(trainer=make_trainer(shard_dir), **train_kwargs)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pre-decode training images into memory-mapped shards.")
+    ap.add_argument("--data", required=True, help="data.yaml used for training")
+    ap.add_argument("--imgsz", type=int, default=640, help="Training imgsz (default: 640)")
+    ap.add_argument("--splits", nargs="+", default=["train", "val"],
+                    help="data.yaml keys to include (default: train val)")
+    ap.add_argument("--out", default=None,
+                    help="Output dir (default: <data.yaml dir>/.image_shards_<imgsz>)")
+    ap.add_argument("--workers", type=int, default=None)
+    args = ap.parse_args()
+
+    data_yaml = Path(args.data)
+    with open(data_yaml, "r") as f:
+        y = yaml.safe_load(f)
+    base = Path(y["path"]) if y.get("path") else data_yaml.parent
+
+    im_files = []
+    for key in args.splits:
+        if not y.get(key):
+            continue
+        src = Path(y[key]) if Path(y[key]).is_absolute() else base / y[key]
+        files = get_img_files(src)
+        print(f"[{key}] {len(files)} images from {src}")
+        im_files.extend(files)
+    im_files = sorted(set(im_files))
+    if not im_files:
+        raise RuntimeError("No images found for the requested splits")
+
+    out = Path(args.out) if args.out else data_yaml.parent / f".image_shards_{args.imgsz}"
+    n, skipped = build_shards(im_files, out, imgsz=args.imgsz, workers=args.workers)
+    size = sum(p.stat().st_size for p in out.glob("shard_*.bin"))
+    print(f"\n✅ {n} images -> {out} ({size / 1e9:.2f} GB, {skipped} unreadable skipped)")
+
+
+if __name__ == "__main__":
+    main()
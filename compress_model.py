@@ -0,0 +1,273 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from export_cpu import time_torch, valid_images, validate
+
+# Structured channel pruning + knowledge distillation for a trained best.pt,
+# to get under the CPU latency yolov8n has at imgsz=640:
+#   1. C2f blocks are swapped for C2f_v2 (cv1 split into cv0/cv1 instead of a
+#      chunk() of one conv) so torch_pruning can prune both halves.
+#   2. Channels are removed in small steps (L2 magnitude, Detect outputs kept)
+#      until the model is under --target-macs (fraction of the original) and/or
+#      --target-ms (measured batch-1 CPU latency of the torch model).
+#   3. The pruned model is fine-tuned on the dataset with the normal detection
+#      loss plus distillation from the original model: BCE on the class logits
+#      and temperature KL on the DFL box distributions, per feature level,
+#      weighted by the teacher's confidence.
+#   4. compress_report.json: params, GFLOPs, CPU latency and valid mAP before
+#      and after.
+#
+# Needs torch-pruning (pip install torch-pruning). The compressed checkpoint
+# pickles C2f_v2 from this module, so load it from this repo (export_cpu.py
+# can export it to ONNX as usual).
+
+
+def _ultralytics_modules():
+    from ultralytics.nn.modules import C2f, Conv, Detect
+    return C2f, Conv, Detect
+
+
+class C2f_v2(nn.Module):
+    """C2f with cv1 split into two convs, same outputs, prunable halves."""
+
+    def __init__(self, c2f):
+        super().__init__()
+        _, Conv, _ = _ultralytics_modules()
+        c1, c = c2f.cv1.conv.in_channels, c2f.c
+        self.c = c
+        self.cv0, self.cv1 = Conv(c1, c, 1, 1), Conv(c1, c, 1, 1)
+        w, bn = c2f.cv1.conv.weight.data, c2f.cv1.bn
+        for k, conv in enumerate((self.cv0, self.cv1)):
+            s = slice(k * c, (k + 1) * c)
+            conv.conv.weight.data = w[s].clone()
+            for a in ("weight", "bias", "running_mean", "running_var"):
+                getattr(conv.bn, a).data = getattr(bn, a).data[s].clone()
+            conv.bn.eps, conv.bn.momentum = bn.eps, bn.momentum
+            conv.act = c2f.cv1.act
+        self.cv2, self.m = c2f.cv2, c2f.m
+        for a in ("i", "f", "type", "np"):  # ultralytics layer routing attributes
+            if hasattr(c2f, a):
+                setattr(self, a, getattr(c2f, a))
+
+    def forward(self, x):
+        y = [self.cv0(x), self.cv1(x)]
+        y.extend(m(y[-1]) for m in self.m)
+        return self.cv2(torch.cat(y, 1))
+
+
+def replace_c2f(module):
+    """Swap every plain C2f (not subclasses like C3k2) for C2f_v2, in place."""
+    C2f, _, _ = _ultralytics_modules()
+    n = 0
+    for name, child in module.named_children():
+        if type(child) is C2f:
+            setattr(module, name, C2f_v2(child))
+            n += 1
+        else:
+            n += replace_c2f(child)
+    return n
+
+
+def count_macs(model, imgsz=640):
+    import torch_pruning as tp
+    model.eval()
+    macs, params = tp.utils.count_ops_and_params(model, torch.randn(1, 3, imgsz, imgsz))
+    return macs, params
+
+
+def torch_latency(model, imgsz=640, warmup=3, iters=15):
+    """Median batch-1 CPU forward ms (no pre/post), for steering the pruning."""
+    model.eval()
+    x = torch.randn(1, 3, imgsz, imgsz)
+    with torch.inference_mode():
+        for _ in range(warmup):
+            model(x)
+        lat = []
+        for _ in range(iters):
+            t = time.perf_counter()
+            model(x)
+            lat.append(time.perf_counter() - t)
+    return float(np.median(lat)) * 1000
+
+
+def prune(model, imgsz=640, target_macs=0.5, target_ms=None, step=0.05, max_ratio=0.8):
+    """
+    Prune in steps of `step` channel ratio until both targets are met (or
+    max_ratio is reached). Returns a list of per-step dicts.
+    """
+    import torch_pruning as tp
+    _, _, Detect = _ultralytics_modules()
+
+    model.eval()
+    for p in model.parameters():
+        p.requires_grad_(True)
+    example = torch.randn(1, 3, imgsz, imgsz)
+    base_macs, _ = tp.utils.count_ops_and_params(model, example)
+    steps = int(round(max_ratio / step))
+    pruner = tp.pruner.MetaPruner(model, example, importance=tp.importance.MagnitudeImportance(p=2),
+                                  iterative_steps=steps, pruning_ratio=max_ratio,
+                                  ignored_layers=[m for m in model.modules() if isinstance(m, Detect)])
+    history = []
+    for k in range(steps):
+        pruner.step()
+        macs, params = tp.utils.count_ops_and_params(model, example)
+        ms = torch_latency(model, imgsz) if target_ms else None
+        history.append({"step": k + 1, "macs_ratio": round(macs / base_macs, 4), "params": int(params),
+                        "torch_ms": round(ms, 2) if ms else None})
+        print(f"  step {k + 1}: MACs {macs / base_macs:.1%} of original, {params / 1e6:.2f}M params"
+              + (f", {ms:.1f} ms" if ms else ""))
+        if macs <= target_macs * base_macs and (not target_ms or ms <= target_ms):
+            break
+    return history
+
+
+# ---- distillation -----------------------------------------------------------
+
+class DistillLoss:
+    """
+    v8DetectionLoss of the student plus dense distillation from a teacher with
+    the same Detect layout (same nc, reg_max and strides).
+    """
+
+    def __init__(self, student, teacher, alpha=1.0, T=2.0):
+        from ultralytics.utils.loss import v8DetectionLoss
+        self.base = v8DetectionLoss(student)
+        self.teacher = teacher
+        self.alpha, self.T = alpha, T
+        self.reg_max = student.model[-1].reg_max
+        self.nc = student.model[-1].nc
+
+    def kd(self, s_feats, t_feats):
+        loss = 0.0
+        for s, t in zip(s_feats, t_feats):
+            b = s.shape[0]
+            s = s.float().view(b, 4 * self.reg_max + self.nc, -1)
+            t = t.float().view(b, 4 * self.reg_max + self.nc, -1)
+            s_box, s_cls = s.split((4 * self.reg_max, self.nc), 1)
+            t_box, t_cls = t.split((4 * self.reg_max, self.nc), 1)
+            t_prob = t_cls.sigmoid()
+            w = t_prob.max(1)[0]  # (b, anchors): focus on where the teacher sees something
+            cls_kd = F.binary_cross_entropy_with_logits(s_cls, t_prob, reduction="none").mean(1)
+            s_dfl = F.log_softmax(s_box.view(b, 4, self.reg_max, -1) / self.T, 2)
+            t_dfl = F.softmax(t_box.view(b, 4, self.reg_max, -1) / self.T, 2)
+            box_kd = (t_dfl * (t_dfl.clamp_min(1e-9).log() - s_dfl)).sum(2).mean(1) * self.T ** 2
+            loss = loss + ((cls_kd + box_kd) * w).sum() / w.sum().clamp_min(1.0)
+        return loss
+
+    def __call__(self, preds, batch):
+        loss, items = self.base(preds, batch)
+        with torch.no_grad():
+            t_out = self.teacher(batch["img"])
+        t_feats = t_out[1] if isinstance(t_out, tuple) else t_out
+        s_feats = preds[1] if isinstance(preds, tuple) else preds
+        kd = self.kd(s_feats, t_feats) * self.alpha * batch["img"].shape[0]
+        return loss.sum() + kd, items
+
+
+def finetune(student, teacher_weights, data, imgsz=640, epochs=30, batch=16, device=None,
+             project="runs/detect", name="compressed", kd=True, alpha=1.0, T=2.0, workers=0):
+    """Train the pruned module with the regular DetectionTrainer (+ KD). Returns best.pt."""
+    from ultralytics import YOLO
+    from ultralytics.models.yolo.detect import DetectionTrainer
+
+    from predict_stream import select_device
+
+    trainer = DetectionTrainer(overrides={"model": str(teacher_weights), "data": str(data), "imgsz": imgsz,
+                                          "epochs": epochs, "batch": batch, "device": select_device(device),
+                                          "project": project, "name": name, "workers": workers,
+                                          "exist_ok": True})
+    trainer.model = student  # setup_model() keeps an nn.Module as is
+
+    if kd:
+        def attach_kd(tr):
+            teacher = YOLO(teacher_weights).model.to(tr.device).float().eval()
+            for p in teacher.parameters():
+                p.requires_grad_(False)
+            # set after the EMA copy was taken, so checkpoints do not carry the teacher
+            tr.model.criterion = DistillLoss(tr.model, teacher, alpha, T)
+
+        trainer.add_callback("on_train_start", attach_kd)
+    trainer.train()
+    return Path(trainer.best)
+
+
+def describe(weights, data, imgsz, files, iters, do_val):
+    from ultralytics import YOLO
+    m = YOLO(str(weights)).model.float()
+    macs, params = count_macs(m, imgsz)
+    mean_ms, p50 = time_torch(str(weights), files, imgsz, iters=iters)
+    row = {"path": str(weights), "params_m": round(params / 1e6, 3), "gflops": round(2 * macs / 1e9, 2),
+           "mean_ms": round(mean_ms, 2), "p50_ms": round(p50, 2)}
+    if do_val:
+        row["map50"], row["map"] = validate(weights, data, imgsz)
+    return row
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Prune best.pt to a MACs/latency budget and recover it with distillation.")
+    ap.add_argument("--weights", required=True, help="Trained best.pt (also the teacher)")
+    ap.add_argument("--data", required=True, help="data.yaml")
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--target-macs", type=float, default=0.5, help="MACs budget as a fraction of the original")
+    ap.add_argument("--target-ms", type=float, default=None, help="Also require this torch CPU latency (ms)")
+    ap.add_argument("--step", type=float, default=0.05, help="Channel ratio removed per pruning step")
+    ap.add_argument("--max-ratio", type=float, default=0.8)
+    ap.add_argument("--epochs", type=int, default=30)
+    ap.add_argument("--batch", type=int, default=16)
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--no-kd", action="store_true", help="Fine-tune without distillation")
+    ap.add_argument("--kd-alpha", type=float, default=1.0)
+    ap.add_argument("--kd-t", type=float, default=2.0, help="Distillation temperature")
+    ap.add_argument("--project", default="runs/detect")
+    ap.add_argument("--name", default="compressed")
+    ap.add_argument("--iters", type=int, default=50, help="Images to time per model")
+    ap.add_argument("--no-val", action="store_true", help="Skip mAP validation in the report")
+    args = ap.parse_args()
+
+    from ultralytics import YOLO
+
+    files = valid_images(args.data)
+    print("📏 Measuring the original model...")
+    before = describe(args.weights, args.data, args.imgsz, files, args.iters, not args.no_val)
+
+    student = YOLO(args.weights).model.float().cpu()
+    print(f"🔧 Replaced {replace_c2f(student)} C2f blocks with C2f_v2")
+    print(f"✂️  Pruning to {args.target_macs:.0%} MACs" + (f" / {args.target_ms} ms" if args.target_ms else ""))
+    history = prune(student, args.imgsz, args.target_macs, args.target_ms, args.step, args.max_ratio)
+
+    print(f"🎓 Fine-tuning {'with' if not args.no_kd else 'without'} distillation...")
+    best = finetune(student, args.weights, args.data, args.imgsz, args.epochs, args.batch, args.device,
+                    args.project, args.name, kd=not args.no_kd, alpha=args.kd_alpha, T=args.kd_t)
+
+    print("📏 Measuring the compressed model...")
+    after = describe(best, args.data, args.imgsz, files, args.iters, not args.no_val)
+    after["speedup"] = round(before["mean_ms"] / after["mean_ms"], 2)
+    if not args.no_val:
+        after["map_drift"] = round(after["map"] - before["map"], 4)
+
+    report = {"imgsz": args.imgsz, "target_macs": args.target_macs, "target_ms": args.target_ms,
+              "kd": not args.no_kd, "before": before, "after": after, "pruning": history}
+    out = best.parent.parent / "compress_report.json"
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'model':<12}{'params M':>10}{'GFLOPs':>8}{'ms/img':>8}{'mAP50':>8}{'mAP50-95':>10}")
+    for name, row in (("original", before), ("compressed", after)):
+        print(f"{name:<12}{row['params_m']:>10.2f}{row['gflops']:>8.1f}{row['mean_ms']:>8.1f}"
+              f"{row.get('map50', float('nan')):>8.3f}{row.get('map', float('nan')):>10.3f}")
+    print(f"\nspeedup x{after['speedup']}" + (f", mAP50-95 drift {after['map_drift']:+.3f}"
+                                             if "map_drift" in after else ""))
+    print(f"✅ Compressed weights: {best}\n✅ Report: {out}")
+
+
+if __name__ == "__main__":
+    # run through the module so pickled C2f_v2 resolves to compress_model.C2f_v2
+    from compress_model import main as _main
+    _main()
@@ -0,0 +1,200 @@
+import ast
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Minimal CPU inference for exported YOLOv8 detectors (ONNX Runtime or
+# OpenVINO). Only numpy + cv2 + the runtime itself are imported, so it starts
+# in a fraction of the time the ultralytics/torch stack needs and can run on
+# the car without torch installed.
+#
+# Pre/post-processing matches ultralytics: letterbox to a square with gray
+# (114) padding, RGB /255 NCHW input; the raw output is (B, 4 + nc, anchors)
+# with xywh boxes in input pixels and per-class scores, followed by
+# class-aware NMS.
+
+
+def letterbox(im, new_shape=640, color=(114, 114, 114)):
+    """Resize keeping aspect ratio and pad to new_shape. Returns (im, r, (dw, dh))."""
+    h, w = im.shape[:2]
+    r = min(new_shape / h, new_shape / w)
+    new_unpad = int(round(w * r)), int(round(h * r))
+    dw, dh = (new_shape - new_unpad[0]) / 2, (new_shape - new_unpad[1]) / 2
+    if (w, h) != new_unpad:
+        im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return im, r, (left, top)
+
+
+def preprocess(ims, imgsz=640):
+    """BGR images -> (N, 3, imgsz, imgsz) float32 blob plus per-image (r, pad)."""
+    blobs, meta = [], []
+    for im in ims:
+        lb, r, pad = letterbox(im, imgsz)
+        blobs.append(lb[:, :, ::-1].transpose(2, 0, 1))
+        meta.append((r, pad, im.shape[:2]))
+    x = np.ascontiguousarray(np.stack(blobs), dtype=np.float32) / 255.0
+    return x, meta
+
+
+def xywh2xyxy(x):
+    y = np.empty_like(x)
+    y[..., 0] = x[..., 0] - x[..., 2] / 2
+    y[..., 1] = x[..., 1] - x[..., 3] / 2
+    y[..., 2] = x[..., 0] + x[..., 2] / 2
+    y[..., 3] = x[..., 1] + x[..., 3] / 2
+    return y
+
+
+def box_iou(a, b):
+    """IoU matrix (len(a), len(b)) for xyxy boxes."""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(-1)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def nms(boxes, scores, iou_thres=0.7, classes=None, max_wh=7680):
+    """
+    Greedy NMS, vectorized per kept box. With `classes`, boxes of different
+    classes never suppress each other (offset trick, same as ultralytics).
+    Returns kept indices sorted by score.
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    b = np.asarray(boxes, dtype=np.float32)
+    if classes is not None:
+        b = b + (np.asarray(classes, dtype=np.float32) * max_wh)[:, None]
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    x1, y1, x2, y2 = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_thres]
+    return np.array(keep, dtype=np.int64)
+
+
+def postprocess(out, meta, conf=0.25, iou=0.7, max_det=300, agnostic=False):
+    """
+    Raw (B, 4 + nc, A) output -> per image (xyxy, conf, cls) in original pixels.
+    """
+    dets = []
+    for pred, (r, (padx, pady), (h0, w0)) in zip(out, meta):
+        pred = pred.T  # (A, 4 + nc)
+        scores = pred[:, 4:]
+        cls = scores.argmax(1)
+        sc = scores[np.arange(len(cls)), cls]
+        m = sc > conf
+        boxes, sc, cls = xywh2xyxy(pred[m, :4]), sc[m], cls[m]
+        keep = nms(boxes, sc, iou, classes=None if agnostic else cls)[:max_det]
+        boxes, sc, cls = boxes[keep], sc[keep], cls[keep]
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - padx) / r).clip(0, w0)
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pady) / r).clip(0, h0)
+        dets.append((boxes, sc.astype(np.float32), cls.astype(np.int64)))
+    return dets
+
+
+def parse_names(names):
+    """{id: name} from ultralytics export metadata (a dict, or its repr as ONNX stores it)."""
+    if isinstance(names, str):
+        try:
+            names = ast.literal_eval(names)
+        except (ValueError, SyntaxError):
+            return {}
+    if isinstance(names, list):
+        names = dict(enumerate(names))
+    return {int(k): str(v) for k, v in names.items()} if isinstance(names, dict) else {}
+
+
+class Detector:
+    """Common pre/post around a backend-specific _infer(x) -> (B, 4 + nc, A)."""
+
+    imgsz = 640
+    fixed_imgsz = None
+    fixed_batch = None
+    names = {}
+
+    def _input_size(self, static, imgsz):
+        """Static exports run at their baked-in size; dynamic ones at imgsz (default 640)."""
+        if static is None:
+            return imgsz or 640
+        if imgsz and imgsz != static:
+            raise ValueError(f"model input is fixed at {static}, cannot run at imgsz={imgsz}")
+        return static
+
+    def __call__(self, ims, conf=0.25, iou=0.7, max_det=300, agnostic=False, imgsz=None):
+        """imgsz overrides the input size per call (dynamic exports only)."""
+        x, meta = preprocess(ims, self._input_size(self.fixed_imgsz, imgsz) if imgsz else self.imgsz)
+        if self.fixed_batch and len(x) != self.fixed_batch:
+            out = np.concatenate([self._infer(x[i:i + 1]) for i in range(len(x))])
+        else:
+            out = self._infer(x)
+        return postprocess(out, meta, conf=conf, iou=iou, max_det=max_det, agnostic=agnostic)
+
+
+class OnnxDetector(Detector):
+    def __init__(self, path, threads=None, imgsz=None):
+        import onnxruntime as ort
+
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = threads or os.cpu_count() or 1
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(str(path), so, providers=["CPUExecutionProvider"])
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.fixed_imgsz = inp.shape[2] if isinstance(inp.shape[2], int) else None
+        self.imgsz = self._input_size(self.fixed_imgsz, imgsz)
+        self.fixed_batch = inp.shape[0] if isinstance(inp.shape[0], int) else None
+        self.names = parse_names(self.session.get_modelmeta().custom_metadata_map.get("names"))
+
+    def _infer(self, x):
+        return self.session.run(None, {self.input_name: x})[0]
+
+
+class OpenVinoDetector(Detector):
+    def __init__(self, path, imgsz=None):
+        import openvino as ov
+
+        path = Path(path)
+        xml = path if path.suffix == ".xml" else next(path.glob("*.xml"))
+        core = ov.Core()
+        self.model = core.compile_model(core.read_model(xml), "CPU")
+        shape = self.model.inputs[0].get_partial_shape()
+        self.fixed_imgsz = shape[2].get_length() if shape[2].is_static else None
+        self.imgsz = self._input_size(self.fixed_imgsz, imgsz)
+        self.fixed_batch = shape[0].get_length() if shape[0].is_static else None
+        meta = xml.parent / "metadata.yaml"
+        if meta.exists():
+            import yaml
+            with open(meta, "r") as f:
+                self.names = parse_names((yaml.safe_load(f) or {}).get("names"))
+
+    def _infer(self, x):
+        return self.model(x)[0]
+
+
+def load_detector(path, threads=None, imgsz=None):
+    """OnnxDetector for .onnx, OpenVinoDetector for an *_openvino_model dir or .xml.
+
+    imgsz sets the input size of dynamic exports; a static export raises
+    ValueError if it differs from the size baked into the model.
+    """
+    path = Path(path)
+    if path.suffix == ".onnx":
+        return OnnxDetector(path, threads=threads, imgsz=imgsz)
+    return OpenVinoDetector(path, imgsz=imgsz)
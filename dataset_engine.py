@@ -0,0 +1,319 @@
+import argparse
+import os
+from collections import Counter, defaultdict
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from label_cache import refresh_caches
+from yolo_io import (LAYOUT_FLAT, detect_layout, find_splits, format_rows, list_images,
+                     list_labels, load_names, parse_rows, place_file, split_dirs,
+                     write_atomic, write_data_yaml)
+
+# One pass over every (image, label) pair of every split, applying a chain of
+# operations. Replaces running remap_ids.py / ramap_ids_difformat.py /
+# filter_yolo_dataset.py / remove_unlabeled.py back to back, each of which
+# re-reads the whole dataset.
+#
+# An op chain is a list of (kind, arg) tuples so it pickles cheaply into the
+# worker processes:
+#   ("remap", {old_id: new_id})  rows with ids not in the dict are dropped
+#   ("keep",  {old_id: new_id})  keep-list filter; ids are compacted so they
+#                                stay in sync with the shortened names list
+#   ("to_bbox", sidecar)         polygon rows -> tight xywh boxes; with sidecar
+#                                the original polygons are kept next to the
+#                                labels in labels/<split>.polygons/<stem>.txt.
+#                                It never drops rows, so on its own it never
+#                                deletes a label or image (background .txt
+#                                files pass through as they are)
+
+_OPS = []
+_OUT_ROOT = None
+_REMOVE_ORPHANS = False
+_PLACE_MODE = "copy"
+
+SIDECAR_SUFFIX = ".polygons"
+
+
+def build_ops(names, remap=None, new_names=None, keep=None, to_bbox=False, sidecar=False):
+    """
+    Turn CLI-level choices into an op chain.
+    Order is remap first, then keep, so --keep names refer to the remapped names,
+    and to_bbox last, so sidecar polygons carry the final class ids.
+    Returns (ops, final_names).
+    """
+    ops = []
+    if remap:
+        ops.append(("remap", dict(remap)))
+        names = list(new_names)
+    if keep:
+        missing = [k for k in keep if k not in names]
+        if missing:
+            raise ValueError(f"These class names are not in the names list: {missing}\n"
+                             f"Found names: {names}")
+        kept = [n for n in names if n in keep]  # preserve original order
+        ops.append(("keep", {names.index(n): i for i, n in enumerate(kept)}))
+        names = kept
+    if to_bbox:
+        ops.append(("to_bbox", bool(sidecar)))
+    return ops, names
+
+
+def polygons_to_bboxes(polys):
+    """
+    Tight normalized xywh boxes for a list of polygon coord-token lists,
+    computed for all polygons of a file at once with reduceat.
+    """
+    lens = np.fromiter((len(p) // 2 for p in polys), dtype=np.int64, count=len(polys))
+    pts = np.array([t for p in polys for t in p], dtype=np.float64).reshape(-1, 2)
+    starts = np.concatenate([[0], np.cumsum(lens)[:-1]])
+    lo = np.minimum.reduceat(pts, starts, axis=0).clip(0, 1)
+    hi = np.maximum.reduceat(pts, starts, axis=0).clip(0, 1)
+    return np.concatenate([(lo + hi) / 2, hi - lo], axis=1)
+
+
+def _is_polygon(coords):
+    return len(coords) >= 6 and len(coords) % 2 == 0
+
+
+def to_bbox_rows(rows, polygons=None):
+    """
+    Replace polygon rows by their tight box. Box rows (and malformed rows) are
+    left as they are and the row count never changes. Converted polygon rows are appended to `polygons` if given.
+    """
+    idx = [i for i, (_, coords) in enumerate(rows) if _is_polygon(coords)]
+    if not idx:
+        return rows
+    try:
+        boxes = polygons_to_bboxes([rows[i][1] for i in idx])
+    except ValueError:
+        return rows  # non-numeric coords; leave the file for the scanners to report
+    rows = list(rows)
+    for i, box in zip(idx, boxes):
+        if polygons is not None:
+            polygons.append(rows[i])
+        rows[i] = (rows[i][0], [f"{v:.6f}" for v in box])
+    return rows
+
+
+def apply_ops(rows, ops, polygons=None):
+    for kind, arg in ops:
+        if kind in ("remap", "keep"):
+            rows = [(arg[cid], coords) for cid, coords in rows if cid in arg]
+        elif kind == "to_bbox":
+            rows = to_bbox_rows(rows, polygons if arg else None)
+    return rows
+
+
+def sidecar_path(lbl_dir, stem):
+    lbl_dir = Path(lbl_dir)
+    return lbl_dir.with_name(lbl_dir.name + SIDECAR_SUFFIX) / f"{stem}.txt"
+
+
+def _write_sidecar(lbl_dir, stem, polygons):
+    if not polygons:
+        return
+    path = sidecar_path(lbl_dir, stem)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(path, format_rows(polygons))
+
+
+def _init_worker(ops, out_root, remove_orphans, place_mode):
+    global _OPS, _OUT_ROOT, _REMOVE_ORPHANS, _PLACE_MODE
+    _OPS, _OUT_ROOT, _REMOVE_ORPHANS, _PLACE_MODE = ops, out_root, remove_orphans, place_mode
+
+
+def _unlink(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _process_pair(task):
+    """
+    Handle one stem of one split. Returns (split, status, stem, changed)
+    where `changed` is True if a file under the dataset was rewritten or removed.
+    """
+    split, stem, img_path, lbl_path = task
+
+    if lbl_path is None:
+        if _OUT_ROOT is None and _REMOVE_ORPHANS:
+            _unlink(img_path)
+            return split, "orphan_image", stem, True
+        return split, "unlabeled", stem, False
+
+    if img_path is None and (_REMOVE_ORPHANS or _OUT_ROOT is not None):
+        if _OUT_ROOT is None:
+            _unlink(lbl_path)
+            return split, "orphan_label", stem, True
+        return split, "orphan_label", stem, False
+
+    with open(lbl_path, "r") as f:
+        text = f.read()
+    rows = parse_rows(text)
+    polygons = []
+    new_rows = apply_ops(rows, _OPS, polygons)
+
+    # only a file the ops actually emptied is dropped; an already-empty label
+    # is a background image and stays as it is
+    emptied = bool(rows) and not new_rows
+
+    if _OUT_ROOT is not None:
+        if emptied:
+            return split, "emptied", stem, False
+        out_img = _OUT_ROOT / "images" / split / img_path.name
+        out_lbl = _OUT_ROOT / "labels" / split / f"{stem}.txt"
+        place_file(img_path, out_img, _PLACE_MODE)
+        write_atomic(out_lbl, format_rows(new_rows))
+        _write_sidecar(out_lbl.parent, stem, polygons)
+        return split, "kept" if rows else "background", stem, True
+
+    if emptied:
+        # remove label file with no relevant objects left (and its image, if asked)
+        _unlink(lbl_path)
+        if _REMOVE_ORPHANS and img_path is not None:
+            _unlink(img_path)
+        return split, "emptied", stem, True
+
+    if new_rows != rows:
+        _write_sidecar(lbl_path.parent, stem, polygons)
+        write_atomic(lbl_path, format_rows(new_rows))
+        return split, "kept", stem, True
+    return split, "unchanged" if rows else "background", stem, False
+
+
+def iter_tasks(root, layout, splits):
+    """Yield (split, stem, img_path, lbl_path) for the union of images and labels."""
+    for sp in splits:
+        img_dir, lbl_dir = split_dirs(root, sp, layout)
+        imgs = list_images(img_dir)
+        lbls = list_labels(lbl_dir)
+        for stem in sorted(imgs.keys() | lbls.keys()):
+            yield sp, stem, imgs.get(stem), lbls.get(stem)
+
+
+def transform_dataset(root, ops, out_root=None, remove_orphans=False, splits=None,
+                      workers=None, chunksize=64, place_mode="copy"):
+    """
+    Run the op chain over every split of `root` in a single streaming pass.
+
+    In-place (out_root=None) label files are rewritten atomically, labels the
+    ops emptied are deleted (already-empty background labels are kept), and with remove_orphans images without labels and
+    labels without images are deleted too.
+    With out_root, kept pairs are written to <out_root>/images|labels/<split>
+    and the source dataset is left untouched; place_mode="link" hardlinks the
+    images instead of copying them.
+
+    Returns (layout, splits, totals, touched) where totals[split] is a Counter
+    of statuses and touched[split] is the set of stems whose files changed.
+    """
+    root = Path(root)
+    layout = detect_layout(root)
+    if layout is None:
+        raise RuntimeError(f"Could not find images/labels folders under {root}")
+    splits = splits or find_splits(root, layout)
+
+    if out_root is not None:
+        out_root = Path(out_root)
+        for sp in splits:
+            (out_root / "images" / sp).mkdir(parents=True, exist_ok=True)
+            (out_root / "labels" / sp).mkdir(parents=True, exist_ok=True)
+
+    tasks = list(iter_tasks(root, layout, splits))
+    totals = defaultdict(Counter)
+    touched = defaultdict(set)
+
+    workers = workers or os.cpu_count() or 1
+    with Pool(workers, initializer=_init_worker,
+              initargs=(ops, out_root, remove_orphans, place_mode)) as pool:
+        results = pool.imap_unordered(_process_pair, tasks, chunksize=chunksize)
+        for split, status, stem, changed in tqdm(results, total=len(tasks),
+                                                 desc="transforming"):
+            totals[split][status] += 1
+            if changed:
+                touched[split].add(stem)
+
+    return layout, splits, totals, touched
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Remap / filter / clean a YOLO dataset in one parallel pass.")
+    ap.add_argument("--root", required=True,
+                    help="Dataset root with data.yaml (images/<split> or <split>/images layout)")
+    ap.add_argument("--remap", action="store_true",
+                    help="Apply OLD_TO_NEW / NEW_CLASS_NAMES from remap_ids.py")
+    ap.add_argument("--keep", nargs="+", default=None,
+                    help="Class names to keep (after --remap, if given)")
+    ap.add_argument("--to-bbox", action="store_true",
+                    help="Convert polygon rows to tight bounding boxes")
+    ap.add_argument("--polygon-sidecar", action="store_true",
+                    help="With --to-bbox, keep the original polygons in labels/<split>.polygons/")
+    ap.add_argument("--remove-orphans", action="store_true",
+                    help="Delete images without labels and labels without images")
+    ap.add_argument("--out", default=None,
+                    help="Write the result to this root instead of modifying --root in place")
+    ap.add_argument("--link", action="store_true",
+                    help="With --out, hardlink (or symlink) images instead of copying them")
+    ap.add_argument("--splits", nargs="+", default=None,
+                    help="Splits to process (default: all that exist)")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="Worker processes (default: all cores)")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="Do not rebuild the stale labels/<split>.cache files afterwards")
+    args = ap.parse_args()
+
+    root = Path(args.root)
+    if not root.exists():
+        raise FileNotFoundError(f"Dataset root not found: {root}")
+
+    data_yaml = root / "data.yaml"
+    names, base_yaml = load_names(data_yaml) if data_yaml.exists() else ([], {})
+
+    remap, new_names = None, None
+    if args.remap:
+        from remap_ids import NEW_CLASS_NAMES, OLD_TO_NEW
+        remap, new_names = OLD_TO_NEW, NEW_CLASS_NAMES
+    if args.keep and not (names or new_names):
+        raise RuntimeError("Could not read class names from data.yaml")
+
+    if args.polygon_sidecar and not args.to_bbox:
+        raise ValueError("--polygon-sidecar only makes sense together with --to-bbox")
+
+    ops, final_names = build_ops(names, remap=remap, new_names=new_names, keep=args.keep,
+                                 to_bbox=args.to_bbox, sidecar=args.polygon_sidecar)
+    out_root = Path(args.out) if args.out else None
+
+    print(f"📁 Processing dataset in: {root}")
+    for kind, arg in ops:
+        print(f"  {kind}: {arg}")
+    if args.remove_orphans:
+        print("  remove orphans")
+
+    layout, splits, totals, touched = transform_dataset(
+        root, ops, out_root=out_root, remove_orphans=args.remove_orphans,
+        splits=args.splits, workers=args.workers,
+        place_mode="link" if args.link else "copy")
+
+    if out_root is not None:
+        yaml_path = write_data_yaml(out_root, base_yaml, LAYOUT_FLAT, splits, final_names)
+        print(f"\nWrote YAML at {yaml_path}")
+    elif final_names != names:
+        yaml_path = write_data_yaml(root, base_yaml, layout, splits, final_names)
+        print(f"\nUpdated YAML at {yaml_path}")
+
+    print("\nSummary:")
+    for sp in splits:
+        counts = ", ".join(f"{k} {v}" for k, v in sorted(totals[sp].items()))
+        print(f"  {sp}: {counts or 'nothing to do'}")
+
+    if not args.no_cache and (out_root is not None or any(touched.values())):
+        refresh_caches(out_root or root, workers=args.workers)
+    print("\n✅ DONE")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import argparse
+import csv
+import json
+from pathlib import Path
+
+import numpy as np
+
+from cpu_runtime import box_iou, xywh2xyxy
+from label_index import parse_label_file
+from yolo_io import list_images, list_labels, load_names
+
+# Scores saved predictions (predict with save_txt + save_conf, i.e. rows of
+# "cls x y w h conf") against ground-truth labels/<split>, without running the
+# model or the trainer's validator. Matching follows the trainer: per IoU
+# threshold 0.50:0.95, highest-IoU same-class pairs first, one match per box.
+# AP uses the same 101-point interpolated PR area. Ground-truth polygon rows
+# are scored through their tight bbox, as the trainer does.
+#
+# The confidence sweep evaluates every threshold in one pass: predictions are
+# sorted by score once and cumulative TP/FP counts give P/R/F1 at any cut.
+
+IOUV = np.linspace(0.5, 0.95, 10)
+
+
+def read_predictions(path):
+    """(cls, xyxy, conf) from a txt with 'cls x y w h conf' rows (normalized)."""
+    if path is None or not Path(path).exists() or not Path(path).stat().st_size:
+        return np.zeros(0, np.int64), np.zeros((0, 4), np.float32), np.zeros(0, np.float32)
+    with open(path, "r") as f:
+        a = np.array([line.split() for line in f if line.strip()], dtype=np.float32)
+    if a.size == 0:
+        return np.zeros(0, np.int64), np.zeros((0, 4), np.float32), np.zeros(0, np.float32)
+    if a.shape[1] < 6:
+        raise ValueError(f"{path} has no confidence column; predict with save_conf=True")
+    return a[:, 0].astype(np.int64), xywh2xyxy(a[:, 1:5]), a[:, 5]
+
+
+def read_ground_truth(path):
+    if path is None:
+        return np.zeros(0, np.int64), np.zeros((0, 4), np.float32)
+    cls, bbox, _, _ = parse_label_file(path)
+    return cls.astype(np.int64), xywh2xyxy(bbox)
+
+
+def match_predictions(gt_cls, gt_box, pr_cls, pr_box):
+    """(n_pred, 10) bool: prediction is a TP at each IoU threshold."""
+    correct = np.zeros((len(pr_cls), len(IOUV)), dtype=bool)
+    if not len(gt_cls) or not len(pr_cls):
+        return correct
+    iou = box_iou(gt_box, pr_box) * (gt_cls[:, None] == pr_cls[None, :])
+    for i, t in enumerate(IOUV):
+        matches = np.argwhere(iou >= t)
+        if not len(matches):
+            continue
+        if len(matches) > 1:
+            matches = matches[iou[matches[:, 0], matches[:, 1]].argsort()[::-1]]
+            matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+            matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+        correct[matches[:, 1], i] = True
+    return correct
+
+
+def compute_ap(recall, precision):
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return np.trapezoid(np.interp(x, mrec, mpre), x) if hasattr(np, "trapezoid") \
+        else np.trapz(np.interp(x, mrec, mpre), x)
+
+
+def evaluate(tp, conf, pred_cls, target_cls, nc, grid=1000):
+    """
+    Per-class AP at 10 IoU thresholds and the P/R/F1 sweep over confidence.
+    Returns a dict of numpy arrays (sweep curves are on `grid` points in [0, 1]).
+    """
+    order = np.argsort(-conf, kind="stable")
+    tp, conf, pred_cls = tp[order], conf[order], pred_cls[order]
+    n_gt = np.bincount(target_cls, minlength=nc)[:nc]
+
+    px = np.linspace(0, 1, grid)
+    ap = np.zeros((nc, tp.shape[1]))
+    p_curve = np.zeros((nc, grid))
+    r_curve = np.zeros((nc, grid))
+    for c in range(nc):
+        m = pred_cls == c
+        if not m.any() or not n_gt[c]:
+            continue
+        tpc = tp[m].cumsum(0)
+        fpc = (1 - tp[m]).cumsum(0)
+        recall = tpc / (n_gt[c] + 1e-16)
+        precision = tpc / (tpc + fpc)
+        # value at threshold t = counts over predictions with conf >= t
+        k = np.searchsorted(-conf[m], -px, side="right")  # n predictions kept per t
+        kept = k > 0
+        r_curve[c, kept] = recall[k[kept] - 1, 0]
+        p_curve[c, kept] = precision[k[kept] - 1, 0]
+        p_curve[c, ~kept] = 1.0
+        for j in range(tp.shape[1]):
+            ap[c, j] = compute_ap(recall[:, j], precision[:, j])
+    f1_curve = 2 * p_curve * r_curve / (p_curve + r_curve + 1e-16)
+    return {"ap": ap, "px": px, "p": p_curve, "r": r_curve, "f1": f1_curve, "n_gt": n_gt}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fast mAP/F1 evaluation and conf sweep from txt predictions.")
+    ap.add_argument("--pred", required=True, help="Folder of prediction txt files (with conf)")
+    ap.add_argument("--labels", required=True, help="Ground-truth labels folder, e.g. labels/valid")
+    ap.add_argument("--images", default=None,
+                    help="Image folder; images with neither file still count (default: union of stems)")
+    ap.add_argument("--data", default=None, help="data.yaml for class names")
+    ap.add_argument("--conf", type=float, default=None,
+                    help="Report P/R/F1 at this conf (default: best mean F1)")
+    ap.add_argument("--out", default=None, help="Write summary JSON and sweep CSV with this prefix")
+    args = ap.parse_args()
+
+    preds = list_labels(Path(args.pred))
+    gts = list_labels(Path(args.labels))
+    if preds and gts and not set(preds) & set(gts):
+        raise SystemExit(f"No matching images: no prediction in {args.pred} has a label in {args.labels}")
+    stems = set(preds) | set(gts)
+    if args.images:
+        stems |= set(list_images(Path(args.images)))
+    if not stems:
+        raise SystemExit(f"No matching images: no txt files in {args.pred} or {args.labels}")
+
+    tps, confs, pcls, tcls = [], [], [], []
+    min_conf = 1.0
+    for stem in sorted(stems):
+        gc, gb = read_ground_truth(gts.get(stem))
+        pc, pb, pconf = read_predictions(preds.get(stem))
+        tps.append(match_predictions(gc, gb, pc, pb))
+        confs.append(pconf)
+        pcls.append(pc)
+        tcls.append(gc)
+        if len(pconf):
+            min_conf = min(min_conf, float(pconf.min()))
+
+    tp, conf = np.concatenate(tps), np.concatenate(confs)
+    pred_cls, target_cls = np.concatenate(pcls), np.concatenate(tcls)
+
+    names = load_names(Path(args.data))[0] if args.data else None
+    nc = len(names) if names else int(max(pred_cls.max(initial=-1), target_cls.max(initial=-1))) + 1
+    names = names or [str(i) for i in range(nc)]
+
+    res = evaluate(tp, conf, pred_cls, target_cls, nc)
+    present = res["n_gt"] > 0
+    if not present.any():
+        raise SystemExit(f"No ground-truth objects in {args.labels}; nothing to evaluate")
+    mean_f1 = res["f1"][present].mean(0)
+    if args.conf is not None:
+        i = int(np.abs(res["px"] - args.conf).argmin())
+    else:
+        i = len(mean_f1) - 1 - int(mean_f1[::-1].argmax())  # highest conf among ties
+    conf_at = float(res["px"][i])
+
+    print(f"{len(stems)} images, {len(target_cls)} targets, {len(pred_cls)} predictions")
+    if min_conf > 0.01 and len(pred_cls):
+        print(f"[NOTE] predictions were saved at conf >= {min_conf:.2f}; "
+              f"lower thresholds cannot be evaluated.")
+    print(f"\n{'class':<16}{'targets':>8}{'P':>8}{'R':>8}{'F1':>8}{'mAP50':>8}{'mAP50-95':>10}")
+    rows = []
+    for c in range(nc):
+        if not present[c]:
+            continue
+        row = {"class": names[c], "targets": int(res["n_gt"][c]), "p": float(res["p"][c, i]),
+               "r": float(res["r"][c, i]), "f1": float(res["f1"][c, i]),
+               "map50": float(res["ap"][c, 0]), "map": float(res["ap"][c].mean()),
+               "best_conf": float(res["px"][res["f1"][c].argmax()])}
+        rows.append(row)
+        print(f"{row['class']:<16}{row['targets']:>8}{row['p']:>8.3f}{row['r']:>8.3f}"
+              f"{row['f1']:>8.3f}{row['map50']:>8.3f}{row['map']:>10.3f}")
+    overall = {"p": float(res["p"][present, i].mean()), "r": float(res["r"][present, i].mean()),
+               "f1": float(mean_f1[i]), "map50": float(res["ap"][present, 0].mean()),
+               "map": float(res["ap"][present].mean()), "conf": conf_at}
+    print(f"{'all':<16}{int(res['n_gt'].sum()):>8}{overall['p']:>8.3f}{overall['r']:>8.3f}"
+          f"{overall['f1']:>8.3f}{overall['map50']:>8.3f}{overall['map']:>10.3f}")
+    print(f"\nF1 evaluated at conf={conf_at:.3f}"
+          + ("" if args.conf is not None else " (best mean F1)"))
+
+    if args.out:
+        out = Path(args.out)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        with open(out.with_suffix(".json"), "w") as f:
+            json.dump({"overall": overall, "classes": rows}, f, indent=2)
+        with open(out.with_suffix(".csv"), "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["conf", "precision", "recall", "f1"])
+            for k in range(len(res["px"])):
+                w.writerow([f"{res['px'][k]:.4f}", f"{res['p'][present, k].mean():.4f}",
+                            f"{res['r'][present, k].mean():.4f}", f"{mean_f1[k]:.4f}"])
+        print(f"✅ Wrote {out.with_suffix('.json')} and {out.with_suffix('.csv')}")
+
+
+if __name__ == "__main__":
+    main()
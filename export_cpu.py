@@ -0,0 +1,181 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import yaml
+
+from cpu_runtime import load_detector, preprocess
+from label_cache import get_img_files
+
+# Export a trained best.pt (train_nc6.py / fine_tuning.py) for CPU inference:
+#   fp32 ONNX, INT8 ONNX (static quantization calibrated on images/valid) and,
+#   when openvino is installed, an INT8 OpenVINO model.
+# Every variant is validated on the valid split (mAP50 / mAP50-95) and timed
+# with cpu_runtime, and the report shows accuracy drift next to the speedup so
+# a quantized model is only shipped when it is actually safe.
+
+
+def valid_images(data_yaml, limit=None):
+    with open(data_yaml, "r") as f:
+        y = yaml.safe_load(f)
+    base = Path(y["path"]) if y.get("path") else Path(data_yaml).parent
+    src = Path(y["val"]) if Path(y["val"]).is_absolute() else base / y["val"]
+    files = get_img_files(src)
+    if not files:
+        raise RuntimeError(f"No validation images found at {src}")
+    return files[:limit] if limit else files
+
+
+def export_onnx(weights, imgsz=640):
+    from ultralytics import YOLO
+    return Path(YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True))
+
+
+def export_openvino_int8(weights, data_yaml, imgsz=640):
+    from ultralytics import YOLO
+    return Path(YOLO(weights).export(format="openvino", imgsz=imgsz, int8=True, data=str(data_yaml)))
+
+
+class ValidReader:
+    """onnxruntime CalibrationDataReader over letterboxed validation images."""
+
+    def __init__(self, files, input_name, imgsz):
+        self.files = iter(files)
+        self.input_name = input_name
+        self.imgsz = imgsz
+
+    def get_next(self):
+        for f in self.files:
+            im = cv2.imread(f)
+            if im is not None:
+                x, _ = preprocess([im], self.imgsz)
+                return {self.input_name: x}
+        return None
+
+    def rewind(self):
+        pass
+
+
+def quantize_onnx_int8(onnx_path, calib_files, imgsz=640):
+    """Static QDQ INT8 quantization (per-channel weights) calibrated on calib_files."""
+    import onnxruntime as ort
+    from onnxruntime.quantization import (CalibrationMethod, QuantFormat, QuantType,
+                                          quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    onnx_path = Path(onnx_path)
+    prep = onnx_path.with_name(onnx_path.stem + "-prep.onnx")
+    out = onnx_path.with_name(onnx_path.stem + "-int8.onnx")
+    quant_pre_process(str(onnx_path), str(prep))
+    input_name = ort.InferenceSession(str(prep), providers=["CPUExecutionProvider"]) \
+        .get_inputs()[0].name
+    quantize_static(str(prep), str(out), ValidReader(calib_files, input_name, imgsz),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    calibrate_method=CalibrationMethod.MinMax)
+    prep.unlink(missing_ok=True)
+    return out
+
+
+def validate(model_path, data_yaml, imgsz=640):
+    """(mAP50, mAP50-95) on the valid split, CPU."""
+    from ultralytics import YOLO
+    m = YOLO(str(model_path), task="detect").val(data=str(data_yaml), imgsz=imgsz, batch=1,
+                                                device="cpu", plots=False, verbose=False)
+    return float(m.box.map50), float(m.box.map)
+
+
+def time_runtime(model_path, files, imgsz=640, warmup=5, iters=50):
+    """Mean/p50 ms per image at batch 1 through cpu_runtime (pre + infer + NMS)."""
+    det = load_detector(model_path, imgsz=imgsz)
+    ims = [cv2.imread(f) for f in files[:iters]]
+    ims = [im for im in ims if im is not None]
+    for im in ims[:warmup]:
+        det([im])
+    lat = []
+    for im in ims:
+        t = time.perf_counter()
+        det([im])
+        lat.append(time.perf_counter() - t)
+    lat = np.array(lat) * 1000
+    return float(lat.mean()), float(np.percentile(lat, 50))
+
+
+def time_torch(weights, files, imgsz=640, warmup=5, iters=50):
+    """Same timing for the original .pt through ultralytics on CPU, as the baseline."""
+    from ultralytics import YOLO
+    model = YOLO(weights)
+    ims = [cv2.imread(f) for f in files[:iters]]
+    ims = [im for im in ims if im is not None]
+    for im in ims[:warmup]:
+        model.predict(im, imgsz=imgsz, device="cpu", verbose=False)
+    lat = []
+    for im in ims:
+        t = time.perf_counter()
+        model.predict(im, imgsz=imgsz, device="cpu", verbose=False)
+        lat.append(time.perf_counter() - t)
+    lat = np.array(lat) * 1000
+    return float(lat.mean()), float(np.percentile(lat, 50))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Export best.pt to ONNX/OpenVINO (+INT8) and report drift vs speedup.")
+    ap.add_argument("--weights", required=True, help="Path to best.pt")
+    ap.add_argument("--data", required=True, help="data.yaml (valid split used for calibration and mAP)")
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--calib", type=int, default=300, help="Number of valid images for INT8 calibration")
+    ap.add_argument("--iters", type=int, default=50, help="Images to time per variant")
+    ap.add_argument("--no-openvino", action="store_true", help="Skip the OpenVINO export")
+    ap.add_argument("--no-val", action="store_true", help="Skip mAP validation (timing only)")
+    args = ap.parse_args()
+
+    files = valid_images(args.data)
+    rng = np.random.default_rng(0)
+    calib = [files[i] for i in rng.permutation(len(files))[:args.calib]]
+
+    variants = {}
+    print("📦 Exporting ONNX (fp32)...")
+    variants["onnx_fp32"] = export_onnx(args.weights, args.imgsz)
+    print("📦 Quantizing ONNX to INT8...")
+    variants["onnx_int8"] = quantize_onnx_int8(variants["onnx_fp32"], calib, args.imgsz)
+    if not args.no_openvino:
+        try:
+            import openvino  # noqa: F401
+            print("📦 Exporting OpenVINO (INT8)...")
+            variants["openvino_int8"] = export_openvino_int8(args.weights, args.data, args.imgsz)
+        except ImportError:
+            print("[WARN] openvino not installed, skipping OpenVINO export.")
+
+    report = {"weights": str(args.weights), "imgsz": args.imgsz, "variants": {}}
+    base_ms, base_p50 = time_torch(args.weights, files, args.imgsz, iters=args.iters)
+    base = {"path": str(args.weights), "mean_ms": round(base_ms, 2), "p50_ms": round(base_p50, 2)}
+    if not args.no_val:
+        base["map50"], base["map"] = validate(args.weights, args.data, args.imgsz)
+    report["variants"]["pytorch"] = base
+
+    for name, path in variants.items():
+        mean_ms, p50 = time_runtime(path, files, args.imgsz, iters=args.iters)
+        row = {"path": str(path), "mean_ms": round(mean_ms, 2), "p50_ms": round(p50, 2),
+               "speedup": round(base_ms / mean_ms, 2)}
+        if not args.no_val:
+            row["map50"], row["map"] = validate(path, args.data, args.imgsz)
+            row["map_drift"] = round(row["map"] - base["map"], 4)
+        report["variants"][name] = row
+
+    out = Path(args.weights).with_name("cpu_export_report.json")
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'variant':<15}{'ms/img':>9}{'speedup':>9}{'mAP50':>8}{'mAP50-95':>10}{'drift':>8}")
+    for name, row in report["variants"].items():
+        print(f"{name:<15}{row['mean_ms']:>9.1f}{row.get('speedup', 1.0):>9.2f}"
+              f"{row.get('map50', float('nan')):>8.3f}{row.get('map', float('nan')):>10.3f}"
+              f"{row.get('map_drift', 0.0):>8.3f}")
+    print(f"\n✅ Report: {out}")
+
+
+if __name__ == "__main__":
+    main()
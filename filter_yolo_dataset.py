@@ -1,7 +1,10 @@
-import argparse, os, shutil, yaml
+import argparse, os, yaml
 from pathlib import Path
 from tqdm import tqdm
 
+from label_cache import refresh_caches
+from yolo_io import place_file, write_atomic
+
 def load_names(data_yaml):
     with open(data_yaml, "r") as f:
         y = yaml.safe_load(f)
@@ -17,7 +20,7 @@ def ensure_dirs(root_out, splits):
         (root_out / "images" / sp).mkdir(parents=True, exist_ok=True)
         (root_out / "labels" / sp).mkdir(parents=True, exist_ok=True)
 
-def filter_split(root_in, root_out, split, keep_ids):
+def filter_split(root_in, root_out, split, keep_ids, mode="copy"):
     img_dir = root_in / split / "images"
     lbl_dir = root_in / split / "labels"
     kept, skipped = 0, 0
@@ -52,9 +55,8 @@ def filter_split(root_in, root_out, split, keep_ids):
             # copy image + write filtered labels
             out_img = root_out / "images" / split / img_path.name
             out_lbl = root_out / "labels" / split / f"{stem}.txt"
-            shutil.copy2(img_path, out_img)
-            with open(out_lbl, "w") as f:
-                f.writelines(keep_lines)
+            place_file(img_path, out_img, mode)
+            write_atomic(out_lbl, "".join(keep_lines))
             kept += 1
         else:
             skipped += 1
@@ -87,6 +89,10 @@ def main():
                     help="Path to dataset root that contains train/ valid/ test/ and data.yaml")
     ap.add_argument("--keep", nargs="+", default=["SS", "yield sign"],
                     help='Class names to keep (default: "SS" "yield sign")')
+    ap.add_argument("--mode", choices=["copy", "link"], default="copy",
+                    help="copy kept images (default) or hardlink/symlink them into the output")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="Do not prebuild the labels/<split>.cache files of the output")
     args = ap.parse_args()
 
     root_in = Path(args.root)
@@ -121,12 +127,14 @@ def main():
 
     totals = {}
     for sp in splits:
-        kept, skipped = filter_split(root_in, out_root, sp, keep_ids)
+        kept, skipped = filter_split(root_in, out_root, sp, keep_ids, mode=args.mode)
         totals[sp] = (kept, skipped)
 
     # Write new data.yaml with only the kept class names (preserve original order)
     new_names = [n for n in names if n in args.keep]
     write_data_yaml(out_root, base_yaml, splits, new_names)
+    if not args.no_cache:
+        refresh_caches(out_root)
 
     print("\nSummary:")
     for sp,(k,s) in totals.items():
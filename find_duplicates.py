@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import shutil
+from collections import defaultdict
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from label_cache import refresh_caches
+from yolo_io import detect_layout, find_splits, list_images, split_dirs
+
+# Finds near-duplicate images (Roboflow augmentation siblings, _dupN copies from
+# oversampling, re-exports) across all splits with a 64-bit difference hash,
+# and flags clusters that leak between train and valid/test.
+#
+# Hashes are kept in <root>/.phash_index.npz keyed by path + size + mtime, so a
+# re-run only hashes new or changed images. Neighbours within Hamming distance
+# t are found with multi-index hashing: the 64 bits are cut into t+1 chunks and
+# any pair within distance t must agree exactly on at least one chunk, so only
+# pairs sharing a chunk value are compared (vectorized XOR + popcount).
+
+INDEX_NAME = ".phash_index.npz"
+EVAL_SPLITS = ("valid", "val", "test")
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount64(x):
+    x = np.asarray(x, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).astype(np.uint8)
+    return _POPCOUNT8[x.view(np.uint8).reshape(x.shape + (8,))].sum(-1, dtype=np.uint8)
+
+
+def dhash(path, size=8):
+    """64-bit difference hash. JPEGs are decoded at reduced scale via draft()."""
+    with Image.open(path) as im:
+        im.draft("L", (size * 8, size * 8))
+        px = np.asarray(im.convert("L").resize((size + 1, size), Image.BILINEAR),
+                        dtype=np.int16)
+    bits = (px[:, 1:] > px[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def _hash_task(path):
+    try:
+        return path, dhash(path)
+    except Exception:  # unreadable/corrupt image: leave it to the integrity scanner
+        return path, None
+
+
+def collect_images(root: Path):
+    """[(split, path)] for every image in every split."""
+    layout = detect_layout(root)
+    if layout is None:
+        raise RuntimeError(f"Could not find images/labels folders under {root}")
+    out = []
+    for sp in find_splits(root, layout):
+        img_dir, _ = split_dirs(root, sp, layout)
+        out.extend((sp, str(p)) for _, p in sorted(list_images(img_dir).items()))
+    return layout, out
+
+
+def load_hashes(root: Path, paths, workers=None):
+    """uint64 hash per path (0 with valid=False for unreadable images), using the on-disk index."""
+    index_path = root / INDEX_NAME
+    known = {}
+    if index_path.exists():
+        z = np.load(index_path, allow_pickle=False)
+        for p, s, m, h in zip(z["paths"], z["sizes"], z["mtimes"], z["hashes"]):
+            known[str(p)] = (int(s), int(m), int(h))
+
+    sigs = []
+    for p in paths:
+        st = os.stat(p)
+        sigs.append((st.st_size, st.st_mtime_ns))
+
+    hashes = np.zeros(len(paths), dtype=np.uint64)
+    valid = np.ones(len(paths), dtype=bool)
+    todo = []
+    for i, (p, sig) in enumerate(zip(paths, sigs)):
+        k = known.get(p)
+        if k and k[:2] == sig:
+            hashes[i] = k[2]
+        else:
+            todo.append(i)
+
+    if todo:
+        pos = {paths[i]: i for i in todo}
+        with Pool(workers or os.cpu_count() or 1) as pool:
+            it = pool.imap_unordered(_hash_task, [paths[i] for i in todo], chunksize=64)
+            for p, h in tqdm(it, total=len(todo), desc="hashing"):
+                if h is None:
+                    valid[pos[p]] = False
+                else:
+                    hashes[pos[p]] = h
+
+    keep = valid
+    np.savez(index_path,
+             paths=np.array(paths, dtype=str)[keep],
+             sizes=np.array([s for s, _ in sigs], dtype=np.int64)[keep],
+             mtimes=np.array([m for _, m in sigs], dtype=np.int64)[keep],
+             hashes=hashes[keep])
+    print(f"Hashed {len(todo)} images ({len(paths) - len(todo)} from {INDEX_NAME})")
+    return hashes, valid
+
+
+def near_pairs(hashes, threshold=4, max_block=4096):
+    """
+    All index pairs (i, j), i < j, with Hamming distance <= threshold.
+    Returns an (n, 2) int64 array.
+    """
+    n = len(hashes)
+    k = threshold + 1
+    width = 64 // k
+    found = []
+    for c in range(k):
+        lo = c * width
+        bits = 64 - lo if c == k - 1 else width
+        key = (hashes >> np.uint64(lo)) & np.uint64((1 << bits) - 1)
+        order = np.argsort(key, kind="stable")
+        sk = key[order]
+        cuts = np.flatnonzero(np.diff(sk)) + 1
+        starts = np.concatenate([[0], cuts])
+        ends = np.concatenate([cuts, [n]])
+        for a, b in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            members = order[a:b]
+            hm = hashes[members]
+            for s in range(0, len(members), max_block):
+                blk = hm[s:s + max_block]
+                d = popcount64(blk[:, None] ^ hm[None, :])
+                ii, jj = np.nonzero(d <= threshold)
+                ii = ii + s
+                m = ii < jj
+                if m.any():
+                    found.append(np.stack([members[ii[m]], members[jj[m]]], 1))
+    if not found:
+        return np.zeros((0, 2), dtype=np.int64)
+    pairs = np.concatenate(found)
+    pairs = np.sort(pairs, axis=1)
+    return np.unique(pairs, axis=0)
+
+
+def clusters_from_pairs(n, pairs):
+    """Union-find over the pairs. Returns a list of index lists (size >= 2)."""
+    parent = np.arange(n)
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in pairs:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    groups = defaultdict(list)
+    for i in np.unique(pairs):
+        groups[find(i)].append(int(i))
+    return [sorted(g) for g in groups.values()]
+
+
+def pick_keepers(members, items):
+    """
+    Which members of a cluster to keep. If the cluster touches an eval split,
+    keep all eval copies and drop the train copies (that is the leak); a
+    cluster made only of eval images is kept whole, since moving any of them
+    would silently shrink valid/test. Otherwise keep one image, preferring a
+    name without _dupN.
+    """
+    eval_members = [m for m in members if items[m][0] in EVAL_SPLITS]
+    if eval_members:
+        return set(eval_members)
+    ranked = sorted(members, key=lambda m: ("_dup" in Path(items[m][1]).stem, items[m][1]))
+    return {ranked[0]}
+
+
+def quarantine(root, layout, split, img_path, dest_root, stem=None):
+    """
+    Move an image and its label under <dest_root>/<split>/images|labels.
+    img_path may be None to move only the label of `stem` (orphan labels).
+    Returns the number of files moved.
+    """
+    stem = stem or Path(img_path).stem
+    _, lbl_dir = split_dirs(root, split, layout)
+    moved = 0
+    for src, kind in ((img_path, "images"), (lbl_dir / f"{stem}.txt", "labels")):
+        if src is not None and Path(src).exists():
+            dst = dest_root / split / kind
+            dst.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(src), str(dst / Path(src).name))
+            moved += 1
+    return moved
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Find near-duplicate images and cross-split leaks.")
+    ap.add_argument("--root", required=True, help="Dataset root")
+    ap.add_argument("--threshold", type=int, default=4,
+                    help="Max Hamming distance between 64-bit hashes (default: 4)")
+    ap.add_argument("--report", default=None,
+                    help="JSON report path (default: <root>/duplicates.json)")
+    ap.add_argument("--dedupe", action="store_true",
+                    help="Move duplicates (train copies of leaks first) to <root>/_duplicates")
+    ap.add_argument("--workers", type=int, default=None)
+    args = ap.parse_args()
+
+    root = Path(args.root)
+    layout, items = collect_images(root)
+    print(f"🔍 {len(items)} images under {root}")
+
+    hashes, valid = load_hashes(root, [p for _, p in items], workers=args.workers)
+    idx = np.flatnonzero(valid)
+    pairs = idx[near_pairs(hashes[idx], threshold=args.threshold)]
+    clusters = clusters_from_pairs(len(items), pairs)
+
+    report = {"threshold": args.threshold, "n_images": len(items),
+              "n_unreadable": int((~valid).sum()), "clusters": [], "leaks": 0, "eval_only": 0}
+    to_move = []
+    for members in sorted(clusters, key=len, reverse=True):
+        splits = sorted({items[m][0] for m in members})
+        leak = len(splits) > 1
+        eval_only = all(sp in EVAL_SPLITS for sp in splits)
+        report["leaks"] += int(leak)
+        report["eval_only"] += int(eval_only)
+        report["clusters"].append({
+            "splits": splits, "leak": leak, "eval_only": eval_only,
+            "members": [{"split": items[m][0], "path": items[m][1]} for m in members]})
+        keep = pick_keepers(members, items)
+        to_move.extend(m for m in members if m not in keep)
+
+    report["n_clusters"] = len(clusters)
+    report["n_redundant"] = len(to_move)
+    report_path = Path(args.report) if args.report else root / "duplicates.json"
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=1)
+
+    print(f"\nClusters: {len(clusters)}  (cross-split leaks: {report['leaks']})")
+    print(f"Redundant images: {len(to_move)}")
+    if report["eval_only"]:
+        print(f"[NOTE] {report['eval_only']} clusters lie only in valid/test; left in place "
+              f"(see \"eval_only\" in the report)")
+    print(f"Report: {report_path}")
+
+    if args.dedupe and to_move:
+        dest = root / "_duplicates"
+        for m in tqdm(to_move, desc="moving duplicates"):
+            quarantine(root, layout, items[m][0], items[m][1], dest)
+        print(f"🗑️ Moved {len(to_move)} images (+labels) to {dest}")
+        refresh_caches(root)
+
+    print("\n✅ DONE")
+
+
+if __name__ == "__main__":
+    main()
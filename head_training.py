@@ -0,0 +1,450 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+import yaml
+from ultralytics import YOLO, __version__
+from ultralytics.cfg import get_cfg
+from ultralytics.nn.tasks import DetectionModel
+from ultralytics.utils.loss import v8DetectionLoss
+from ultralytics.utils.torch_utils import ModelEMA
+
+from cpu_runtime import letterbox, postprocess
+from evaluate_predictions import evaluate, match_predictions
+from label_cache import get_img_files, img2label_paths
+from label_index import parse_label_file
+from pipeline import weights_hash
+
+# Head-only training from cached backbone features, for warmup phases like
+# train_nc6.py phase 1 (freeze=10): the frozen layers give the same output for
+# an image every epoch, so they run once per image and view and the epochs
+# only run the trainable layers (>= freeze).
+#
+# Only the frozen outputs the head actually reads are stored (for YOLOv8 with
+# freeze=10: layers 4, 6 and 9, found from each layer's `.f` inputs), in fp16,
+# or int8 with a per-channel scale (half the size again). Each sample is a
+# zlib-compressed blob in one memory-mapped shard per layer, with byte offsets
+# next to it, so any sample can still be read on its own:
+#   <cache>/<split>/feat_<layer>.bin feat_<layer>.off.npy [scale_<layer>.npy]
+#   labels.npz meta.json
+# A cache is reused while weights, imgsz, freeze, views, dtype and the split's
+# files (path, size and mtime of every image and label) match.
+#
+# Views: view 0 is the plain letterboxed image (no augmentation); --views K
+# adds K-1 fixed random scale/translate/HSV views per train image. No flips:
+# keep_right would turn into a mirrored sign.
+#
+# Validation runs the head on the cached valid features every epoch and scores
+# it with evaluate_predictions (mAP50 / mAP50-95 on letterboxed valid images).
+# The result is a normal ultralytics checkpoint (<project>/<name>/weights/best.pt)
+# to continue from with YOLO(best).train(freeze=0, ...).
+
+
+def cached_layers(dm, freeze):
+    """Indices of frozen layers whose outputs the trainable layers read."""
+    needed = {freeze - 1}
+    for m in dm.model[freeze:]:
+        for j in ([m.f] if isinstance(m.f, int) else m.f):
+            if j != -1 and j < freeze:
+                needed.add(j)
+    return sorted(needed)
+
+
+def run_backbone(dm, x, freeze, layers):
+    y = []
+    for m in dm.model[:freeze]:
+        if m.f != -1:
+            x = y[m.f] if isinstance(m.f, int) else [x if j == -1 else y[j] for j in m.f]
+        x = m(x)
+        y.append(x)
+    return {j: y[j] for j in layers}
+
+
+def head_forward(dm, feats, freeze):
+    """Run layers >= freeze from cached {layer: tensor} features."""
+    y = [None] * len(dm.model)
+    for j, t in feats.items():
+        y[j] = t
+    x = feats[freeze - 1]
+    for m in dm.model[freeze:]:
+        if m.f != -1:
+            x = y[m.f] if isinstance(m.f, int) else [x if j == -1 else y[j] for j in m.f]
+        x = m(x)
+        y[m.i] = x
+    return x
+
+
+# ---- samples ----------------------------------------------------------------
+
+def augment_hsv(im, rng, hgain=0.015, sgain=0.7, vgain=0.4):
+    r = rng.uniform(-1, 1, 3) * [hgain, sgain, vgain] + 1
+    hue, sat, val = cv2.split(cv2.cvtColor(im, cv2.COLOR_BGR2HSV))
+    x = np.arange(0, 256, dtype=r.dtype)
+    lut_hue = ((x * r[0]) % 180).astype(np.uint8)
+    lut_sat = np.clip(x * r[1], 0, 255).astype(np.uint8)
+    lut_val = np.clip(x * r[2], 0, 255).astype(np.uint8)
+    hsv = cv2.merge((cv2.LUT(hue, lut_hue), cv2.LUT(sat, lut_sat), cv2.LUT(val, lut_val)))
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+def random_view(im, boxes, rng, scale=0.25, translate=0.1):
+    """Random scale/translate (boxes follow, mostly-cut boxes are dropped) + HSV jitter."""
+    n = im.shape[0]
+    s = rng.uniform(1 - scale, 1 + scale)
+    tx, ty = rng.uniform(-translate, translate, 2) * n
+    ox, oy = (1 - s) * n / 2 + tx, (1 - s) * n / 2 + ty
+    M = np.array([[s, 0, ox], [0, s, oy]], dtype=np.float32)
+    im = cv2.warpAffine(im, M, (n, n), borderValue=(114, 114, 114))
+    b = boxes * s + np.array([ox, oy, ox, oy])
+    area0 = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    b = b.clip(0, n)
+    area = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    keep = area > 0.2 * np.maximum(area0, 1e-9)
+    return augment_hsv(im, rng), b, keep
+
+
+def load_sample(task):
+    """Letterboxed BGR image plus (cls, xyxy in input pixels) for one (image, view)."""
+    path, lbl, imgsz, view, seed = task
+    im = cv2.imread(path)
+    if im is None:
+        return None
+    h0, w0 = im.shape[:2]
+    cls, bbox = np.zeros(0, np.int64), np.zeros((0, 4), np.float32)
+    if Path(lbl).exists():
+        c, bbox, _, _ = parse_label_file(lbl)
+        cls = c.astype(np.int64)
+    im, r, (px, py) = letterbox(im, imgsz)
+    xyxy = np.stack([(bbox[:, 0] - bbox[:, 2] / 2) * w0 * r + px,
+                     (bbox[:, 1] - bbox[:, 3] / 2) * h0 * r + py,
+                     (bbox[:, 0] + bbox[:, 2] / 2) * w0 * r + px,
+                     (bbox[:, 1] + bbox[:, 3] / 2) * h0 * r + py], 1).astype(np.float32)
+    if view:
+        im, xyxy, keep = random_view(im, xyxy, np.random.default_rng([seed, view, zlib.crc32(path.encode())]))
+        cls, xyxy = cls[keep], xyxy[keep]
+    return im, cls, xyxy
+
+
+# ---- feature cache ----------------------------------------------------------
+
+def files_signature(im_files):
+    """Hash of path, size and mtime of every image and label, so edits invalidate the cache."""
+    h = hashlib.sha256()
+    for p in list(im_files) + img2label_paths(im_files):
+        try:
+            st = os.stat(p)
+            h.update(f"{p}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+        except OSError:
+            h.update(f"{p}:-\n".encode())
+    return h.hexdigest()[:16]
+
+
+CACHE_FORMAT = 2  # zlib blobs; part of the cache key so older raw .npy caches are rebuilt
+
+
+def build_feature_cache(dm, im_files, out_dir, imgsz, freeze, views=1, dtype="fp16",
+                        batch=16, device="cpu", seed=0, threads=8, key=None):
+    out_dir = Path(out_dir)
+    meta_path = out_dir / "meta.json"
+    if key and meta_path.exists():
+        with open(meta_path, "r") as f:
+            if json.load(f).get("key") == key:
+                print(f"[OK] reusing feature cache {out_dir}")
+                return
+    out_dir.mkdir(parents=True, exist_ok=True)
+    meta_path.unlink(missing_ok=True)  # no valid cache until the new one is complete
+    for old in list(out_dir.glob("feat_*")) + list(out_dir.glob("scale_*.npy")):
+        old.unlink()
+    layers = cached_layers(dm, freeze)
+    lbl_files = img2label_paths(im_files)
+    tasks = [(p, lbl, imgsz, v, seed) for p, lbl in zip(im_files, lbl_files) for v in range(views)]
+    N = len(tasks)
+    dm.eval().to(device)
+
+    shards = {j: open(out_dir / f"feat_{j}.bin", "wb") for j in layers}
+    offsets = {j: [0] for j in layers}
+    shapes, scales = {}, {j: [] for j in layers}
+    off, cls_all, box_all = [0], [], []
+    n = 0
+
+    def flush(ims):
+        nonlocal n
+        x = torch.from_numpy(np.stack(ims)[..., ::-1].transpose(0, 3, 1, 2).copy()).to(device)
+        with torch.inference_mode():
+            feats = run_backbone(dm, x.float() / 255, freeze, layers)
+        for j, t in feats.items():
+            a = t.float().cpu().numpy()
+            shapes[j] = list(a.shape[1:])
+            if dtype == "int8":
+                s = np.abs(a).max(axis=(2, 3)) / 127 + 1e-12
+                q = np.round(a / s[:, :, None, None]).astype(np.int8)
+                scales[j].append(s.astype(np.float32))
+            else:
+                q = a.astype(np.float16)
+            for sample in q:
+                blob = zlib.compress(sample.tobytes(), 1)
+                shards[j].write(blob)
+                offsets[j].append(offsets[j][-1] + len(blob))
+        n += len(ims)
+
+    ims = []
+    with ThreadPoolExecutor(threads) as pool:
+        for res in pool.map(load_sample, tasks):
+            if res is None:
+                continue
+            im, c, b = res
+            ims.append(im)
+            cls_all.append(c)
+            box_all.append(b)
+            off.append(off[-1] + len(c))
+            if len(ims) == batch:
+                flush(ims)
+                ims = []
+                print(f"\r  backbone {n}/{N}", end="")
+        if ims:
+            flush(ims)
+    print(f"\r  backbone {n}/{N}")
+    for j in layers:
+        shards[j].close()
+        np.save(out_dir / f"feat_{j}.off.npy", np.array(offsets[j], np.int64))
+        if dtype == "int8":
+            np.save(out_dir / f"scale_{j}.npy", np.concatenate(scales[j]) if scales[j]
+                    else np.zeros((0, 0), np.float32))
+
+    np.savez(out_dir / "labels.npz", off=np.array(off, np.int64),
+             cls=np.concatenate(cls_all) if cls_all else np.zeros(0, np.int64),
+             xyxy=np.concatenate(box_all) if box_all else np.zeros((0, 4), np.float32))
+    with open(meta_path, "w") as f:
+        json.dump({"key": key, "format": CACHE_FORMAT, "n": n, "layers": layers,
+                   "shapes": [shapes.get(j) for j in layers], "imgsz": imgsz, "dtype": dtype,
+                   "views": views}, f)
+
+
+class FeatureCache:
+    def __init__(self, cache_dir):
+        self.dir = Path(cache_dir)
+        with open(self.dir / "meta.json", "r") as f:
+            self.meta = json.load(f)
+        self.n = self.meta["n"]
+        self.imgsz = self.meta["imgsz"]
+        self.dtype = np.int8 if self.meta["dtype"] == "int8" else np.float16
+        layers = self.meta["layers"] if self.n else []
+        self.shapes = dict(zip(layers, self.meta["shapes"]))
+        self.shards = {j: np.memmap(self.dir / f"feat_{j}.bin", dtype=np.uint8, mode="r") for j in layers}
+        self.offsets = {j: np.load(self.dir / f"feat_{j}.off.npy") for j in layers}
+        self.scales = {j: np.load(self.dir / f"scale_{j}.npy", mmap_mode="r")
+                       for j in layers if self.meta["dtype"] == "int8"}
+        z = np.load(self.dir / "labels.npz")
+        self.off, self.cls, self.xyxy = z["off"], z["cls"], z["xyxy"]
+
+    def __len__(self):
+        return self.n
+
+    def features(self, idx, device):
+        out = {}
+        for j, mm in self.shards.items():
+            o = self.offsets[j]
+            a = np.stack([np.frombuffer(zlib.decompress(mm[o[i]:o[i + 1]]), self.dtype)
+                          for i in idx]).reshape(len(idx), *self.shapes[j]).astype(np.float32)
+            if j in self.scales:
+                a *= np.asarray(self.scales[j][idx])[:, :, None, None]
+            out[j] = torch.from_numpy(a).to(device)
+        return out
+
+    def targets(self, idx):
+        """(per-image cls, per-image xyxy) lists in input pixels."""
+        return ([self.cls[self.off[i]:self.off[i + 1]] for i in idx],
+                [self.xyxy[self.off[i]:self.off[i + 1]] for i in idx])
+
+    def batch(self, idx, device):
+        feats = self.features(idx, device)
+        cls, xyxy = self.targets(idx)
+        bi = np.concatenate([np.full(len(c), k) for k, c in enumerate(cls)]) if cls else np.zeros(0)
+        c = np.concatenate(cls) if cls else np.zeros(0)
+        b = np.concatenate(xyxy) / self.imgsz if xyxy else np.zeros((0, 4))
+        xywh = np.concatenate([(b[:, :2] + b[:, 2:]) / 2, b[:, 2:] - b[:, :2]], 1)
+        return feats, {"batch_idx": torch.from_numpy(bi.astype(np.float32)).to(device),
+                       "cls": torch.from_numpy(c.astype(np.float32)).view(-1, 1).to(device),
+                       "bboxes": torch.from_numpy(xywh.astype(np.float32)).to(device)}
+
+
+# ---- training ---------------------------------------------------------------
+
+def validate_cached(model, cache, freeze, nc, device, batch=32):
+    """(mAP50, mAP50-95) of the head on cached valid features."""
+    model.eval()
+    if not len(cache):
+        return 0.0, 0.0
+    tps, confs, pcls, tcls = [], [], [], []
+    meta = (1.0, (0, 0), (cache.imgsz, cache.imgsz))
+    with torch.inference_mode():
+        for s in range(0, len(cache), batch):
+            idx = np.arange(s, min(s + batch, len(cache)))
+            out = head_forward(model, cache.features(idx, device), freeze)
+            dets = postprocess(out[0].float().cpu().numpy(), [meta] * len(idx), conf=0.001, iou=0.7)
+            gcls, gbox = cache.targets(idx)
+            for (pb, pc, pk), gc, gb in zip(dets, gcls, gbox):
+                tps.append(match_predictions(gc, gb, pk, pb))
+                confs.append(pc)
+                pcls.append(pk)
+                tcls.append(gc)
+    res = evaluate(np.concatenate(tps), np.concatenate(confs), np.concatenate(pcls),
+                   np.concatenate(tcls), nc)
+    present = res["n_gt"] > 0
+    if not present.any():
+        return 0.0, 0.0
+    return float(res["ap"][present, 0].mean()), float(res["ap"][present].mean())
+
+
+def save_checkpoint(model, path, fitness, train_args):
+    """Finished-run checkpoint in the layout ultralytics loads (ema, no optimizer)."""
+    torch.save({"epoch": -1, "best_fitness": fitness, "model": None,
+                "ema": deepcopy(model).half(), "updates": None, "optimizer": None,
+                "train_args": train_args, "date": datetime.now().isoformat(),
+                "version": __version__}, path)
+
+
+def build_model(weights, names):
+    """DetectionModel for len(names) classes with every matching weight of `weights`."""
+    base = YOLO(weights).model
+    dm = DetectionModel(deepcopy(base.yaml), nc=len(names), verbose=False)
+    dm.load(base)
+    dm.names = dict(enumerate(names))
+    dm.args = get_cfg()
+    return dm
+
+
+def train_head(dm, train_cache, val_cache, freeze, epochs=5, batch=16, lr0=0.002, lrf=0.01,
+               weight_decay=5e-4, device="cpu", save_dir=None, train_args=None, seed=0):
+    dm.to(device)
+    for p in dm.parameters():
+        p.requires_grad = False
+    head = dm.model[freeze:]
+    decay, no_decay = [], []
+    for m in head.modules():
+        for name, p in m.named_parameters(recurse=False):
+            p.requires_grad = True
+            (no_decay if name == "bias" or isinstance(m, torch.nn.BatchNorm2d) else decay).append(p)
+    opt = torch.optim.AdamW([{"params": decay, "weight_decay": weight_decay},
+                             {"params": no_decay, "weight_decay": 0.0}], lr=lr0, betas=(0.9, 0.999))
+    criterion = v8DetectionLoss(dm)
+    ema = ModelEMA(dm)
+    nc = len(dm.names)
+    rng = np.random.default_rng(seed)
+    if not len(train_cache):
+        raise ValueError(f"no training samples in {train_cache.dir}; check the train split in data.yaml")
+    nb = math.ceil(len(train_cache) / batch)
+    total = epochs * nb
+    warmup = min(nb, 100)
+    weights_dir = Path(save_dir) / "weights"
+    weights_dir.mkdir(parents=True, exist_ok=True)
+    best, history = -1.0, []
+
+    with ThreadPoolExecutor(1) as prefetch:
+        for epoch in range(epochs):
+            head.train()
+            perm = rng.permutation(len(train_cache))
+            batches = [np.sort(perm[k * batch:(k + 1) * batch]) for k in range(nb)]
+            fut = prefetch.submit(train_cache.batch, batches[0], device)
+            tloss = torch.zeros(3)
+            for k in range(nb):
+                feats, tgt = fut.result()
+                if k + 1 < nb:
+                    fut = prefetch.submit(train_cache.batch, batches[k + 1], device)
+                it = epoch * nb + k
+                lr = lr0 * ((1 - it / total) * (1 - lrf) + lrf)
+                if it < warmup:
+                    lr *= (it + 1) / warmup
+                for g in opt.param_groups:
+                    g["lr"] = lr
+                preds = head_forward(dm, feats, freeze)
+                loss, items = criterion(preds, tgt)
+                loss.sum().backward()
+                torch.nn.utils.clip_grad_norm_(head.parameters(), max_norm=10.0)
+                opt.step()
+                opt.zero_grad()
+                ema.update(dm)
+                tloss = (tloss * k + items.cpu()) / (k + 1)
+            map50, map_ = validate_cached(ema.ema, val_cache, freeze, nc, device)
+            history.append({"epoch": epoch + 1, "box_loss": float(tloss[0]), "cls_loss": float(tloss[1]),
+                            "dfl_loss": float(tloss[2]), "map50": map50, "map": map_})
+            print(f"epoch {epoch + 1}/{epochs}  loss box {tloss[0]:.3f} cls {tloss[1]:.3f} "
+                  f"dfl {tloss[2]:.3f}  val mAP50 {map50:.3f} mAP50-95 {map_:.3f}")
+            fitness = 0.1 * map50 + 0.9 * map_
+            save_checkpoint(ema.ema, weights_dir / "last.pt", fitness, train_args or {})
+            if fitness > best:
+                best = fitness
+                save_checkpoint(ema.ema, weights_dir / "best.pt", fitness, train_args or {})
+    with open(Path(save_dir) / "head_training.json", "w") as f:
+        json.dump(history, f, indent=2)
+    return weights_dir / "best.pt"
+
+
+def split_files(data_yaml, key):
+    with open(data_yaml, "r") as f:
+        y = yaml.safe_load(f)
+    base = Path(y["path"]) if y.get("path") else Path(data_yaml).parent
+    src = Path(y[key]) if Path(y[key]).is_absolute() else base / y[key]
+    return get_img_files(src), y
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Train only the unfrozen layers from cached backbone features.")
+    ap.add_argument("--weights", default="yolov8n.pt")
+    ap.add_argument("--data", required=True, help="data.yaml")
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--freeze", type=int, default=10)
+    ap.add_argument("--epochs", type=int, default=5)
+    ap.add_argument("--batch", type=int, default=16)
+    ap.add_argument("--lr0", type=float, default=0.002)
+    ap.add_argument("--views", type=int, default=1, help="Cached views per train image (1 = no augmentation)")
+    ap.add_argument("--dtype", choices=["fp16", "int8"], default="fp16")
+    ap.add_argument("--cache-dir", default=None,
+                    help="Feature cache (default: <data.yaml dir>/.head_cache_<weights>_<imgsz>_f<freeze>)")
+    ap.add_argument("--device", default="cpu")
+    ap.add_argument("--project", default="runs/detect")
+    ap.add_argument("--name", default="head_cached")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    train_files, y = split_files(args.data, "train")
+    val_files, _ = split_files(args.data, "val")
+    names = y["names"] if isinstance(y["names"], list) else [y["names"][k] for k in sorted(y["names"])]
+    dm = build_model(args.weights, names)
+
+    cache_dir = Path(args.cache_dir) if args.cache_dir else \
+        Path(args.data).parent / f".head_cache_{Path(args.weights).stem}_{args.imgsz}_f{args.freeze}"
+    wkey = weights_hash(args.weights)
+    for split, files, views in (("train", train_files, args.views), ("val", val_files, 1)):
+        if not files:
+            raise SystemExit(f"No {split} images found for {args.data}")
+        key = (f"{wkey}:{args.imgsz}:{args.freeze}:{views}:{args.dtype}:{len(names)}:{args.seed}:"
+               f"{files_signature(files)}:v{CACHE_FORMAT}")
+        print(f"[{split}] {len(files)} images x {views} view(s)")
+        build_feature_cache(dm, files, cache_dir / split, args.imgsz, args.freeze, views=views,
+                            dtype=args.dtype, batch=args.batch, device=args.device,
+                            seed=args.seed, key=key)
+
+    save_dir = Path(args.project) / args.name
+    train_args = {"task": "detect", "mode": "train", "model": args.weights, "data": args.data,
+                  "imgsz": args.imgsz, "epochs": args.epochs, "batch": args.batch,
+                  "freeze": args.freeze, "lr0": args.lr0}
+    best = train_head(dm, FeatureCache(cache_dir / "train"), FeatureCache(cache_dir / "val"),
+                      args.freeze, epochs=args.epochs, batch=args.batch, lr0=args.lr0,
+                      device=args.device, save_dir=save_dir, train_args=train_args, seed=args.seed)
+    print(f"\n✅ Head weights: {best}")
+    print(f"Continue with: YOLO('{best}').train(data=..., freeze=0, ...)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import argparse
+import json
+import math
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+# Hyperparameter search with asynchronous successive halving (ASHA), driven by
+# a config file (see hparam_search_nc6.yaml).
+#
+# `trials` configurations are sampled from `space` (seeded, so trial i is the
+# same config on every run). Each rung trains for more epochs on a bigger
+# `fraction` of the train split. A config is promoted to the next rung as soon
+# as it ranks in the top 1/eta of the results finished at its rung, so the
+# worker processes never wait for a whole rung to complete. Only the best
+# configs ever reach the full budget.
+#
+# Every finished (trial, rung) is appended to <project>/<name>/results.jsonl.
+# Re-running the same command skips what is already there, so an interrupted
+# search resumes where it stopped (trials that were running are redone).
+
+RESULTS = "results.jsonl"
+METRIC_KEYS = {"map": "metrics/mAP50-95(B)", "map50": "metrics/mAP50(B)"}
+
+
+def sample_space(space, n, seed=0):
+    """
+    n configs from a search space. Each entry is either a list (choice) or a
+    dict with one of uniform: [lo, hi], log_uniform: [lo, hi], int: [lo, hi].
+    """
+    rng = np.random.default_rng(seed)
+    configs = []
+    for _ in range(n):
+        cfg = {}
+        for key, spec in space.items():
+            if isinstance(spec, list):
+                v = spec[rng.integers(len(spec))]
+            elif "uniform" in spec:
+                v = float(rng.uniform(*spec["uniform"]))
+            elif "log_uniform" in spec:
+                lo, hi = spec["log_uniform"]
+                v = float(math.exp(rng.uniform(math.log(lo), math.log(hi))))
+            elif "int" in spec:
+                lo, hi = spec["int"]
+                v = int(rng.integers(lo, hi + 1))
+            else:
+                raise ValueError(f"Unknown search space spec for '{key}': {spec}")
+            cfg[key] = v.item() if hasattr(v, "item") else v
+        configs.append(cfg)
+    return configs
+
+
+def load_results(path):
+    """{(trial, rung): record} from the results store."""
+    done = {}
+    if Path(path).exists():
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    r = json.loads(line)
+                    done[(r["trial"], r["rung"])] = r
+    return done
+
+
+def run_trial(job):
+    """Train one (trial, rung) in a worker process. Returns the result record."""
+    threads = job.get("threads")
+    if threads:
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+        import torch
+        torch.set_num_threads(threads)
+    from ultralytics import YOLO
+
+    t0 = time.time()
+    rec = {"trial": job["trial"], "rung": job["rung"], "params": job["params"],
+           "epochs": job["epochs"], "fraction": job["fraction"]}
+    try:
+        model = YOLO(job["model"])
+        model.train(data=job["data"], project=job["project"], name=job["run_name"],
+                    exist_ok=True, epochs=job["epochs"], fraction=job["fraction"],
+                    verbose=False, **job["defaults"], **job["params"])
+        metrics = model.trainer.metrics
+        rec["metric"] = float(metrics[METRIC_KEYS[job["metric"]]])
+        rec["status"] = "done"
+    except Exception as e:  # a bad config should not stop the search
+        rec["metric"] = None
+        rec["status"] = "failed"
+        rec["error"] = f"{type(e).__name__}: {e}"
+    rec["seconds"] = round(time.time() - t0, 1)
+    return rec
+
+
+class ASHA:
+    """Promotion bookkeeping; results are looked up in `done`."""
+
+    def __init__(self, n_trials, n_rungs, eta, done):
+        self.n_trials = n_trials
+        self.n_rungs = n_rungs
+        self.eta = eta
+        self.done = done
+        self.running = set()
+        self.next_trial = 0
+
+    def _finished(self, rung):
+        return [r for (t, k), r in self.done.items() if k == rung and r["status"] == "done"]
+
+    def next_job(self):
+        """(trial, rung) to start next, or None if nothing can start right now."""
+        # promotions first, from the highest rung down
+        for rung in range(self.n_rungs - 2, -1, -1):
+            fin = sorted(self._finished(rung), key=lambda r: -r["metric"])
+            top = fin[:len(fin) // self.eta]
+            for r in top:
+                key = (r["trial"], rung + 1)
+                if key not in self.done and key not in self.running:
+                    return key
+        while self.next_trial < self.n_trials:
+            key = (self.next_trial, 0)
+            self.next_trial += 1
+            if key not in self.done and key not in self.running:
+                return key
+        return None
+
+
+def run_search(cfg, parallel=None, threads=None):
+    out_dir = Path(cfg.get("project", "runs/hpsearch")) / cfg.get("name", "search")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    store = out_dir / RESULTS
+    done = load_results(store)
+    rungs = cfg["rungs"]
+    eta = int(cfg.get("eta", 3))
+    configs = sample_space(cfg["space"], int(cfg["trials"]), seed=int(cfg.get("seed", 0)))
+    parallel = parallel or int(cfg.get("parallel", max(1, (os.cpu_count() or 2) // 4)))
+    threads = threads or int(cfg.get("threads_per_trial", max(1, (os.cpu_count() or 1) // parallel)))
+    defaults = dict(cfg.get("defaults", {}))
+    defaults.setdefault("device", "cpu")
+    defaults.setdefault("plots", False)
+    if done:
+        print(f"⏯️ {len(done)} finished trial rungs found in {store}, resuming")
+
+    sched = ASHA(len(configs), len(rungs), eta, done)
+
+    def make_job(trial, rung):
+        return {"trial": trial, "rung": rung, "params": configs[trial], "model": cfg["model"],
+                "data": cfg["data"], "project": str(out_dir), "run_name": f"t{trial:03d}_r{rung}",
+                "epochs": int(rungs[rung]["epochs"]), "fraction": float(rungs[rung].get("fraction", 1.0)),
+                "defaults": defaults, "metric": cfg.get("metric", "map"), "threads": threads}
+
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(parallel, mp_context=ctx, max_tasks_per_child=1) as pool, \
+            open(store, "a") as sf:
+        futures = {}
+        while True:
+            while len(futures) < parallel:
+                key = sched.next_job()
+                if key is None:
+                    break
+                sched.running.add(key)
+                r = rungs[key[1]]
+                print(f"🚀 trial {key[0]} rung {key[1]} ({r['epochs']} ep, fraction "
+                      f"{r.get('fraction', 1.0)}): {configs[key[0]]}")
+                futures[pool.submit(run_trial, make_job(*key))] = key
+            if not futures:
+                break
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                key = futures.pop(fut)
+                sched.running.discard(key)
+                rec = fut.result()
+                done[key] = rec
+                sf.write(json.dumps(rec) + "\n")
+                sf.flush()
+                if rec["status"] == "done":
+                    print(f"[OK] trial {key[0]} rung {key[1]}: {cfg.get('metric', 'map')}="
+                          f"{rec['metric']:.4f} ({rec['seconds']} s)")
+                else:
+                    print(f"[WARN] trial {key[0]} rung {key[1]} failed: {rec.get('error')}")
+    return done, configs
+
+
+def leaderboard(done, top=10):
+    """Best result per trial, ranked by highest rung reached, then metric."""
+    best = {}
+    for (t, k), r in done.items():
+        if r["status"] != "done":
+            continue
+        if t not in best or (k, r["metric"]) > (best[t]["rung"], best[t]["metric"]):
+            best[t] = r
+    return sorted(best.values(), key=lambda r: (-r["rung"], -r["metric"]))[:top]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="ASHA hyperparameter search over YOLO training runs.")
+    ap.add_argument("config", help="Search config yaml (e.g. hparam_search_nc6.yaml)")
+    ap.add_argument("--parallel", type=int, default=None, help="Concurrent trials")
+    ap.add_argument("--threads", type=int, default=None, help="Torch threads per trial")
+    ap.add_argument("--report", action="store_true", help="Only print the leaderboard")
+    args = ap.parse_args()
+
+    with open(args.config, "r") as f:
+        cfg = yaml.safe_load(f)
+    if args.report:
+        out_dir = Path(cfg.get("project", "runs/hpsearch")) / cfg.get("name", "search")
+        done = load_results(out_dir / RESULTS)
+    else:
+        done, _ = run_search(cfg, parallel=args.parallel, threads=args.threads)
+
+    board = leaderboard(done)
+    n_rungs = len(cfg["rungs"])
+    print(f"\n{'trial':>6}{'rung':>6}{'metric':>9}  params")
+    for r in board:
+        print(f"{r['trial']:>6}{r['rung']:>6}{r['metric']:>9.4f}  {r['params']}")
+    if board:
+        n_epochs = sum(r["epochs"] * r["fraction"] for r in done.values())
+        full = len({t for t, _ in done}) * cfg["rungs"][-1]["epochs"]
+        print(f"\nCompute: {n_epochs:.1f} epoch-equivalents vs {full} for full runs of every trial")
+        if board[0]["rung"] == n_rungs - 1:
+            print("Best config (paste into a pipeline phase):")
+            print(yaml.safe_dump(board[0]["params"], sort_keys=False).rstrip())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 from ultralytics import YOLO
 
+from train_profiler import attach_profiler
+
 DATA_YAML = "/Users/juanpablogarza/Desktop/traffic_sign_dataset/data.yaml"
 
 model = YOLO("yolov8n.pt")
+attach_profiler(model)  # per-batch timing -> <run>/profile.csv
 
 model.train(data=DATA_YAML, 
             imgsz=640, 
@@ -0,0 +1,255 @@
+import argparse
+import glob
+import hashlib
+import os
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import yaml
+from tqdm import tqdm
+
+from yolo_io import SPLITS, detect_layout, split_dirs
+
+# Rebuilds the trainer's labels/<split>.cache files right after a dataset tool
+# changes the data, instead of leaving a stale cache (or a full rescan at the
+# next training start). Entries for image/label pairs that did not change are
+# copied from the old cache; only new or modified pairs are re-verified.
+#
+# The file format is the one ultralytics writes itself, plus one extra key,
+# "sigs" ({im_file: (img size, img mtime, label size, label mtime)}), which the
+# trainer ignores and which lets the next refresh tell untouched pairs apart.
+# Entries of a cache without "sigs" (one the trainer wrote) are all re-verified
+# once.
+
+# same list as ultralytics.data.utils.IMG_FORMATS
+IMG_FORMATS = {"bmp", "dng", "jpeg", "jpg", "mpo", "png", "tif", "tiff", "webp", "pfm", "heic"}
+YAML_KEYS = {"train": "train", "valid": "val", "test": "test"}
+
+
+def get_img_files(source):
+    """Image list the trainer would build for a data.yaml entry (dir or .txt list)."""
+    p = Path(source)
+    if p.is_dir():
+        files = glob.glob(str(p / "**" / "*.*"), recursive=True)
+    elif p.is_file():
+        parent = str(p.parent) + os.sep
+        with open(p, "r") as f:
+            files = [x.replace("./", parent) if x.startswith("./") else x
+                     for x in f.read().strip().splitlines()]
+    else:
+        return []
+    return sorted(x.replace("/", os.sep) for x in files
+                  if x.split(".")[-1].lower() in IMG_FORMATS)
+
+
+def img2label_paths(img_paths):
+    sa, sb = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    return [sb.join(x.rsplit(sa, 1)).rsplit(".", 1)[0] + ".txt" for x in img_paths]
+
+
+def get_hash(paths):
+    """Same hash the trainer uses to decide whether a cache is current."""
+    size = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+    h = hashlib.sha256(str(size).encode())
+    h.update("".join(paths).encode())
+    return h.hexdigest()
+
+
+def cache_path_for(label_files):
+    return Path(label_files[0]).parent.with_suffix(".cache")
+
+
+def load_cache(path):
+    try:
+        return np.load(str(path), allow_pickle=True).item()
+    except (OSError, ValueError, EOFError):
+        return None
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    except OSError:
+        return -1, -1
+
+
+def _sig(im_file, lb_file):
+    return _stat(im_file) + _stat(lb_file)
+
+
+def _verify(args):
+    from ultralytics.data.utils import verify_image_label
+    return verify_image_label(args)
+
+
+def _entry(im_file, lb, shape, segments, keypoint):
+    return {"im_file": im_file, "shape": shape, "cls": lb[:, 0:1], "bboxes": lb[:, 1:],
+            "segments": segments, "keypoints": keypoint, "normalized": True,
+            "bbox_format": "xywh"}
+
+
+def rebuild_cache(im_files, nc, workers=None, prefix=""):
+    """
+    Bring the cache for one image list up to date.
+    Returns (cache_path, n_reused, n_verified), or (cache_path, -1, -1) if the
+    cache was already current.
+    """
+    from ultralytics.data.utils import DATASET_CACHE_VERSION
+
+    label_files = img2label_paths(im_files)
+    path = cache_path_for(label_files)
+    want_hash = get_hash(label_files + im_files)
+
+    old = load_cache(path) if path.exists() else None
+    if old and old.get("version") == DATASET_CACHE_VERSION and old.get("hash") == want_hash:
+        return path, -1, -1
+
+    old_entries, old_sigs = {}, {}
+    if old and old.get("version") == DATASET_CACHE_VERSION:
+        old_entries = {lb["im_file"]: lb for lb in old.get("labels", [])}
+        old_sigs = old.get("sigs", {})
+
+    sigs = {}
+    reuse, todo = {}, []
+    for im_file, lb_file in zip(im_files, label_files):
+        sig = _sig(im_file, lb_file)
+        sigs[im_file] = sig
+        entry = old_entries.get(im_file)
+        # entries without a sig (caches written by the trainer) are re-verified:
+        # copy2 / hardlinks keep old mtimes, so "older than the cache" proves nothing
+        if entry is not None and im_file in old_sigs and tuple(old_sigs[im_file]) == sig:
+            reuse[im_file] = entry
+            continue
+        todo.append((im_file, lb_file, prefix, False, nc, 0, 3, False))
+
+    x = {"labels": [], "msgs": []}
+    nm = nf = ne = n_corrupt = 0
+    verified = {}
+    if todo:
+        with Pool(workers or os.cpu_count() or 1) as pool:
+            results = pool.imap(_verify, todo, chunksize=32)
+            for im_file, lb, shape, segments, keypoint, nm_f, nf_f, ne_f, nc_f, msg in tqdm(
+                    results, total=len(todo), desc=f"{prefix}verifying {path.name}"):
+                nm += nm_f
+                nf += nf_f
+                ne += ne_f
+                n_corrupt += nc_f
+                if im_file:
+                    verified[im_file] = _entry(im_file, lb, shape, segments, keypoint)
+                if msg:
+                    x["msgs"].append(msg)
+
+    for im_file, lb_file in zip(im_files, label_files):
+        if im_file in reuse:
+            entry = reuse[im_file]
+            if sigs[im_file][2] >= 0:
+                nf += 1
+                ne += int(len(entry["cls"]) == 0)
+            else:
+                nm += 1
+            x["labels"].append(entry)
+        elif im_file in verified:
+            x["labels"].append(verified[im_file])
+
+    x["hash"] = want_hash
+    x["results"] = nf, nm, ne, n_corrupt, len(im_files)
+    x["version"] = DATASET_CACHE_VERSION
+    x["sigs"] = sigs
+
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, x)
+    os.replace(tmp, path)
+    return path, len(reuse), len(todo)
+
+
+def split_sources(root: Path, data_yaml: Path = None):
+    """
+    {split: image source} for the dataset at `root`. data.yaml entries win when
+    they exist on this machine (dirs or manifest .txt files); otherwise the
+    split image folders of the detected layout are used.
+    """
+    root = Path(root)
+    data_yaml = Path(data_yaml) if data_yaml else root / "data.yaml"
+    y = {}
+    if data_yaml.exists():
+        with open(data_yaml, "r") as f:
+            y = yaml.safe_load(f) or {}
+    base = Path(y["path"]) if y.get("path") else data_yaml.parent
+    layout = detect_layout(root)
+
+    sources = {}
+    for sp in SPLITS:
+        entry = y.get(YAML_KEYS[sp])
+        if entry:
+            p = Path(entry) if Path(entry).is_absolute() else base / entry
+            if p.exists():
+                sources[sp] = str(p)
+                continue
+        if layout:
+            for cand in ([sp, "val"] if sp == "valid" else [sp]):
+                img_dir = split_dirs(root, cand, layout)[0]
+                if img_dir.is_dir():
+                    sources[sp] = str(img_dir)
+                    break
+    return sources
+
+
+def refresh_caches(root: Path, data_yaml: Path = None, workers=None):
+    """
+    Rebuild every stale split cache of a dataset. Call this at the end of any
+    tool that adds, removes or rewrites images/labels.
+    Without ultralytics installed the stale caches are deleted instead, so the
+    trainer can never pick one up.
+    """
+    root = Path(root)
+    data_yaml = Path(data_yaml) if data_yaml else root / "data.yaml"
+    nc = None
+    if data_yaml.exists():
+        with open(data_yaml, "r") as f:
+            y = yaml.safe_load(f) or {}
+        names = y.get("names") or []
+        nc = y.get("nc") or len(names)
+
+    try:
+        import ultralytics  # noqa: F401
+        have_ul = True
+    except ImportError:
+        have_ul = False
+
+    for sp, source in split_sources(root, data_yaml).items():
+        im_files = get_img_files(source)
+        if not im_files:
+            continue
+        path = cache_path_for(img2label_paths(im_files))
+        if not have_ul or not nc:
+            old = load_cache(path) if path.exists() else None
+            if old and old.get("hash") == get_hash(img2label_paths(im_files) + im_files):
+                continue
+            if path.exists():
+                path.unlink()
+                why = "install ultralytics" if not have_ul else "add names to data.yaml"
+                print(f"[cache] {sp}: removed {path} ({why} to rebuild it)")
+            continue
+        path, n_reused, n_verified = rebuild_cache(im_files, nc, workers=workers,
+                                                   prefix=f"{sp}: ")
+        if n_verified < 0:
+            print(f"[cache] {sp}: {path} is up to date")
+        else:
+            print(f"[cache] {sp}: rebuilt {path} "
+                  f"({n_reused} reused, {n_verified} verified)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Rebuild stale YOLO label caches incrementally.")
+    ap.add_argument("--root", required=True, help="Dataset root")
+    ap.add_argument("--data", default=None, help="data.yaml (default: <root>/data.yaml)")
+    ap.add_argument("--workers", type=int, default=None)
+    args = ap.parse_args()
+    refresh_caches(Path(args.root), data_yaml=args.data, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
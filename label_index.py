@@ -0,0 +1,349 @@
+import argparse
+import json
+import os
+import shutil
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from yolo_io import detect_layout, find_splits, split_dirs, write_atomic
+
+# Columnar index of a labels folder, stored next to it as <labels>/<split>.index/
+# (same place the trainer puts <split>.cache). Every array is a plain .npy so
+# it can be memory-mapped:
+#   img_off  (M+1,) int64    rows of image i are img_off[i]:img_off[i+1]
+#   cls      (N,)   int32    class id per row
+#   bbox     (N,4)  float32  normalized xywh per row (tight box for polygons)
+#   poly_off (N+1,) int64    vertices of row j are poly[poly_off[j]:poly_off[j+1]]
+#   poly     (P,2)  float32  polygon vertices, empty range for plain bbox rows
+# meta.json holds the stems plus size/mtime of every label file, which is what
+# makes rebuilds incremental.
+
+INDEX_VERSION = 1
+ARRAYS = ("img_off", "cls", "bbox", "poly_off", "poly")
+
+
+def index_dir_for(lbl_dir: Path):
+    lbl_dir = Path(lbl_dir)
+    return lbl_dir.with_name(lbl_dir.name + ".index")
+
+
+def parse_label_file(path):
+    """
+    Parse one YOLO txt into (cls, bbox, poly_len, poly) arrays.
+    Rows with 4 coords are boxes, rows with an even number >= 6 are polygons.
+    Anything else is malformed and skipped.
+    """
+    cls, boxes, lens, verts = [], [], [], []
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            try:
+                cid = int(parts[0])
+                xy = np.array(parts[1:], dtype=np.float32)
+            except ValueError:
+                continue
+            if xy.size == 4:
+                cls.append(cid)
+                boxes.append(xy)
+                lens.append(0)
+            elif xy.size >= 6 and xy.size % 2 == 0:
+                pts = xy.reshape(-1, 2)
+                lo, hi = pts.min(0), pts.max(0)
+                cls.append(cid)
+                boxes.append(np.concatenate([(lo + hi) / 2, hi - lo]))
+                lens.append(len(pts))
+                verts.append(pts)
+    return (np.array(cls, dtype=np.int32),
+            np.array(boxes, dtype=np.float32).reshape(-1, 4),
+            np.array(lens, dtype=np.int64),
+            np.concatenate(verts) if verts else np.zeros((0, 2), np.float32))
+
+
+def _parse_task(path):
+    return path, parse_label_file(path)
+
+
+def _scan(lbl_dir):
+    """stem -> (path, size, mtime_ns) for every label file, one directory scan."""
+    out = {}
+    with os.scandir(lbl_dir) as it:
+        for e in it:
+            if e.is_file() and e.name.endswith(".txt"):
+                st = e.stat()
+                out[e.name[:-4]] = (e.path, st.st_size, st.st_mtime_ns)
+    return out
+
+
+class LabelIndex:
+    """All annotations of one split as packed arrays plus per-image offsets."""
+
+    def __init__(self, stems, img_off, cls, bbox, poly_off, poly, sigs=None):
+        self.stems = list(stems)
+        self.img_off = img_off
+        self.cls = cls
+        self.bbox = bbox
+        self.poly_off = poly_off
+        self.poly = poly
+        self.sigs = sigs or {}
+
+    def __len__(self):
+        return len(self.stems)
+
+    @property
+    def n_rows(self):
+        return len(self.cls)
+
+    def row_image(self):
+        """Image index of every row."""
+        return np.repeat(np.arange(len(self.stems)), np.diff(self.img_off))
+
+    def is_polygon(self):
+        return np.diff(self.poly_off) > 0
+
+    # ---- persistence -------------------------------------------------------
+
+    @classmethod
+    def load(cls, index_dir, mmap=True):
+        index_dir = Path(index_dir)
+        with open(index_dir / "meta.json", "r") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported index version in {index_dir}")
+        mode = "r" if mmap else None
+        arrays = {k: np.load(index_dir / f"{k}.npy", mmap_mode=mode) for k in ARRAYS}
+        sigs = {s: tuple(v) for s, v in zip(meta["stems"], meta["sigs"])}
+        return cls(meta["stems"], sigs=sigs, **arrays)
+
+    def save(self, index_dir):
+        """Write to a temp dir and swap it in, so a crash never leaves half an index."""
+        index_dir = Path(index_dir)
+        tmp = index_dir.with_name(index_dir.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for k in ARRAYS:
+            np.save(tmp / f"{k}.npy", np.ascontiguousarray(getattr(self, k)))
+        meta = {"version": INDEX_VERSION, "stems": self.stems,
+                "sigs": [list(self.sigs.get(s, (-1, -1))) for s in self.stems]}
+        with open(tmp / "meta.json", "w") as f:
+            json.dump(meta, f)
+        old = index_dir.with_name(index_dir.name + ".old")
+        if index_dir.exists():
+            shutil.rmtree(old, ignore_errors=True)
+            os.replace(index_dir, old)
+        os.replace(tmp, index_dir)
+        shutil.rmtree(old, ignore_errors=True)
+
+    # ---- vectorized queries ------------------------------------------------
+
+    def images_with_classes(self, ids):
+        """Bool mask over images: True if the image has at least one row in `ids`."""
+        mask = np.zeros(len(self.stems), dtype=bool)
+        hit = np.isin(self.cls, np.fromiter(ids, dtype=np.int64))
+        mask[self.row_image()[hit]] = True
+        return mask
+
+    def class_counts(self, nc=None):
+        nc = nc or (int(self.cls.max()) + 1 if self.n_rows else 0)
+        return np.bincount(self.cls, minlength=nc)
+
+    def select_rows(self, keep):
+        """New in-memory index with only the rows where `keep` is True (images are kept)."""
+        keep = np.asarray(keep, dtype=bool)
+        row_img = self.row_image()
+        counts = np.bincount(row_img[keep], minlength=len(self.stems))
+        img_off = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        lens = np.diff(self.poly_off)[keep]
+        poly_off = np.concatenate([[0], np.cumsum(lens)]).astype(np.int64)
+        # gather ragged polygon slices without a Python loop
+        starts = self.poly_off[:-1][keep]
+        idx = np.repeat(starts - poly_off[:-1], lens) + np.arange(poly_off[-1])
+        return LabelIndex(self.stems, img_off, np.asarray(self.cls)[keep],
+                          np.asarray(self.bbox)[keep], poly_off,
+                          np.asarray(self.poly)[idx], dict(self.sigs))
+
+    def remap(self, mapping):
+        """
+        Rewrite class ids with an {old_id: new_id} dict; rows whose id is not in
+        the dict are dropped (same rule as remap_split). One lookup-table gather.
+        """
+        if not self.n_rows:
+            return self
+        size = max(int(self.cls.max()), max(mapping)) + 1
+        lut = np.full(size, -1, dtype=np.int32)
+        lut[list(mapping.keys())] = list(mapping.values())
+        new_cls = lut[np.clip(self.cls, 0, size - 1)]
+        new_cls[self.cls < 0] = -1
+        out = self.select_rows(new_cls >= 0)
+        out.cls = new_cls[new_cls >= 0]
+        return out
+
+    def apply_ops(self, ops):
+        """Apply a dataset_engine op chain ("remap"/"keep" dicts) vectorized."""
+        out = self
+        for kind, arg in ops:
+            if kind in ("remap", "keep"):
+                out = out.remap(arg)
+        return out
+
+    # ---- export ------------------------------------------------------------
+
+    def export(self, out_dir, only=None, skip_empty=True):
+        """
+        Write YOLO txt files to `out_dir`. Polygon rows are written back as
+        polygons, bbox rows as xywh. `only` is an optional bool mask over images.
+        Returns the number of files written.
+        """
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        poly_off = np.asarray(self.poly_off)
+        written = 0
+        for i, stem in enumerate(self.stems):
+            if only is not None and not only[i]:
+                continue
+            a, b = int(self.img_off[i]), int(self.img_off[i + 1])
+            if a == b and skip_empty:
+                continue
+            lines = []
+            for j in range(a, b):
+                p0, p1 = poly_off[j], poly_off[j + 1]
+                coords = self.poly[p0:p1].ravel() if p1 > p0 else self.bbox[j]
+                lines.append(f"{int(self.cls[j])} " + " ".join(f"{v:.6f}" for v in coords) + "\n")
+            write_atomic(out_dir / f"{stem}.txt", "".join(lines))
+            written += 1
+        return written
+
+
+def _concat(parts):
+    """Stitch per-image (cls, bbox, poly_len, poly) parts into one LabelIndex body."""
+    n_rows = np.array([len(p[0]) for p in parts], dtype=np.int64)
+    img_off = np.concatenate([[0], np.cumsum(n_rows)]).astype(np.int64)
+    if parts:
+        cls = np.concatenate([p[0] for p in parts]).astype(np.int32)
+        bbox = np.concatenate([p[1] for p in parts]).astype(np.float32).reshape(-1, 4)
+        lens = np.concatenate([p[2] for p in parts]).astype(np.int64)
+        poly = np.concatenate([p[3] for p in parts]).astype(np.float32).reshape(-1, 2)
+    else:
+        cls, bbox = np.zeros(0, np.int32), np.zeros((0, 4), np.float32)
+        lens, poly = np.zeros(0, np.int64), np.zeros((0, 2), np.float32)
+    poly_off = np.concatenate([[0], np.cumsum(lens)]).astype(np.int64)
+    return img_off, cls, bbox, poly_off, poly
+
+
+def build_index(lbl_dir: Path, workers=None, verbose=True):
+    """
+    Build or incrementally refresh the index for one labels folder.
+    Files whose size and mtime match the previous index are not re-read.
+    Returns (index, n_parsed).
+    """
+    lbl_dir = Path(lbl_dir)
+    index_dir = index_dir_for(lbl_dir)
+    files = _scan(lbl_dir) if lbl_dir.is_dir() else {}
+
+    old = None
+    if (index_dir / "meta.json").exists():
+        try:
+            old = LabelIndex.load(index_dir)
+        except (ValueError, OSError, KeyError):
+            old = None
+    old_pos = {s: i for i, s in enumerate(old.stems)} if old else {}
+
+    stems = sorted(files)
+    stale = [s for s in stems
+             if s not in old_pos or old.sigs.get(s) != (files[s][1], files[s][2])]
+
+    if old is not None and not stale and len(stems) == len(old.stems):
+        return old, 0
+
+    parsed = {}
+    if stale:
+        paths = [files[s][0] for s in stale]
+        if len(paths) > 256 and (workers is None or workers > 1):
+            with Pool(workers or os.cpu_count() or 1) as pool:
+                it = pool.imap_unordered(_parse_task, paths, chunksize=128)
+                for path, part in tqdm(it, total=len(paths), desc=f"indexing {lbl_dir.name}",
+                                       disable=not verbose):
+                    parsed[Path(path).stem] = part
+        else:
+            for path in paths:
+                parsed[Path(path).stem] = parse_label_file(path)
+
+    parts = []
+    for s in stems:
+        if s in parsed:
+            parts.append(parsed[s])
+            continue
+        i = old_pos[s]
+        a, b = int(old.img_off[i]), int(old.img_off[i + 1])
+        p0, p1 = int(old.poly_off[a]), int(old.poly_off[b])
+        parts.append((np.asarray(old.cls[a:b]), np.asarray(old.bbox[a:b]),
+                      np.diff(old.poly_off[a:b + 1]), np.asarray(old.poly[p0:p1])))
+
+    sigs = {s: (files[s][1], files[s][2]) for s in stems}
+    index = LabelIndex(stems, *_concat(parts), sigs=sigs)
+    index.save(index_dir)
+    return LabelIndex.load(index_dir), len(stale)
+
+
+def build_dataset_index(root: Path, splits=None, workers=None):
+    """Refresh the index of every split under a dataset root. Returns {split: index}."""
+    root = Path(root)
+    layout = detect_layout(root)
+    if layout is None:
+        raise RuntimeError(f"Could not find images/labels folders under {root}")
+    out = {}
+    for sp in splits or find_splits(root, layout):
+        _, lbl_dir = split_dirs(root, sp, layout)
+        if not lbl_dir.is_dir():
+            continue
+        out[sp], n_parsed = build_index(lbl_dir, workers=workers)
+        print(f"[{sp}] {len(out[sp])} label files, {out[sp].n_rows} rows "
+              f"({n_parsed} re-parsed)")
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build / query the columnar label index.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("build", help="Build or incrementally refresh the index")
+    b.add_argument("--root", required=True, help="Dataset root")
+    b.add_argument("--splits", nargs="+", default=None)
+    b.add_argument("--workers", type=int, default=None)
+
+    e = sub.add_parser("export", help="Export (optionally remapped/filtered) labels to YOLO txt")
+    e.add_argument("--root", required=True, help="Dataset root")
+    e.add_argument("--split", required=True)
+    e.add_argument("--out", required=True, help="Output labels folder")
+    e.add_argument("--remap", action="store_true",
+                   help="Apply OLD_TO_NEW / NEW_CLASS_NAMES from remap_ids.py")
+    e.add_argument("--keep", nargs="+", default=None, help="Class names to keep")
+    args = ap.parse_args()
+
+    if args.cmd == "build":
+        build_dataset_index(Path(args.root), splits=args.splits, workers=args.workers)
+        return
+
+    from dataset_engine import build_ops
+    from yolo_io import load_names
+
+    root = Path(args.root)
+    index = build_dataset_index(root, splits=[args.split])[args.split]
+    names, _ = load_names(root / "data.yaml")
+    remap, new_names = None, None
+    if args.remap:
+        from remap_ids import NEW_CLASS_NAMES, OLD_TO_NEW
+        remap, new_names = OLD_TO_NEW, NEW_CLASS_NAMES
+    ops, final_names = build_ops(names, remap=remap, new_names=new_names, keep=args.keep)
+    out = index.apply_ops(ops)
+    n = out.export(Path(args.out))
+    print(f"✅ Wrote {n} label files to {args.out} (names: {final_names})")
+
+
+if __name__ == "__main__":
+    main()
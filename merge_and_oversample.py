@@ -1,11 +1,15 @@
 import os
-import shutil
 import argparse
 
+import yaml
+
+from label_cache import refresh_caches
+from yolo_io import place_file
+
 IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
 
 
-def copy_split(new_root, base_root, split, oversample=1, prefix="f1_"):
+def copy_split(new_root, base_root, split, oversample=1, prefix="f1_", mode="copy"):
     """
     Copy images+labels from:
         new_root/{split}/images, new_root/{split}/labels
@@ -13,6 +17,8 @@ def copy_split(new_root, base_root, split, oversample=1, prefix="f1_"):
         base_root/images/{split}, base_root/labels/{split}
 
     For train split, you can oversample by copying each example `oversample` times.
+    With mode="link" the image copies are hardlinks (symlinks as fallback), so
+    the merge costs almost no extra disk or I/O; labels are always copied.
     """
     src_img_dir = os.path.join(new_root, split, "images")
     src_lbl_dir = os.path.join(new_root, split, "labels")
@@ -54,14 +60,73 @@ def copy_split(new_root, base_root, split, oversample=1, prefix="f1_"):
             dst_img_path = os.path.join(dst_img_dir, new_stem + ext)
             dst_lbl_path = os.path.join(dst_lbl_dir, new_stem + ".txt")
 
-            shutil.copy2(src_img_path, dst_img_path)
-            shutil.copy2(src_lbl_path, dst_lbl_path)
+            place_file(src_img_path, dst_img_path, mode)
+            # labels are always real copies: tools like remap_ids.py rewrite
+            # them in place, which would hit every _dupN and the source too
+            place_file(src_lbl_path, dst_lbl_path, "copy")
             n_copied += 1
 
-    print(f"[OK] Split '{split}': copied {n_copied} image+label pairs "
+    verb = "linked" if mode == "link" else "copied"
+    print(f"[OK] Split '{split}': {verb} {n_copied} image+label pairs "
           f"({'x'+str(oversample) if split=='train' else 'no oversample'})")
 
 
+def list_split_images(img_dir, lbl_dir):
+    """Sorted image paths in img_dir that have a matching label in lbl_dir."""
+    if not os.path.isdir(img_dir) or not os.path.isdir(lbl_dir):
+        return []
+    out = []
+    for f in sorted(os.listdir(img_dir)):
+        stem, ext = os.path.splitext(f)
+        if ext.lower() in IMAGE_EXTS and os.path.isfile(os.path.join(lbl_dir, stem + ".txt")):
+            out.append(os.path.abspath(os.path.join(img_dir, f)))
+    return out
+
+
+def write_manifest(new_root, base_root, split, oversample=1):
+    """
+    Manifest mode: instead of touching any image, write base_root/{split}.txt
+    listing every base image plus every new image (repeated `oversample` times
+    for train). The trainer finds each label by swapping /images/ for /labels/
+    in the path, so new images keep using the labels in new_root.
+    Returns the manifest path, or None if the split has no images at all.
+    """
+    base_imgs = list_split_images(os.path.join(base_root, "images", split),
+                                  os.path.join(base_root, "labels", split))
+    new_imgs = list_split_images(os.path.join(new_root, split, "images"),
+                                 os.path.join(new_root, split, "labels"))
+    if not base_imgs and not new_imgs:
+        print(f"[WARN] Skipping split '{split}' — no labelled images found.")
+        return None
+
+    repeat = oversample if split == "train" else 1
+    lines = base_imgs + new_imgs * repeat
+
+    manifest = os.path.join(base_root, f"{split}.txt")
+    with open(manifest, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    print(f"[OK] Split '{split}': manifest with {len(base_imgs)} base + "
+          f"{len(new_imgs)}x{repeat} new entries -> {manifest}")
+    return manifest
+
+
+def point_yaml_at_manifests(base_root, manifests):
+    """Point data.yaml train/val/test at the manifest files."""
+    yaml_path = os.path.join(base_root, "data.yaml")
+    if not os.path.isfile(yaml_path):
+        print(f"[WARN] No data.yaml in {base_root}; point train/val/test at the manifests yourself.")
+        return
+    with open(yaml_path, "r") as f:
+        y = yaml.safe_load(f)
+    keys = {"train": "train", "valid": "val", "test": "test"}
+    for split, manifest in manifests.items():
+        y[keys[split]] = manifest
+    with open(yaml_path, "w") as f:
+        yaml.safe_dump(y, f, sort_keys=False)
+    print(f"[OK] Updated {yaml_path} to use the manifests")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Merge new F1TENTH-like YOLOv8 dataset into base dataset and oversample train."
@@ -74,21 +139,40 @@ def main():
                         help="Oversampling factor for TRAIN split (default: 2).")
     parser.add_argument("--prefix", type=str, default="f1_",
                         help="Filename prefix for new images/labels to avoid collisions.")
+    parser.add_argument("--mode", choices=["copy", "link", "manifest"], default="copy",
+                        help="copy files (default), hardlink/symlink images (labels are copied), or only write "
+                             "train.txt/valid.txt/test.txt image lists and point data.yaml at them.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Do not rebuild the stale labels/*.cache files after merging.")
 
     args = parser.parse_args()
 
     print(f"New dataset root : {args.new_root}")
     print(f"Base dataset root: {args.base_root}")
     print(f"Oversample factor (train): {args.oversample}")
+    print(f"Mode             : {args.mode}")
     print()
 
-    for split in ["train", "valid", "test"]:
-        copy_split(args.new_root, args.base_root, split,
-                   oversample=args.oversample, prefix=args.prefix)
-
-    print("\n[NOTE] Now delete YOLO cache files so it sees the new data:")
-    print(f"  rm {os.path.join(args.base_root, 'labels', 'train.cache')}  (if exists)")
-    print(f"  rm {os.path.join(args.base_root, 'labels', 'valid.cache')}  (if exists)")
+    if args.mode == "manifest":
+        manifests = {}
+        for split in ["train", "valid", "test"]:
+            manifest = write_manifest(args.new_root, args.base_root, split,
+                                      oversample=args.oversample)
+            if manifest:
+                manifests[split] = manifest
+        point_yaml_at_manifests(args.base_root, manifests)
+    else:
+        for split in ["train", "valid", "test"]:
+            copy_split(args.new_root, args.base_root, split,
+                       oversample=args.oversample, prefix=args.prefix, mode=args.mode)
+
+    if args.no_cache:
+        print("\n[NOTE] Now delete YOLO cache files so it sees the new data:")
+        print(f"  rm {os.path.join(args.base_root, 'labels', 'train.cache')}  (if exists)")
+        print(f"  rm {os.path.join(args.base_root, 'labels', 'valid.cache')}  (if exists)")
+    else:
+        print()
+        refresh_caches(args.base_root)
     print("\nThen fine-tune starting from your best model.")
 
 
@@ -0,0 +1,322 @@
+import argparse
+import io
+import os
+import tarfile
+from multiprocessing import Pool
+from pathlib import Path
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from label_cache import refresh_caches
+from yolo_io import (LAYOUT_FLAT, detect_layout, find_splits, list_images, list_labels,
+                     load_names, split_dirs, write_data_yaml)
+
+try:  # ShardStream must be a real IterableDataset or DataLoader treats it as map-style
+    from torch.utils.data import IterableDataset as _StreamBase
+except ImportError:
+    _StreamBase = object
+
+# Packs every split into a few plain tar shards (image and its label txt are
+# adjacent members), so copying / rsyncing a dataset moves a handful of large
+# files instead of ~16k small ones:
+#   <out>/data.yaml
+#   <out>/<split>/shard_00000.tar ...   <stem>.jpg, <stem>.txt, <stem>.jpg, ...
+#   <out>/<split>/index.npz             stem, shard, byte offset/size of image and label
+# The shards are ordinary tars (tar -tf works), the index gives random access.
+#
+#   iter_samples(<out>/<split>, worker_id, num_workers)  sequential streaming,
+#       whole shards per worker (ShardStream wraps it for a torch DataLoader)
+#   predict_stream.py --source <out>/<split>             inference on a pack
+#   python pack_dataset.py unpack <out> <root>           back to images|labels/<split>
+#
+# Workers stream whole shards, so a split needs at least as many shards as
+# DataLoader workers: shards are capped at --shard-mb and a split is also cut
+# into at least --min-shards pieces, however small it is.
+#
+# The ultralytics trainer reads files, so a training box unpacks once locally
+# (sequential reads, no per-file network overhead) before training.
+
+SHARD_BYTES = 64 << 20
+MIN_SHARDS = 16
+INDEX = "index.npz"
+PACK_VERSION = 1
+
+
+def is_packed(path):
+    return Path(path).is_dir() and (Path(path) / INDEX).exists()
+
+
+# ---- packing ----------------------------------------------------------------
+
+def plan_shards(pairs, shard_bytes=SHARD_BYTES, min_shards=MIN_SHARDS):
+    """
+    Group (stem, img, lbl) into consecutive shards of about shard_bytes each,
+    smaller if needed so there are at least min_shards (one image each at most).
+    """
+    sizes = [os.path.getsize(img) + (os.path.getsize(lbl) if lbl else 0) for _, img, lbl in pairs]
+    shard_bytes = min(shard_bytes, -(-sum(sizes) // max(min_shards, 1)))
+    shards, cur, size = [], [], 0
+    for (stem, img, lbl), n in zip(pairs, sizes):
+        if cur and size + n > shard_bytes:
+            shards.append(cur)
+            cur, size = [], 0
+        cur.append((stem, str(img), str(lbl) if lbl else None))
+        size += n
+    if cur:
+        shards.append(cur)
+    return shards
+
+
+def _add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = 0  # reproducible shards
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_shard(task):
+    """Write one shard, then read its headers back for the byte offsets."""
+    path, items = task
+    tmp = Path(str(path) + ".tmp")
+    with tarfile.open(tmp, "w", format=tarfile.PAX_FORMAT) as tar:
+        for stem, img, lbl in items:
+            with open(img, "rb") as f:
+                _add_bytes(tar, stem + Path(img).suffix, f.read())
+            if lbl:
+                with open(lbl, "rb") as f:
+                    _add_bytes(tar, stem + ".txt", f.read())
+    os.replace(tmp, path)
+
+    pos = {}
+    with tarfile.open(path, "r") as tar:
+        for m in tar:
+            pos[m.name] = (m.offset_data, m.size)
+    rows = []
+    for stem, img, lbl in items:
+        io_, is_ = pos[stem + Path(img).suffix]
+        lo, ls = pos.get(stem + ".txt", (-1, 0)) if lbl else (-1, 0)
+        rows.append((stem, Path(img).suffix, io_, is_, lo, ls))
+    return rows
+
+
+def pack_split(img_dir, lbl_dir, out_dir, shard_bytes=SHARD_BYTES, workers=None,
+               min_shards=MIN_SHARDS):
+    """Pack one split; images without labels are kept (background), orphan labels are not."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for old in out_dir.glob("shard_*.tar"):
+        old.unlink()
+    imgs, lbls = list_images(img_dir), list_labels(lbl_dir)
+    pairs = [(s, imgs[s], lbls.get(s)) for s in sorted(imgs)]
+    shards = plan_shards(pairs, shard_bytes, min_shards)
+    tasks = [(out_dir / f"shard_{i:05d}.tar", items) for i, items in enumerate(shards)]
+
+    cols = {k: [] for k in ("stem", "ext", "shard", "img_off", "img_size", "lbl_off", "lbl_size")}
+    with Pool(min(workers or os.cpu_count() or 1, max(len(tasks), 1))) as pool:
+        for i, rows in enumerate(tqdm(pool.imap(write_shard, tasks), total=len(tasks),
+                                      desc=f"packing {out_dir.name}")):
+            for stem, ext, io_, is_, lo, ls in rows:
+                for k, v in zip(cols, (stem, ext, i, io_, is_, lo, ls)):
+                    cols[k].append(v)
+    np.savez(out_dir / INDEX, version=PACK_VERSION, n_shards=len(tasks),
+             stem=np.array(cols["stem"]), ext=np.array(cols["ext"]),
+             **{k: np.array(cols[k], dtype=np.int64) for k in list(cols)[2:]})
+    n_unlabeled = sum(1 for _, _, lbl in pairs if lbl is None)
+    return len(pairs), len(tasks), n_unlabeled, len(set(lbls) - set(imgs))
+
+
+def pack_dataset(root, out, splits=None, shard_bytes=SHARD_BYTES, workers=None,
+                 min_shards=MIN_SHARDS):
+    root, out = Path(root), Path(out)
+    layout = detect_layout(root)
+    if layout is None:
+        raise RuntimeError(f"Could not find images/labels folders under {root}")
+    splits = splits or find_splits(root, layout)
+    out.mkdir(parents=True, exist_ok=True)
+    for sp in splits:
+        img_dir, lbl_dir = split_dirs(root, sp, layout)
+        n, n_shards, n_unl, n_orph = pack_split(img_dir, lbl_dir, out / sp, shard_bytes, workers,
+                                              min_shards)
+        print(f"[OK] {sp}: {n} images in {n_shards} shards "
+              f"({n_unl} without labels, {n_orph} orphan labels skipped)")
+    if (root / "data.yaml").exists():
+        with open(root / "data.yaml", "r") as f:
+            text = f.read()
+        with open(out / "data.yaml", "w") as f:
+            f.write(text)
+    return splits
+
+
+# ---- reading ----------------------------------------------------------------
+
+class PackIndex:
+    """Random access into a packed split."""
+
+    def __init__(self, split_dir):
+        self.dir = Path(split_dir)
+        z = np.load(self.dir / INDEX)
+        self.stems = z["stem"].tolist()
+        self.ext = z["ext"].tolist()
+        self.n_shards = int(z["n_shards"])
+        self.shard, self.img_off, self.img_size = z["shard"], z["img_off"], z["img_size"]
+        self.lbl_off, self.lbl_size = z["lbl_off"], z["lbl_size"]
+        self._pos = {s: i for i, s in enumerate(self.stems)}
+
+    def __len__(self):
+        return len(self.stems)
+
+    def shard_path(self, k):
+        return self.dir / f"shard_{k:05d}.tar"
+
+    def read(self, i):
+        """(stem, image bytes, label text or None) for sample i (or a stem)."""
+        i = self._pos[i] if isinstance(i, str) else i
+        with open(self.shard_path(int(self.shard[i])), "rb") as f:
+            f.seek(int(self.img_off[i]))
+            img = f.read(int(self.img_size[i]))
+            lbl = None
+            if self.lbl_off[i] >= 0:
+                f.seek(int(self.lbl_off[i]))
+                lbl = f.read(int(self.lbl_size[i])).decode()
+        return self.stems[i], img, lbl
+
+
+def decode_image(data):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def worker_shards(n_shards, worker_id=0, num_workers=1, seed=None, epoch=0):
+    """Shards for one worker: whole shards, round-robin, optionally shuffled per epoch."""
+    order = np.arange(n_shards)
+    if seed is not None:
+        order = np.random.default_rng(seed + epoch).permutation(n_shards)
+    return order[worker_id::num_workers].tolist()
+
+
+def iter_samples(split_dir, worker_id=0, num_workers=1, seed=None, epoch=0, decode=True):
+    """
+    Stream (stem, image, label text or None) through this worker's shards with
+    sequential reads only. image is BGR if decode else the encoded bytes.
+    """
+    index = PackIndex(split_dir)
+    for k in worker_shards(index.n_shards, worker_id, num_workers, seed, epoch):
+        pending = None  # (stem, data) waiting for a possible label member
+        with tarfile.open(index.shard_path(k), "r|") as tar:
+            for m in tar:
+                stem, ext = os.path.splitext(m.name)
+                data = tar.extractfile(m).read()
+                if ext == ".txt" and pending and pending[0] == stem:
+                    yield stem, decode_image(pending[1]) if decode else pending[1], data.decode()
+                    pending = None
+                    continue
+                if pending:
+                    yield pending[0], decode_image(pending[1]) if decode else pending[1], None
+                pending = (stem, data) if ext != ".txt" else None
+        if pending:
+            yield pending[0], decode_image(pending[1]) if decode else pending[1], None
+
+
+class ShardStream(_StreamBase):
+    """
+    torch IterableDataset: inside a DataLoader each worker gets its own shards
+    (torch.utils.data.get_worker_info), call set_epoch() to reshuffle shard
+    order. Plain iterable when torch is not installed.
+    """
+
+    def __init__(self, split_dir, seed=None, decode=True, transform=None):
+        super().__init__()
+        self.split_dir = split_dir
+        self.seed = seed
+        self.decode = decode
+        self.transform = transform
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        worker_id, num_workers = 0, 1
+        try:
+            from torch.utils.data import get_worker_info
+            info = get_worker_info()
+            if info is not None:
+                worker_id, num_workers = info.id, info.num_workers
+        except ImportError:
+            pass
+        if worker_id == 0 and num_workers > 1:
+            n_shards = PackIndex(self.split_dir).n_shards
+            if n_shards < num_workers:
+                print(f"[WARN] {self.split_dir}: {n_shards} shards for {num_workers} workers, "
+                      f"{num_workers - n_shards} workers stay idle (re-pack with more --min-shards)")
+        for sample in iter_samples(self.split_dir, worker_id, num_workers, self.seed,
+                                   self.epoch, self.decode):
+            yield self.transform(sample) if self.transform else sample
+
+
+# ---- unpacking --------------------------------------------------------------
+
+def _unpack_shard(task):
+    shard, img_dir, lbl_dir = task
+    n = 0
+    with tarfile.open(shard, "r|") as tar:
+        for m in tar:
+            dst = (lbl_dir if m.name.endswith(".txt") else img_dir) / os.path.basename(m.name)
+            with open(dst, "wb") as f:
+                f.write(tar.extractfile(m).read())
+            n += not m.name.endswith(".txt")
+    return n
+
+
+def unpack_dataset(packed, out, splits=None, workers=None):
+    packed, out = Path(packed), Path(out)
+    splits = splits or sorted(p.name for p in packed.iterdir() if is_packed(p))
+    for sp in splits:
+        img_dir, lbl_dir = split_dirs(out, sp, LAYOUT_FLAT)
+        img_dir.mkdir(parents=True, exist_ok=True)
+        lbl_dir.mkdir(parents=True, exist_ok=True)
+        index = PackIndex(packed / sp)
+        tasks = [(index.shard_path(k), img_dir, lbl_dir) for k in range(index.n_shards)]
+        with Pool(min(workers or os.cpu_count() or 1, max(len(tasks), 1))) as pool:
+            n = sum(tqdm(pool.imap_unordered(_unpack_shard, tasks), total=len(tasks),
+                         desc=f"unpacking {sp}"))
+        print(f"[OK] {sp}: {n} images")
+    if (packed / "data.yaml").exists():
+        names, y = load_names(packed / "data.yaml")
+        write_data_yaml(out, y, LAYOUT_FLAT, splits, names)
+    return splits
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pack a YOLO dataset into tar shards, or unpack it.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("pack", help="Dataset root -> shards")
+    p.add_argument("root", help="Dataset root")
+    p.add_argument("out", help="Output folder for the packed dataset")
+    p.add_argument("--splits", nargs="+", default=None)
+    p.add_argument("--shard-mb", type=int, default=SHARD_BYTES >> 20, help="Max shard size in MB")
+    p.add_argument("--min-shards", type=int, default=MIN_SHARDS,
+                   help="Min shards per split, at least the DataLoader worker count")
+    p.add_argument("--workers", type=int, default=None)
+    u = sub.add_parser("unpack", help="Shards -> images|labels/<split>")
+    u.add_argument("packed", help="Packed dataset folder")
+    u.add_argument("out", help="Dataset root to create")
+    u.add_argument("--splits", nargs="+", default=None)
+    u.add_argument("--workers", type=int, default=None)
+    u.add_argument("--no-cache", action="store_true",
+                   help="Do not build the labels/<split>.cache files afterwards")
+    args = ap.parse_args()
+
+    if args.cmd == "pack":
+        pack_dataset(args.root, args.out, args.splits, args.shard_mb << 20, args.workers,
+                     args.min_shards)
+    else:
+        unpack_dataset(args.packed, args.out, args.splits, args.workers)
+        if not args.no_cache:
+            refresh_caches(Path(args.out), workers=args.workers)
+    print("\n✅ DONE")
+
+
+if __name__ == "__main__":
+    main()
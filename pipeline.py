@@ -0,0 +1,168 @@
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import yaml
+
+from label_cache import get_img_files, img2label_paths
+
+# Runs a multi-phase training recipe from a config file (see
+# train_nc6_pipeline.yaml) instead of one hand-edited script per phase.
+#
+# Every phase's run folder is named after a hash of everything that determines
+# its result: the dataset manifest (data.yaml + path/size/mtime of every image
+# and label), the parent weights (file content) and the train arguments.
+#   - finished phases with the same hash are skipped
+#   - an interrupted phase (weights/last.pt but no phase.json) is resumed
+#   - changing the data, a hyperparameter or a parent phase gives a new hash,
+#     so that phase and everything downstream retrains
+# This replaces train_nc6_phase2.py-style "re-run only phase 2" scripts.
+
+# train arguments that do not change the trained weights
+OPERATIONAL_KEYS = {"workers", "device", "project", "name", "exist_ok", "verbose", "plots",
+                    "resume", "save_period"}
+STATE_FILE = "phase.json"
+
+
+def _sha256_file(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def dataset_manifest_hash(data_yaml):
+    """Hash of data.yaml plus (path, size, mtime) of every image and label it points at."""
+    data_yaml = Path(data_yaml)
+    with open(data_yaml, "rb") as f:
+        raw = f.read()
+    y = yaml.safe_load(raw) or {}
+    base = Path(y["path"]) if y.get("path") else data_yaml.parent
+    h = hashlib.sha256(raw)
+    for key in ("train", "val", "test"):
+        if not y.get(key):
+            continue
+        src = Path(y[key]) if Path(y[key]).is_absolute() else base / y[key]
+        im_files = get_img_files(src)
+        for p in im_files + img2label_paths(im_files):
+            try:
+                st = os.stat(p)
+                h.update(f"{p}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+            except OSError:
+                h.update(f"{p}\0missing\n".encode())
+    return h.hexdigest()
+
+
+def weights_hash(weights):
+    """Content hash for local weights; hub names like yolov8n.pt are hashed by name."""
+    p = Path(weights)
+    return _sha256_file(p) if p.is_file() else f"name:{weights}"
+
+
+def phase_key(data_hash, parent_hash, train_args):
+    hp = {k: v for k, v in train_args.items() if k not in OPERATIONAL_KEYS}
+    blob = json.dumps({"data": data_hash, "parent": parent_hash, "args": hp},
+                      sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()[:12]
+
+
+def load_pipeline(path):
+    with open(path, "r") as f:
+        cfg = yaml.safe_load(f)
+    names = [p["name"] for p in cfg["phases"]]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Phase names must be unique: {names}")
+    for i, p in enumerate(cfg["phases"]):
+        if ("model" in p) == ("init" in p):
+            raise ValueError(f"Phase '{p['name']}' needs exactly one of 'model' or 'init'")
+        if "init" in p and p["init"] not in names[:i]:
+            raise ValueError(f"Phase '{p['name']}' inits from '{p['init']}', which is not an earlier phase")
+    return cfg
+
+
+def run_pipeline(cfg, dry_run=False, force=()):
+    """
+    Run (or skip/resume) every phase in order. Returns {phase name: best.pt path}.
+    `force` lists phase names to retrain even if a finished run exists.
+    """
+    data = cfg["data"]
+    project = Path(cfg.get("project", "runs"))
+    prefix = cfg.get("name", "pipeline")
+    data_hash = dataset_manifest_hash(data)
+    print(f"Dataset manifest: {data_hash[:12]}")
+
+    best = {}
+    pending = set()  # dry run: phases that would (re)train, so their best.pt is not final yet
+    for phase in cfg["phases"]:
+        name = phase["name"]
+        train_args = dict(cfg.get("defaults", {}))
+        train_args.update({k: v for k, v in phase.items() if k not in ("name", "model", "init")})
+        if dry_run and phase.get("init") in pending:
+            # the key hashes the parent's weights, which do not exist yet
+            print(f"[{name}] pending parent '{phase['init']}', key known once it has trained")
+            pending.add(name)
+            continue
+        parent = phase.get("model") or best[phase["init"]]
+        key = phase_key(data_hash, weights_hash(parent), train_args)
+        run_dir = project / f"{prefix}_{name}_{key}"
+        state = run_dir / STATE_FILE
+        last = run_dir / "weights" / "last.pt"
+
+        if state.exists() and name not in force:
+            with open(state, "r") as f:
+                best[name] = json.load(f)["best"]
+            print(f"[{name}] ✅ up to date ({run_dir.name}), skipping")
+            continue
+
+        if dry_run:
+            action = "resume" if last.exists() else "train"
+            print(f"[{name}] would {action} -> {run_dir} (from {parent})")
+            pending.add(name)
+            continue
+
+        from ultralytics import YOLO
+
+        from train_profiler import attach_profiler
+
+        if last.exists() and name not in force:
+            print(f"[{name}] ⏯️ resuming {run_dir.name}")
+            model = YOLO(str(last))
+            attach_profiler(model)
+            model.train(resume=True)
+        else:
+            print(f"[{name}] 🚀 training {run_dir.name} from {parent}")
+            model = YOLO(parent)
+            attach_profiler(model)
+            model.train(data=data, project=str(project), name=run_dir.name,
+                        exist_ok=True, **train_args)
+
+        best_pt = run_dir / "weights" / "best.pt"
+        if not best_pt.exists():
+            raise RuntimeError(f"Phase '{name}' finished without {best_pt}")
+        with open(state, "w") as f:
+            json.dump({"phase": name, "key": key, "parent": str(parent), "data": data_hash,
+                       "args": train_args, "best": str(best_pt)}, f, indent=2, default=str)
+        best[name] = str(best_pt)
+
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run a multi-phase training pipeline with phase caching.")
+    ap.add_argument("config", help="Pipeline yaml (e.g. train_nc6_pipeline.yaml)")
+    ap.add_argument("--dry-run", action="store_true", help="Only show what would run")
+    ap.add_argument("--force", nargs="+", default=[], help="Phase names to retrain anyway")
+    args = ap.parse_args()
+
+    cfg = load_pipeline(args.config)
+    best = run_pipeline(cfg, dry_run=args.dry_run, force=set(args.force))
+    print("\nFinal weights:" if best else "\nNo finished phases yet.")
+    for name, path in best.items():
+        print(f"  {name}: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+import argparse
+import http.client
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+from cpu_runtime import load_detector
+from predict_stream import select_device
+from tiled_predict import run_detector
+
+# Long-running local inference service, so tools on one box share warm models
+# instead of each paying the import + weight load (predit_label.py style).
+#
+#   python predict_server.py --model nc6=runs/.../best.pt --model cpu=best.onnx
+#   python predict_server.py --model nc6=best.pt --unix /tmp/yolo.sock
+#
+# Endpoints:
+#   POST /predict   raw image bytes (?model=nc6&conf=0.4), or JSON
+#                   {"paths": [...], "model": "nc6", "conf": 0.4}
+#                   -> {"model", "results": [{"image", "boxes": [{cls, name, conf, xyxy, xywhn}]}]}
+#   GET  /metrics   throughput, queue depth, batch sizes, latency p50/p99
+#   GET  /health    loaded models
+# Errors: 400 bad input (undecodable image, bad JSON/conf), 404 unknown model,
+# 500 model failed to load or run, 504 no result within --timeout.
+#
+# Every model gets one batcher thread: it waits for the first request, then
+# keeps collecting until --max-batch images or --max-wait-ms after that first
+# request, and runs them as one batch (at the lowest conf asked for; each
+# request is filtered to its own conf afterwards). Decoding runs on a shared
+# thread pool in the request threads, so the batcher only ever sees arrays.
+# Models are loaded on first use (outside the pool lock, so /health and other
+# models keep answering) and kept in an LRU pool of --max-models; an evicted
+# model finishes the requests already holding it before its batcher stops.
+# .pt goes through ultralytics, .onnx / *_openvino_model through cpu_runtime.
+
+_STOP = object()
+
+
+class ServerError(Exception):
+    """A model failed to load or run; reported as 500, not as a bad request."""
+
+
+class Metrics:
+    def __init__(self, window=2048):
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+        self.requests = self.images = self.batches = self.errors = 0
+        self.lat = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+
+    def add_batch(self, n, latencies):
+        with self.lock:
+            self.batches += 1
+            self.images += n
+            self.batch_sizes.append(n)
+            self.lat.extend(latencies)
+
+    def add_request(self, ok=True):
+        with self.lock:
+            self.requests += 1
+            self.errors += not ok
+
+    def summary(self):
+        with self.lock:
+            up = time.perf_counter() - self.t0
+            lat = np.array(self.lat) * 1000 if self.lat else np.zeros(1)
+            return {"uptime_s": round(up, 1), "requests": self.requests, "errors": self.errors,
+                    "images": self.images, "batches": self.batches,
+                    "images_per_sec": round(self.images / up, 2) if up else 0.0,
+                    "mean_batch": round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else 0.0,
+                    "p50_ms": round(float(np.percentile(lat, 50)), 2),
+                    "p99_ms": round(float(np.percentile(lat, 99)), 2)}
+
+
+class ModelWorker:
+    """One warm model plus the batcher thread that feeds it."""
+
+    def __init__(self, name, path, device=None, imgsz=640, iou=0.7, max_batch=16, max_wait_ms=10,
+                 metrics=None):
+        self.name, self.path = name, path
+        self.imgsz, self.iou = imgsz, iou
+        self.max_batch, self.max_wait = max_batch, max_wait_ms / 1000
+        self.metrics = metrics or Metrics()
+        t = time.perf_counter()
+        if Path(path).suffix == ".pt":
+            from ultralytics import YOLO
+            self.model = YOLO(path)
+            self.device = select_device(device)
+            self.names = self.model.names
+        else:
+            self.model = load_detector(path, imgsz=imgsz)
+            self.device = None
+            self.names = self.model.names  # from the export metadata
+        self.load_s = time.perf_counter() - t
+        self.q = queue.Queue()
+        self.lock = threading.Lock()
+        self.users = 0
+        self.retired = self.stopped = False
+        self.thread = threading.Thread(target=self._loop, name=f"batcher-{name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, im, conf):
+        fut = Future()
+        with self.lock:
+            if self.stopped:
+                raise RuntimeError(f"model {self.name} was unloaded")
+            self.q.put((im, conf, time.perf_counter(), fut))
+        return fut
+
+    def acquire(self):
+        """Pin the worker for one request (ModelPool.get does this under its lock)."""
+        with self.lock:
+            self.users += 1
+
+    def release(self):
+        with self.lock:
+            self.users -= 1
+            if self.retired and not self.users:
+                self._stop()
+
+    def retire(self):
+        """Evicted: stop once the requests that hold it are done."""
+        with self.lock:
+            self.retired = True
+            if not self.users:
+                self._stop()
+
+    def _stop(self):
+        if not self.stopped:
+            self.stopped = True
+            self.q.put(_STOP)
+
+    def _collect(self):
+        item = self.q.get()
+        if item is _STOP:
+            return None
+        batch = [item]
+        deadline = item[2] + self.max_wait
+        while len(batch) < self.max_batch:
+            left = deadline - time.perf_counter()
+            try:
+                item = self.q.get(timeout=left) if left > 0 else self.q.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self.q.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            conf = min(b[1] for b in batch)
+            try:
+                dets = run_detector(self.model, [b[0] for b in batch], conf, self.imgsz,
+                                    self.device, self.iou)
+            except Exception as e:
+                err = ServerError(f"inference failed: {type(e).__name__}: {e}")
+                for b in batch:
+                    b[3].set_exception(err)
+                continue
+            done = time.perf_counter()
+            for (im, c, _, fut), (boxes, scores, cls) in zip(batch, dets):
+                m = scores >= c
+                fut.set_result((boxes[m], scores[m], cls[m], im.shape[:2]))
+            self.metrics.add_batch(len(batch), [done - b[2] for b in batch])
+
+
+class ModelPool:
+    """
+    name -> ModelWorker, loaded on demand, least recently used evicted.
+    Loading happens outside the pool lock (one loader per name, others wait on
+    its future), and get() pins the worker: call release() when done.
+    """
+
+    def __init__(self, registry, max_models=2, **worker_kw):
+        self.registry = registry
+        self.max_models = max_models
+        self.worker_kw = worker_kw
+        self.workers = OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        if name not in self.registry:
+            raise KeyError(f"unknown model '{name}' (known: {', '.join(self.registry)})")
+        while True:
+            with self.lock:
+                if name in self.workers:
+                    self.workers.move_to_end(name)
+                    w = self.workers[name]
+                    w.acquire()
+                    return w
+                fut = self.loading.get(name)
+                owner = fut is None
+                if owner:
+                    fut = self.loading[name] = Future()
+            if not owner:
+                fut.result()  # raises if that load failed
+                continue
+            try:
+                w = ModelWorker(name, self.registry[name], **self.worker_kw)
+            except Exception as e:
+                err = ServerError(f"could not load model '{name}': {type(e).__name__}: {e}")
+                with self.lock:
+                    del self.loading[name]
+                fut.set_exception(err)
+                raise err from e
+            with self.lock:
+                while len(self.workers) >= self.max_models:
+                    old, ow = self.workers.popitem(last=False)
+                    ow.retire()
+                    print(f"[NOTE] evicted model {old}")
+                self.workers[name] = w
+                del self.loading[name]
+            fut.set_result(w)
+            print(f"[OK] loaded model {name} ({w.load_s:.1f}s)")
+
+    def status(self):
+        with self.lock:
+            return [{"name": n, "path": w.path, "queue": w.q.qsize(), "load_s": round(w.load_s, 2)}
+                    for n, w in self.workers.items()]
+
+
+def to_boxes(boxes, scores, cls, hw, names):
+    h, w = hw
+    out = []
+    for (x0, y0, x1, y1), s, c in zip(boxes.tolist(), scores.tolist(), cls.tolist()):
+        out.append({"cls": int(c), "name": names.get(int(c), str(c)), "conf": round(s, 5),
+                    "xyxy": [round(v, 1) for v in (x0, y0, x1, y1)],
+                    "xywhn": [round(v, 6) for v in ((x0 + x1) / 2 / w, (y0 + y1) / 2 / h,
+                                                     (x1 - x0) / w, (y1 - y0) / h)]})
+    return out
+
+
+def decode_bytes(data):
+    im = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if im is None:
+        raise ValueError("could not decode image")
+    return im
+
+
+def read_image(path):
+    im = cv2.imread(path)
+    if im is None:
+        raise ValueError(f"could not read {path}")
+    return im
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "YOLOPredict/1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, code, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        app = self.server.app
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send(200, {"status": "ok", "models": app.pool.status(),
+                             "known": sorted(app.pool.registry)})
+        elif path == "/metrics":
+            self._send(200, {**app.metrics.summary(), "queue_depth": sum(m["queue"] for m in app.pool.status()),
+                             "models": app.pool.status()})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        app = self.server.app
+        url = urlparse(self.path)
+        if url.path != "/predict":
+            self._send(404, {"error": "not found"})
+            return
+        qs = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                req = json.loads(body)
+                if not isinstance(req, dict):
+                    raise ValueError("JSON body must be an object")
+                paths = req.get("paths", [])
+                names = [Path(p).stem for p in paths]
+                jobs = [app.decoders.submit(read_image, p) for p in paths]
+            else:
+                req = {}
+                names = [qs.get("name", "image")]
+                jobs = [app.decoders.submit(decode_bytes, body)]
+            model = req.get("model", qs.get("model", app.default_model))
+            conf = float(req.get("conf", qs.get("conf", app.conf)))
+            worker = app.pool.get(model)
+            try:
+                futs = [worker.submit(j.result(timeout=app.timeout), conf) for j in jobs]
+                results = [{"image": n, "boxes": to_boxes(*f.result(timeout=app.timeout), worker.names)}
+                           for n, f in zip(names, futs)]
+            finally:
+                worker.release()
+        except TimeoutError:
+            app.metrics.add_request(ok=False)
+            self._send(504, {"error": f"no result within {app.timeout}s"})
+            return
+        except KeyError as e:
+            app.metrics.add_request(ok=False)
+            self._send(404, {"error": e.args[0]})
+            return
+        except ValueError as e:  # undecodable image, bad JSON or conf
+            app.metrics.add_request(ok=False)
+            self._send(400, {"error": f"{type(e).__name__}: {e}"})
+            return
+        except Exception as e:
+            app.metrics.add_request(ok=False)
+            self._send(500, {"error": str(e) if isinstance(e, ServerError) else f"{type(e).__name__}: {e}"})
+            return
+        app.metrics.add_request()
+        self._send(200, {"model": model, "results": results})
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+class App:
+    def __init__(self, registry, default_model, conf=0.25, threads=4, timeout=60.0, **pool_kw):
+        self.metrics = Metrics()
+        self.timeout = timeout
+        self.pool = ModelPool(registry, metrics=self.metrics, **pool_kw)
+        self.decoders = ThreadPoolExecutor(threads, thread_name_prefix="decode")
+        self.default_model = default_model
+        self.conf = conf
+
+
+# ---- client -----------------------------------------------------------------
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.sock_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.sock_path)
+
+
+def predict_paths(server, paths, model=None, conf=None, timeout=60):
+    """
+    Client helper: predict local image paths on a running server
+    ("http://127.0.0.1:8765" or a unix socket path). Returns the results list.
+    """
+    body = {"paths": [str(p) for p in paths]}
+    if model:
+        body["model"] = model
+    if conf is not None:
+        body["conf"] = conf
+    if server.startswith("http"):
+        u = urlparse(server)
+        conn = http.client.HTTPConnection(u.hostname, u.port, timeout=timeout)
+    else:
+        conn = UnixHTTPConnection(server, timeout=timeout)
+    try:
+        conn.request("POST", "/predict", json.dumps(body), {"Content-Type": "application/json"})
+        resp = conn.getresponse()
+        data = json.loads(resp.read())
+    finally:
+        conn.close()
+    if resp.status != 200:
+        raise RuntimeError(data.get("error", resp.status))
+    return data["results"]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local YOLO prediction server with request batching.")
+    ap.add_argument("--model", action="append", required=True,
+                    help="name=path (repeatable); the first one is the default")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--unix", default=None, help="Serve on this unix socket instead of TCP")
+    ap.add_argument("--max-models", type=int, default=2, help="Warm models kept in the pool")
+    ap.add_argument("--max-batch", type=int, default=16)
+    ap.add_argument("--max-wait-ms", type=float, default=10,
+                    help="How long the first request of a batch waits for company")
+    ap.add_argument("--conf", type=float, default=0.25, help="Default confidence")
+    ap.add_argument("--iou", type=float, default=0.7)
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--threads", type=int, default=min(8, os.cpu_count() or 1), help="Decode threads")
+    ap.add_argument("--device", default=None, help="Device for .pt models (default: cuda > mps > cpu)")
+    ap.add_argument("--timeout", type=float, default=60.0, help="Seconds a request waits for its results")
+    ap.add_argument("--preload", action="store_true", help="Load the default model at startup")
+    args = ap.parse_args()
+
+    registry = {}
+    for spec in args.model:
+        name, _, path = spec.rpartition("=")
+        registry[name or Path(path).stem] = path
+    default = next(iter(registry))
+    app = App(registry, default, conf=args.conf, threads=args.threads, timeout=args.timeout,
+              max_models=args.max_models, device=args.device, imgsz=args.imgsz, iou=args.iou,
+              max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    if args.preload:
+        app.pool.get(default).release()
+
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.unlink(args.unix)
+        server = UnixHTTPServer(args.unix, Handler)
+        where = args.unix
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), Handler)
+        where = f"http://{args.host}:{args.port}"
+    server.app = app
+    print(f"✅ Serving {', '.join(f'{k}={v}' for k, v in registry.items())} on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix and os.path.exists(args.unix):
+            os.unlink(args.unix)
+
+
+if __name__ == "__main__":
+    main()
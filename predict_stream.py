@@ -0,0 +1,272 @@
+import argparse
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from pack_dataset import is_packed, iter_samples
+from yolo_io import IMAGE_EXTS
+
+# Streaming inference: images come from a folder, a glob or a video, are decoded
+# on a background thread pool, grouped into batches whose size follows how fast
+# decoding keeps up (up to --batch), and the results are written per batch.
+# Replaces the per-image model.predict(source=folder) call in predit_label.py.
+
+VIDEO_EXTS = {".mp4", ".mov", ".avi", ".mkv", ".m4v"}
+_END = object()
+
+
+class _DecodeError:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def select_device(device=None):
+    """Explicit device if given, else cuda > mps > cpu."""
+    if device:
+        return device
+    import torch
+    if torch.cuda.is_available():
+        return "0"
+    if getattr(torch.backends, "mps", None) and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def list_source(source):
+    """('images', [paths]) for a folder/glob/image/list of paths, or ('video', path)."""
+    if isinstance(source, (list, tuple)):
+        return "images", [str(f) for f in source]
+    p = Path(source)
+    if p.is_dir():
+        return "images", sorted(str(f) for f in p.iterdir() if f.suffix.lower() in IMAGE_EXTS)
+    if p.is_file() and p.suffix.lower() in VIDEO_EXTS:
+        return "video", str(p)
+    if p.is_file():
+        return "images", [str(p)]
+    files = sorted(f for f in glob.glob(source, recursive=True)
+                   if Path(f).suffix.lower() in IMAGE_EXTS)
+    if not files:
+        raise FileNotFoundError(f"No images or video found for source: {source}")
+    return "images", files
+
+
+def iter_decoded(source, threads=4, lookahead=64):
+    """
+    Yield (name, BGR image) in source order. Image files are decoded on a
+    thread pool with a bounded window of in-flight reads; video frames and
+    packed splits (pack_dataset.py) are read sequentially.
+    """
+    if isinstance(source, (str, Path)) and is_packed(source):
+        for name, im, _ in iter_samples(source):
+            if im is None:
+                print(f"[WARN] Could not decode {name}, skipping.")
+                continue
+            yield name, im
+        return
+
+    kind, items = list_source(source)
+    if kind == "video":
+        cap = cv2.VideoCapture(items)
+        stem = Path(items).stem
+        i = 0
+        try:
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield f"{stem}_{i:06d}", frame
+                i += 1
+        finally:
+            cap.release()
+        return
+
+    with ThreadPoolExecutor(threads) as pool:
+        window = deque()
+        it = iter(items)
+        for path in it:
+            window.append((path, pool.submit(cv2.imread, path)))
+            if len(window) >= lookahead:
+                break
+        while window:
+            path, fut = window.popleft()
+            nxt = next(it, None)
+            if nxt is not None:
+                window.append((nxt, pool.submit(cv2.imread, nxt)))
+            im = fut.result()
+            if im is None:
+                print(f"[WARN] Could not read {path}, skipping.")
+                continue
+            yield Path(path).stem, im
+
+
+def start_decoder(source, threads=4, max_queue=128):
+    """Run iter_decoded on a background thread; items land in a bounded queue."""
+    q = queue.Queue(maxsize=max_queue)
+
+    def work():
+        try:
+            for name, im in iter_decoded(source, threads=threads):
+                q.put((name, im, time.perf_counter()))
+        except Exception as e:
+            q.put(_DecodeError(e))  # re-raised by dynamic_batches in the consumer
+        finally:
+            q.put(_END)
+
+    threading.Thread(target=work, daemon=True).start()
+    return q
+
+
+def dynamic_batches(q, max_batch=16):
+    """
+    Block for the first item, then take whatever else is already decoded, up
+    to max_batch. Batches grow when decoding runs ahead of the model and stay
+    small (low latency) when it does not. An error in the decoder thread
+    (e.g. a missing source) is re-raised here, after the frames before it.
+    """
+    done = False
+    while not done:
+        item = q.get()
+        if item is _END:
+            return
+        if isinstance(item, _DecodeError):
+            raise item.exc
+        batch = [item]
+        while len(batch) < max_batch:
+            try:
+                item = q.get_nowait()
+            except queue.Empty:
+                break
+            if item is _END:
+                done = True
+                break
+            if isinstance(item, _DecodeError):
+                yield batch
+                raise item.exc
+            batch.append(item)
+        yield batch
+
+
+def result_rows(r):
+    """(cls, xywhn, conf) numpy arrays from an ultralytics Results object."""
+    b = r.boxes
+    return (b.cls.cpu().numpy().astype(int), b.xywhn.cpu().numpy(), b.conf.cpu().numpy())
+
+
+def format_txt(cls, xywhn, conf, save_conf=True):
+    lines = []
+    for c, box, p in zip(cls, xywhn, conf):
+        vals = " ".join(f"{v:.6f}" for v in box)
+        lines.append(f"{c} {vals} {p:.6f}\n" if save_conf else f"{c} {vals}\n")
+    return "".join(lines)
+
+
+class LatencyStats:
+    def __init__(self):
+        self.lat = []
+        self.n = 0
+        self.t0 = time.perf_counter()
+
+    def add(self, values):
+        self.lat.extend(values)
+        self.n += len(values)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.t0
+        lat = np.array(self.lat) * 1000 if self.lat else np.zeros(1)
+        return {"images": self.n, "seconds": round(elapsed, 3),
+                "images_per_sec": round(self.n / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(float(np.percentile(lat, 50)), 2),
+                "p99_ms": round(float(np.percentile(lat, 99)), 2)}
+
+
+def run_stream(model, source, out_dir, conf=0.25, iou=0.7, imgsz=640, device=None,
+               batch=16, threads=4, save_txt=True, save_json=True, save_conf=True,
+               save_images=False):
+    """
+    Stream `source` through `model` (a YOLO instance). Writes
+    <out_dir>/labels/<name>.txt and <out_dir>/predictions.jsonl.
+    Returns the LatencyStats summary dict.
+    """
+    out_dir = Path(out_dir)
+    (out_dir / "labels").mkdir(parents=True, exist_ok=True)
+    if save_images:
+        (out_dir / "images").mkdir(parents=True, exist_ok=True)
+    device = select_device(device)
+    names = model.names
+
+    stats = LatencyStats()
+    q = start_decoder(source, threads=threads, max_queue=batch * 4)
+    jf = open(out_dir / "predictions.jsonl", "w") if save_json else None
+    try:
+        for items in dynamic_batches(q, max_batch=batch):
+            ims = [im for _, im, _ in items]
+            results = model.predict(ims, conf=conf, iou=iou, imgsz=imgsz, device=device,
+                                    verbose=False)
+            done = time.perf_counter()
+            json_lines = []
+            for (name, _, t_ready), r in zip(items, results):
+                cls, xywhn, p = result_rows(r)
+                if save_txt and len(cls):
+                    with open(out_dir / "labels" / f"{name}.txt", "w") as f:
+                        f.write(format_txt(cls, xywhn, p, save_conf))
+                if jf:
+                    json_lines.append(json.dumps({
+                        "image": name,
+                        "boxes": [{"cls": int(c), "name": names[int(c)], "conf": round(float(s), 5),
+                                   "xywhn": [round(float(v), 6) for v in box]}
+                                  for c, box, s in zip(cls, xywhn, p)]}) + "\n")
+                if save_images:
+                    cv2.imwrite(str(out_dir / "images" / f"{name}.jpg"), r.plot())
+            if jf:
+                jf.writelines(json_lines)
+            stats.add([done - t for _, _, t in items])
+    finally:
+        if jf:
+            jf.close()
+    return stats.summary()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Streaming batched YOLO inference.")
+    ap.add_argument("--model", required=True, help="Path to best.pt (or any YOLO weights)")
+    ap.add_argument("--source", required=True,
+                    help="Image folder, glob pattern, image, video or packed split")
+    ap.add_argument("--out", default="runs/detect/stream", help="Output folder")
+    ap.add_argument("--conf", type=float, default=0.25)
+    ap.add_argument("--iou", type=float, default=0.7)
+    ap.add_argument("--imgsz", type=int, default=640)
+    ap.add_argument("--batch", type=int, default=16, help="Max batch size")
+    ap.add_argument("--threads", type=int, default=min(8, os.cpu_count() or 1),
+                    help="Decode threads")
+    ap.add_argument("--device", default=None, help="Device (default: cuda > mps > cpu)")
+    ap.add_argument("--no-txt", action="store_true", help="Do not write YOLO txt files")
+    ap.add_argument("--no-json", action="store_true", help="Do not write predictions.jsonl")
+    ap.add_argument("--no-conf", action="store_true", help="Leave confidences out of the txt files")
+    ap.add_argument("--save-images", action="store_true", help="Also save annotated images")
+    args = ap.parse_args()
+
+    from ultralytics import YOLO
+
+    model = YOLO(args.model)
+    summary = run_stream(model, args.source, args.out, conf=args.conf, iou=args.iou,
+                         imgsz=args.imgsz, device=args.device, batch=args.batch,
+                         threads=args.threads, save_txt=not args.no_txt,
+                         save_json=not args.no_json, save_conf=not args.no_conf,
+                         save_images=args.save_images)
+    print(f"\n{summary['images']} images in {summary['seconds']}s "
+          f"({summary['images_per_sec']} img/s), latency p50 {summary['p50_ms']} ms, "
+          f"p99 {summary['p99_ms']} ms")
+    print(f"✅ Results in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
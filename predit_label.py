@@ -1,13 +1,18 @@
 from ultralytics import YOLO
 
+from predict_stream import run_stream
+
 model = YOLO("/Users/juanpablogarza/runs/traffic_signs_nc6_v1_full3/weights/best.pt")
 
 
-model.predict(
+summary = run_stream(
+    model,
     source="/Users/juanpablogarza/Desktop/new_car_images",
-    save=True,
-    save_txt=True,  
-    save_conf=True,   
+    out_dir="runs/detect/new_car_images",
+    save_images=True,
+    save_txt=True,
+    save_conf=True,
     conf=0.4,
-    device="mps",
-)
\ No newline at end of file
+    device=None,  # cuda > mps > cpu
+)
+print(summary)
@@ -0,0 +1,203 @@
+import argparse
+import html
+import json
+from pathlib import Path
+
+import numpy as np
+
+from label_index import build_index
+from yolo_io import detect_layout, find_splits, list_images, load_names, split_dirs
+
+# What is in a dataset, before merging or remapping it: class counts per
+# split, boxes per image, box size / aspect histograms, polygon vs bbox rows,
+# images without labels and labels without images.
+#
+# Labels are read through label_index (parallel parse, cached as
+# labels/<split>.index/), so re-profiling after a small change only re-parses
+# the changed files. Every statistic is then a NumPy reduction over the
+# columnar arrays, which takes well under a second even for 1M rows.
+# Output: profile.json plus a self-contained profile.html (inline SVG charts).
+
+BOXES_PER_IMAGE_MAX = 20  # last bin is "20+"
+AREA_BINS = np.geomspace(1e-5, 1.0, 26)  # normalized w*h
+ASPECT_BINS = np.geomspace(1 / 8, 8, 25)  # w/h (normalized coords)
+
+
+def profile_split(root, split, layout, nc, workers=None):
+    img_dir, lbl_dir = split_dirs(root, split, layout)
+    images = list_images(img_dir)
+    index, n_parsed = build_index(lbl_dir, workers=workers, verbose=True)
+    stems = np.array(index.stems, dtype=object)
+
+    has_img = np.fromiter((s in images for s in index.stems), dtype=bool, count=len(stems))
+    rows_per_img = np.diff(np.asarray(index.img_off))
+    cls = np.asarray(index.cls, dtype=np.int64)
+    bbox = np.asarray(index.bbox, dtype=np.float32)
+    row_img = index.row_image()
+    is_poly = index.is_polygon()
+
+    valid_cls = (cls >= 0) & (cls < nc)
+    class_rows = np.bincount(cls[valid_cls], minlength=nc)[:nc]
+    pres = np.zeros((len(stems), nc), dtype=bool)
+    pres[row_img[valid_cls], cls[valid_cls]] = True
+    class_images = pres.sum(0)
+    poly_rows = np.bincount(cls[valid_cls & is_poly], minlength=nc)[:nc]
+
+    w, h = bbox[:, 2], bbox[:, 3]
+    area = w * h
+    aspect = w / np.maximum(h, 1e-9)
+    out_of_range = ((bbox[:, :2] - bbox[:, 2:] / 2 < -1e-3) |
+                    (bbox[:, :2] + bbox[:, 2:] / 2 > 1 + 1e-3)).any(1)
+    degenerate = (w <= 0) | (h <= 0)
+
+    bpi = np.bincount(np.minimum(rows_per_img, BOXES_PER_IMAGE_MAX),
+                      minlength=BOXES_PER_IMAGE_MAX + 1)
+    area_hist = np.histogram(np.clip(area, AREA_BINS[0], AREA_BINS[-1]), bins=AREA_BINS)[0]
+    aspect_hist = np.histogram(np.clip(aspect, ASPECT_BINS[0], ASPECT_BINS[-1]), bins=ASPECT_BINS)[0]
+    area_by_class = {}
+    for c in range(nc):
+        m = valid_cls & (cls == c)
+        if m.any():
+            q = np.percentile(np.sqrt(area[m]), [5, 50, 95])
+            area_by_class[c] = [round(float(v), 4) for v in q]
+
+    label_stems = set(index.stems)
+    return {
+        "images": len(images),
+        "label_files": len(stems),
+        "reparsed": int(n_parsed),
+        "unlabeled_images": sorted(s for s in images if s not in label_stems),
+        "orphan_labels": sorted(stems[~has_img].tolist()),
+        "empty_label_files": int((rows_per_img == 0).sum()),
+        "rows": int(len(cls)),
+        "polygon_rows": int(is_poly.sum()),
+        "bbox_rows": int((~is_poly).sum()),
+        "invalid_class_rows": int((~valid_cls).sum()),
+        "out_of_range_rows": int(out_of_range.sum()),
+        "degenerate_rows": int(degenerate.sum()),
+        "class_rows": class_rows.tolist(),
+        "class_images": class_images.tolist(),
+        "class_polygon_rows": poly_rows.tolist(),
+        "class_sqrt_area_p5_p50_p95": area_by_class,
+        "boxes_per_image": bpi.tolist(),
+        "mean_boxes_per_image": round(float(rows_per_img.mean()), 3) if len(stems) else 0.0,
+        "area_bins": AREA_BINS.tolist(),
+        "area_hist": area_hist.tolist(),
+        "aspect_bins": ASPECT_BINS.tolist(),
+        "aspect_hist": aspect_hist.tolist(),
+    }
+
+
+# ---- HTML report ------------------------------------------------------------
+
+def svg_bars(values, labels, title, width=560, height=180):
+    values = [float(v) for v in values]
+    top = max(values) if values and max(values) > 0 else 1.0
+    n = max(len(values), 1)
+    bw = (width - 40) / n
+    parts = [f'<svg width="{width}" height="{height + 40}" xmlns="http://www.w3.org/2000/svg">',
+             f'<text x="4" y="14" font-size="13" font-weight="bold">{html.escape(title)}</text>']
+    for i, (v, lab) in enumerate(zip(values, labels)):
+        bh = v / top * height
+        x = 30 + i * bw
+        parts.append(f'<rect x="{x:.1f}" y="{20 + height - bh:.1f}" width="{max(bw - 2, 1):.1f}" '
+                     f'height="{bh:.1f}" fill="#4a7bd0"><title>{html.escape(str(lab))}: {v:g}</title></rect>')
+        if n <= 30:
+            parts.append(f'<text x="{x + bw / 2:.1f}" y="{height + 34}" font-size="9" '
+                         f'text-anchor="middle">{html.escape(str(lab))}</text>')
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+def write_html(report, path):
+    names = report["names"]
+    out = ["<html><head><meta charset='utf-8'><title>Dataset profile</title>",
+           "<style>body{font-family:sans-serif;margin:20px}table{border-collapse:collapse}"
+           "td,th{border:1px solid #ccc;padding:3px 8px;text-align:right}"
+           "th:first-child,td:first-child{text-align:left}</style></head><body>",
+           f"<h1>Dataset profile: {html.escape(report['root'])}</h1>"]
+    for sp, s in report["splits"].items():
+        out.append(f"<h2>{html.escape(sp)}</h2><table>")
+        for key in ("images", "label_files", "empty_label_files", "rows", "bbox_rows",
+                    "polygon_rows", "invalid_class_rows", "out_of_range_rows", "degenerate_rows",
+                    "mean_boxes_per_image"):
+            out.append(f"<tr><td>{key}</td><td>{s[key]}</td></tr>")
+        out.append(f"<tr><td>unlabeled_images</td><td>{len(s['unlabeled_images'])}</td></tr>")
+        out.append(f"<tr><td>orphan_labels</td><td>{len(s['orphan_labels'])}</td></tr></table>")
+
+        out.append("<h3>Classes</h3><table><tr><th>class</th><th>rows</th><th>images</th>"
+                   "<th>polygon rows</th><th>sqrt(area) p5 / p50 / p95</th></tr>")
+        for c, n in enumerate(names):
+            q = s["class_sqrt_area_p5_p50_p95"].get(c) or s["class_sqrt_area_p5_p50_p95"].get(str(c))
+            q = " / ".join(f"{v:.3f}" for v in q) if q else "-"
+            out.append(f"<tr><td>{html.escape(n)}</td><td>{s['class_rows'][c]}</td>"
+                       f"<td>{s['class_images'][c]}</td><td>{s['class_polygon_rows'][c]}</td>"
+                       f"<td>{q}</td></tr>")
+        out.append("</table><div>")
+        out.append(svg_bars(s["class_rows"], names, "Rows per class"))
+        bpi_labels = [str(i) for i in range(BOXES_PER_IMAGE_MAX)] + [f"{BOXES_PER_IMAGE_MAX}+"]
+        out.append(svg_bars(s["boxes_per_image"], bpi_labels, "Boxes per image"))
+        a_lab = [f"{v:.0e}" for v in s["area_bins"][:-1]]
+        out.append(svg_bars(s["area_hist"], a_lab, "Box area (normalized w*h, log bins)"))
+        r_lab = [f"{v:.2f}" for v in s["aspect_bins"][:-1]]
+        out.append(svg_bars(s["aspect_hist"], r_lab, "Aspect ratio w/h (log bins)"))
+        out.append("</div>")
+    out.append("</body></html>")
+    with open(path, "w") as f:
+        f.write("\n".join(out))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Profile a YOLO dataset (class counts, box stats, missing labels).")
+    ap.add_argument("--root", required=True, help="Dataset root")
+    ap.add_argument("--splits", nargs="+", default=None)
+    ap.add_argument("--data", default=None, help="data.yaml for class names (default: <root>/data.yaml)")
+    ap.add_argument("--out", default=None, help="Output prefix (default: <root>/profile)")
+    ap.add_argument("--workers", type=int, default=None)
+    args = ap.parse_args()
+
+    root = Path(args.root)
+    layout = detect_layout(root)
+    if layout is None:
+        raise RuntimeError(f"Could not find images/labels folders under {root}")
+    data_yaml = Path(args.data) if args.data else root / "data.yaml"
+    names = load_names(data_yaml)[0] if data_yaml.exists() else None
+
+    splits = {}
+    for sp in args.splits or find_splits(root, layout):
+        if names is None:
+            _, lbl_dir = split_dirs(root, sp, layout)
+            idx, _ = build_index(lbl_dir, workers=args.workers, verbose=False)
+            nc = int(np.asarray(idx.cls).max(initial=-1)) + 1
+        else:
+            nc = len(names)
+        splits[sp] = profile_split(root, sp, layout, nc, workers=args.workers)
+    if names is None:
+        nc = max(len(s["class_rows"]) for s in splits.values()) if splits else 0
+        names = [str(i) for i in range(nc)]
+        for s in splits.values():
+            for key in ("class_rows", "class_images", "class_polygon_rows"):
+                s[key] += [0] * (nc - len(s[key]))
+
+    report = {"root": str(root), "names": names, "splits": splits}
+    out = Path(args.out) if args.out else root / "profile"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out.with_suffix(".json"), "w") as f:
+        json.dump(report, f, indent=2)
+    write_html(report, out.with_suffix(".html"))
+
+    for sp, s in splits.items():
+        print(f"\n[{sp}] {s['images']} images, {s['label_files']} label files "
+              f"({s['reparsed']} re-parsed), {s['rows']} rows "
+              f"({s['polygon_rows']} polygon, {s['bbox_rows']} bbox)")
+        print(f"  unlabeled images: {len(s['unlabeled_images'])}, orphan labels: "
+              f"{len(s['orphan_labels'])}, empty label files: {s['empty_label_files']}")
+        if s["invalid_class_rows"] or s["out_of_range_rows"] or s["degenerate_rows"]:
+            print(f"  [WARN] {s['invalid_class_rows']} rows with class id >= {len(names)}, "
+                  f"{s['out_of_range_rows']} out of range, {s['degenerate_rows']} zero-size")
+        print("  " + ", ".join(f"{n}={s['class_rows'][c]}" for c, n in enumerate(names)))
+    print(f"\n✅ Wrote {out.with_suffix('.json')} and {out.with_suffix('.html')}")
+
+
+if __name__ == "__main__":
+    main()
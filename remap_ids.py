@@ -2,6 +2,8 @@ import os
 from pathlib import Path
 import yaml
 
+from label_cache import refresh_caches
+
 # === EDIT THIS: your dataset root ===
 DATASET_ROOT = Path("/Users/juanpablogarza/Desktop/sign_detection.v11i.yolov8")  # <-- CHANGE THIS
 
@@ -99,6 +101,7 @@ def main():
         remap_split(root, split)
 
     update_yaml(root)
+    refresh_caches(root)
 
     print("\n✅ DONE — All class IDs have been remapped.")
 
@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 
+from label_cache import refresh_caches
+
 # === EDIT THIS: your dataset root ===
 # This should point to the folder containing data.yaml, train, valid, and test
 DATASET_ROOT = Path("/Users/juanpablogarza/Desktop/sign_detection.v9i.yolov8")
@@ -74,6 +76,8 @@ def main():
     for split in SPLITS:
         cleanup_split(root, split)
 
+    refresh_caches(root)
+
     print("\n✅ DONE — Dataset cleanup complete.")
 
 
@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from find_duplicates import quarantine
+from label_cache import refresh_caches
+from label_index import build_index
+from yolo_io import (detect_layout, find_splits, format_rows, list_images, list_labels,
+                     load_names, parse_rows, split_dirs, write_atomic)
+
+# Integrity scan over every split, before the trainer's cache build trips on it.
+#
+# Images (thread pool, header only - nothing is decoded):
+#   empty         zero-byte file
+#   unreadable    PIL cannot identify it
+#   truncated     JPEG without the FFD9 end-of-image marker
+#   too_small     a side under 10 px (the trainer rejects those)
+#   ext_mismatch  e.g. a PNG saved as .jpg (warning only)
+# Labels (vectorized over label_index's columnar arrays):
+#   bad_class     class id < 0 or >= nc
+#   out_of_range  box / polygon extends outside [0, 1]
+#   zero_size     box with zero width or height
+#   duplicate     identical row repeated in the same file
+#   malformed     line that is not a valid box or polygon row
+#   orphan_label  label file without an image
+#
+# <root>/.scan_manifest.json keeps the image results by size/mtime (label_index
+# is incremental by itself), so a re-scan only opens changed files.
+#
+# --fix re-saves truncated JPEGs and rewrites labels without the bad rows
+# (out-of-range coords are clipped); --quarantine moves files that cannot be
+# fixed to <root>/_quarantine/<split>/. Label caches are refreshed afterwards.
+
+MANIFEST = ".scan_manifest.json"
+QUARANTINE = "_quarantine"
+FATAL_IMAGE = {"empty", "unreadable", "truncated", "too_small"}
+PIL_EXT = {"JPEG": {".jpg", ".jpeg"}, "PNG": {".png"}, "BMP": {".bmp"}, "TIFF": {".tif", ".tiff"}}
+
+
+def check_image(path):
+    """(issue or None, detail) from the file size, the header and the JPEG end marker."""
+    try:
+        size = os.path.getsize(path)
+        if size == 0:
+            return "empty", ""
+        with Image.open(path) as im:
+            fmt, (w, h) = im.format, im.size
+        if fmt == "JPEG":
+            with open(path, "rb") as f:
+                f.seek(-2, 2)
+                if f.read() != b"\xff\xd9":
+                    return "truncated", f"{w}x{h}"
+        if w < 10 or h < 10:
+            return "too_small", f"{w}x{h}"
+        if fmt in PIL_EXT and Path(path).suffix.lower() not in PIL_EXT[fmt]:
+            return "ext_mismatch", fmt
+        return None, f"{w}x{h}"
+    except Exception as e:
+        return "unreadable", type(e).__name__
+
+
+def scan_images(paths, manifest, threads=8):
+    """{path: (issue, detail)}, reusing manifest entries whose size/mtime still match."""
+    out, todo = {}, []
+    for p in paths:
+        st = os.stat(p)
+        sig = [st.st_size, st.st_mtime_ns]
+        rec = manifest.get(str(p))
+        if rec and rec[0] == sig:
+            out[str(p)] = tuple(rec[1])
+        else:
+            todo.append((str(p), sig))
+    if todo:
+        with ThreadPoolExecutor(threads) as pool:
+            for (p, sig), res in zip(todo, pool.map(check_image, [p for p, _ in todo])):
+                out[p] = res
+                manifest[p] = [sig, list(res)]
+    return out, len(todo)
+
+
+def count_lines(path):
+    with open(path, "r") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def scan_labels(lbl_dir, nc, manifest):
+    """{stem: Counter(issue kind -> rows)} from the label index plus line counts."""
+    index, _ = build_index(lbl_dir, verbose=False)
+    cls = np.asarray(index.cls, dtype=np.int64)
+    bbox = np.asarray(index.bbox, dtype=np.float64)
+    row_img = index.row_image()
+    eps = 1e-3
+
+    bad = {
+        "bad_class": (cls < 0) | (cls >= nc),
+        "out_of_range": ((bbox[:, :2] - bbox[:, 2:] / 2 < -eps) |
+                         (bbox[:, :2] + bbox[:, 2:] / 2 > 1 + eps)).any(1),
+        "zero_size": (bbox[:, 2] <= 0) | (bbox[:, 3] <= 0),
+    }
+    dup = np.zeros(len(cls), dtype=bool)
+    if len(cls):
+        key = np.column_stack([row_img, cls, np.round(bbox * 1e6)])
+        _, first = np.unique(key, axis=0, return_index=True)
+        dup[:] = True
+        dup[first] = False
+        # polygons sharing a tight box are not duplicates
+        dup &= ~index.is_polygon()
+    bad["duplicate"] = dup
+
+    issues = defaultdict(Counter)
+    for kind, mask in bad.items():
+        for i, n in zip(*np.unique(row_img[mask], return_counts=True)):
+            issues[index.stems[i]][kind] += int(n)
+
+    # rows the index could not parse: non-blank lines minus parsed rows
+    rows_per = np.diff(np.asarray(index.img_off))
+    lines = {}
+    for i, s in enumerate(index.stems):
+        path = str(Path(lbl_dir) / f"{s}.txt")
+        sig = list(index.sigs.get(s, ()))
+        rec = manifest.get(path)
+        if rec and rec[0] == sig:
+            lines[s] = rec[1]
+        else:
+            lines[s] = count_lines(path)
+            manifest[path] = [sig, lines[s]]
+        if lines[s] > rows_per[i]:
+            issues[s]["malformed"] += int(lines[s] - rows_per[i])
+    return issues
+
+
+def fix_label(path, nc):
+    """Drop bad-class / zero-size / malformed / duplicate rows, clip coords to [0, 1]."""
+    with open(path, "r") as f:
+        rows = parse_rows(f.read())
+    out, seen = [], set()
+    for cid, coords in rows:
+        try:
+            xy = np.array(coords, dtype=np.float64)
+        except ValueError:
+            continue
+        if not 0 <= cid < nc or not (xy.size == 4 or (xy.size >= 6 and xy.size % 2 == 0)):
+            continue
+        if xy.size == 4:
+            lo = np.clip(xy[:2] - xy[2:] / 2, 0, 1)
+            hi = np.clip(xy[:2] + xy[2:] / 2, 0, 1)
+            xy = np.concatenate([(lo + hi) / 2, hi - lo])
+            if (xy[2:] <= 0).any():
+                continue
+        else:
+            xy = xy.clip(0, 1)
+        tokens = [f"{v:.6f}" for v in xy]
+        key = (cid, tuple(tokens))
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append((cid, tokens))
+    write_atomic(path, format_rows(out))
+    return len(rows) - len(out)
+
+
+def fix_jpeg(path):
+    """Re-save a truncated JPEG (what the trainer does when it meets one)."""
+    with Image.open(path) as im:
+        ImageOps.exif_transpose(im).save(path, "JPEG", subsampling=0, quality=100)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Scan a YOLO dataset for corrupt images and bad labels.")
+    ap.add_argument("--root", required=True, help="Dataset root with data.yaml")
+    ap.add_argument("--splits", nargs="+", default=None)
+    ap.add_argument("--threads", type=int, default=min(16, (os.cpu_count() or 1) * 2))
+    ap.add_argument("--fix", action="store_true",
+                    help="Re-save truncated JPEGs and rewrite labels without bad rows")
+    ap.add_argument("--quarantine", action="store_true",
+                    help=f"Move unfixable images and orphan labels to <root>/{QUARANTINE}")
+    ap.add_argument("--report", default=None, help="JSON report (default: <root>/scan_report.json)")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="Do not rebuild the labels/<split>.cache files after changes")
+    args = ap.parse_args()
+
+    root = Path(args.root)
+    layout = detect_layout(root)
+    if layout is None:
+        raise RuntimeError(f"Could not find images/labels folders under {root}")
+    names, _ = load_names(root / "data.yaml")
+    nc = len(names)
+    mpath = root / MANIFEST
+    manifest = json.loads(mpath.read_text()) if mpath.exists() else {}
+
+    report, changed = {}, False
+    for sp in args.splits or find_splits(root, layout):
+        img_dir, lbl_dir = split_dirs(root, sp, layout)
+        imgs, lbls = list_images(img_dir), list_labels(lbl_dir)
+        img_res, n_new = scan_images(list(imgs.values()), manifest, args.threads)
+        lbl_issues = scan_labels(lbl_dir, nc, manifest) if lbl_dir.is_dir() else {}
+
+        items = []
+        for stem, p in sorted(imgs.items()):
+            issue, detail = img_res[str(p)]
+            if issue:
+                items.append({"kind": issue, "file": str(p), "detail": detail})
+        for stem, c in sorted(lbl_issues.items()):
+            for kind, n in c.items():
+                items.append({"kind": kind, "file": str(lbl_dir / f"{stem}.txt"), "rows": n})
+        for stem in sorted(set(lbls) - set(imgs)):
+            items.append({"kind": "orphan_label", "file": str(lbls[stem])})
+        unlabeled = len(set(imgs) - set(lbls))
+
+        counts = Counter(it["kind"] for it in items)
+        print(f"[{sp}] {len(imgs)} images ({n_new} checked, rest from manifest), "
+              f"{len(lbls)} label files, {unlabeled} images without labels")
+        for kind, n in sorted(counts.items()):
+            print(f"  [WARN] {kind}: {n}")
+        report[sp] = {"images": len(imgs), "labels": len(lbls), "unlabeled": unlabeled,
+                      "counts": dict(counts), "issues": items}
+
+        fixed = {"jpeg": 0, "labels": 0, "rows": 0, "quarantined": 0}
+        bad_imgs = {Path(it["file"]) for it in items if it["kind"] in FATAL_IMAGE}
+        if args.fix:
+            for it in items:
+                if it["kind"] == "truncated":
+                    try:
+                        fix_jpeg(it["file"])
+                        bad_imgs.discard(Path(it["file"]))
+                        fixed["jpeg"] += 1
+                    except Exception:
+                        pass
+            label_files = {it["file"] for it in items if "rows" in it}
+            for lf in sorted(label_files):
+                fixed["rows"] += fix_label(lf, nc)
+                fixed["labels"] += 1
+        if args.quarantine:
+            dest = root / QUARANTINE
+            for p in sorted(bad_imgs):
+                quarantine(root, layout, sp, p, dest)
+                fixed["quarantined"] += 1
+            for stem in sorted(set(lbls) - set(imgs)):
+                # pass the stem as is: Roboflow stems contain dots
+                fixed["quarantined"] += quarantine(root, layout, sp, None, dest, stem=stem)
+        if any(fixed.values()):
+            changed = True
+            print(f"  [OK] re-saved {fixed['jpeg']} JPEGs, fixed {fixed['labels']} label files "
+                  f"({fixed['rows']} rows dropped), quarantined {fixed['quarantined']}")
+
+    manifest = {p: v for p, v in manifest.items() if os.path.exists(p)}
+    mpath.write_text(json.dumps(manifest))
+    out = Path(args.report) if args.report else root / "scan_report.json"
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport: {out}")
+
+    if changed and not args.no_cache:
+        refresh_caches(root, workers=args.threads)
+    print("\n✅ DONE")
+
+
+if __name__ == "__main__":
+    main()
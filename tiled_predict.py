@@ -0,0 +1,219 @@
+import argparse
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from cpu_runtime import box_iou, load_detector, nms
+from predict_stream import LatencyStats, iter_decoded, select_device
+
+# Tiled inference for small, distant signs. Instead of raising imgsz for the
+# whole frame (cost ~ imgsz^2), the frame is cut into overlapping native
+# resolution tiles that run as one batch, plus (by default) one downscaled
+# full-frame pass for signs too big for a tile. Boxes are shifted back to
+# frame coordinates and merged across tiles with class-aware NMS or weighted
+# box fusion (WBF).
+#
+# ROI modes, to only pay for tiles where signs can be:
+#   --roi x0 y0 x1 y1     fixed band of the frame (fractions), e.g. the right
+#                         half above the road: 0.4 0.0 1.0 0.7
+#   --roi-from-full       tiles centred on the full-frame pass's low-conf
+#                         candidates only (a cheap "where to look" pass)
+#
+# Works with a .pt (ultralytics) or an exported .onnx / OpenVINO model
+# (cpu_runtime). Writes YOLO txt with conf per frame, so the output can be
+# scored with evaluate_predictions.py.
+
+
+def tile_grid(x0, y0, x1, y1, tile, overlap):
+    """Top-left corners of tiles covering [x0, x1) x [y0, y1) with the given overlap."""
+    stride = max(1, int(tile * (1 - overlap)))
+
+    def starts(a, b):
+        if b - a <= tile:
+            return [a]
+        s = list(range(a, b - tile, stride))
+        return s + [b - tile]
+
+    return [(x, y) for y in starts(y0, y1) for x in starts(x0, x1)]
+
+
+def make_tiles(h, w, tile=640, overlap=0.2, roi=None):
+    """(N, 4) int xyxy tiles inside the frame, optionally restricted to a fractional ROI."""
+    tile = min(tile, h, w)
+    if roi is not None:
+        rx0, ry0, rx1, ry1 = roi
+        x0, y0, x1, y1 = int(rx0 * w), int(ry0 * h), int(np.ceil(rx1 * w)), int(np.ceil(ry1 * h))
+        x1, y1 = max(x1, x0 + tile), max(y1, y0 + tile)
+        x0, y0 = min(x0, w - tile), min(y0, h - tile)
+        x1, y1 = min(x1, w), min(y1, h)
+    else:
+        x0, y0, x1, y1 = 0, 0, w, h
+    corners = tile_grid(x0, y0, x1, y1, tile, overlap)
+    return np.array([(x, y, x + tile, y + tile) for x, y in corners], dtype=np.int64)
+
+
+def tiles_around(boxes, h, w, tile=640):
+    """One tile centred on each candidate box (clamped to the frame), deduplicated."""
+    tile = min(tile, h, w)
+    if not len(boxes):
+        return np.zeros((0, 4), np.int64)
+    c = (boxes[:, :2] + boxes[:, 2:]) / 2
+    x0 = np.clip(c[:, 0] - tile / 2, 0, w - tile).astype(np.int64)
+    y0 = np.clip(c[:, 1] - tile / 2, 0, h - tile).astype(np.int64)
+    t = np.stack([x0, y0, x0 + tile, y0 + tile], 1)
+    # drop tiles mostly covered by an earlier one
+    keep = nms(t.astype(np.float32), -np.arange(len(t), dtype=np.float32), iou_thres=0.5)
+    return t[np.sort(keep)]
+
+
+def run_detector(model, ims, conf, imgsz, device=None, iou=0.7):
+    """Per image (xyxy, conf, cls) in that image's pixels, for a YOLO or a cpu_runtime Detector."""
+    if not ims:
+        return []
+    if hasattr(model, "predict"):
+        out = []
+        for r in model.predict(ims, conf=conf, iou=iou, imgsz=imgsz, device=device, verbose=False):
+            b = r.boxes
+            out.append((b.xyxy.cpu().numpy(), b.conf.cpu().numpy(), b.cls.cpu().numpy().astype(np.int64)))
+        return out
+    return model(ims, conf=conf, iou=iou, imgsz=imgsz)
+
+
+def drop_cut_boxes(boxes, tile, frame_hw, margin=2):
+    """Mask of boxes that do not touch a tile edge lying inside the frame (cut objects)."""
+    x0, y0, x1, y1 = tile
+    h, w = frame_hw
+    cut = np.zeros(len(boxes), dtype=bool)
+    if x0 > 0:
+        cut |= boxes[:, 0] <= margin
+    if y0 > 0:
+        cut |= boxes[:, 1] <= margin
+    if x1 < w:
+        cut |= boxes[:, 2] >= (x1 - x0) - margin
+    if y1 < h:
+        cut |= boxes[:, 3] >= (y1 - y0) - margin
+    return ~cut
+
+
+def merge_nms(boxes, scores, cls, iou=0.5):
+    keep = nms(boxes, scores, iou, classes=cls)
+    return boxes[keep], scores[keep], cls[keep]
+
+
+def merge_wbf(boxes, scores, cls, iou=0.5):
+    """
+    Weighted box fusion: NMS picks the cluster heads, every same-class box
+    overlapping a head by > iou is averaged in, weighted by its confidence.
+    """
+    keep = nms(boxes, scores, iou, classes=cls)
+    if not len(keep):
+        return boxes[keep], scores[keep], cls[keep]
+    member = (box_iou(boxes[keep], boxes) > iou) & (cls[keep][:, None] == cls[None, :])
+    member[np.arange(len(keep)), keep] = True
+    wgt = member * scores[None, :]
+    fused = (wgt @ boxes) / wgt.sum(1, keepdims=True)
+    return fused.astype(np.float32), scores[keep], cls[keep]
+
+
+def predict_tiled(model, frame, tile=640, overlap=0.2, conf=0.25, iou=0.5, tile_imgsz=None,
+                  full_imgsz=640, full=True, roi=None, roi_from_full=False, cand_conf=0.05,
+                  merge="wbf", device=None):
+    """
+    Tiled detection on one BGR frame. Returns (xyxy, conf, cls, n_tiles) in frame pixels.
+    """
+    h, w = frame.shape[:2]
+    parts = []
+    if full or roi_from_full:
+        fb, fc, fk = run_detector(model, [frame], cand_conf if roi_from_full else conf,
+                                  full_imgsz, device)[0]
+        if roi_from_full:
+            tiles = tiles_around(fb, h, w, tile)
+            m = fc >= conf
+            fb, fc, fk = fb[m], fc[m], fk[m]
+        if full:
+            parts.append((fb, fc, fk))
+    if not roi_from_full:
+        tiles = make_tiles(h, w, tile, overlap, roi)
+
+    crops = [frame[y0:y1, x0:x1] for x0, y0, x1, y1 in tiles]
+    tile_imgsz = tile_imgsz or getattr(model, "fixed_imgsz", None) or min(tile, h, w)
+    results = run_detector(model, crops, conf, tile_imgsz, device)
+    for t, (b, c, k) in zip(tiles, results):
+        m = drop_cut_boxes(b, t, (h, w)) if len(tiles) > 1 else np.ones(len(b), bool)
+        parts.append((b[m] + np.array([t[0], t[1], t[0], t[1]], np.float32), c[m], k[m]))
+
+    if not parts:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64), 0
+    boxes = np.concatenate([p[0] for p in parts]).astype(np.float32)
+    scores = np.concatenate([p[1] for p in parts]).astype(np.float32)
+    cls = np.concatenate([p[2] for p in parts]).astype(np.int64)
+    fn = merge_wbf if merge == "wbf" else merge_nms
+    b, s, k = fn(boxes, scores, cls, iou)
+    return b, s, k, len(tiles)
+
+
+def to_txt(boxes, scores, cls, hw):
+    h, w = hw
+    lines = []
+    for (x0, y0, x1, y1), s, c in zip(boxes, scores, cls):
+        lines.append(f"{c} {(x0 + x1) / 2 / w:.6f} {(y0 + y1) / 2 / h:.6f} "
+                     f"{(x1 - x0) / w:.6f} {(y1 - y0) / h:.6f} {s:.6f}\n")
+    return "".join(lines)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Tiled / ROI inference for small objects.")
+    ap.add_argument("--model", required=True, help="best.pt, .onnx or *_openvino_model")
+    ap.add_argument("--source", required=True, help="Image folder, glob, image, video or packed split")
+    ap.add_argument("--out", default="runs/detect/tiled", help="Output folder (labels/*.txt)")
+    ap.add_argument("--tile", type=int, default=640, help="Tile size in frame pixels")
+    ap.add_argument("--overlap", type=float, default=0.2)
+    ap.add_argument("--tile-imgsz", type=int, default=None, help="Model input for tiles (default: --tile, or a static export's size)")
+    ap.add_argument("--full-imgsz", type=int, default=640, help="Model input for the full-frame pass")
+    ap.add_argument("--no-full", action="store_true", help="Skip the full-frame pass")
+    ap.add_argument("--roi", type=float, nargs=4, default=None, metavar=("X0", "Y0", "X1", "Y1"),
+                    help="Only tile this fractional region")
+    ap.add_argument("--roi-from-full", action="store_true",
+                    help="Only tile around full-frame candidates")
+    ap.add_argument("--conf", type=float, default=0.25)
+    ap.add_argument("--iou", type=float, default=0.5, help="Cross-tile merge IoU")
+    ap.add_argument("--merge", choices=["wbf", "nms"], default="wbf")
+    ap.add_argument("--device", default=None)
+    args = ap.parse_args()
+
+    if Path(args.model).suffix == ".pt":
+        from ultralytics import YOLO
+        model = YOLO(args.model)
+        device = select_device(args.device)
+    else:
+        model = load_detector(args.model)
+        device = None
+
+    out = Path(args.out) / "labels"
+    out.mkdir(parents=True, exist_ok=True)
+    stats = LatencyStats()
+    n_tiles = n_boxes = 0
+    for name, frame in iter_decoded(args.source, threads=min(8, os.cpu_count() or 1)):
+        t = time.perf_counter()
+        b, s, k, nt = predict_tiled(model, frame, tile=args.tile, overlap=args.overlap,
+                                    conf=args.conf, iou=args.iou, tile_imgsz=args.tile_imgsz,
+                                    full_imgsz=args.full_imgsz, full=not args.no_full,
+                                    roi=args.roi, roi_from_full=args.roi_from_full,
+                                    merge=args.merge, device=device)
+        stats.add([time.perf_counter() - t])
+        n_tiles += nt
+        n_boxes += len(b)
+        if len(b):
+            with open(out / f"{name}.txt", "w") as f:
+                f.write(to_txt(b, s, k, frame.shape[:2]))
+
+    s = stats.summary()
+    print(f"\n{s['images']} frames, {n_tiles / max(s['images'], 1):.1f} tiles/frame, "
+          f"{n_boxes} boxes, {s['images_per_sec']} frames/s, p50 {s['p50_ms']} ms")
+    print(f"✅ Results in {out}")
+
+
+if __name__ == "__main__":
+    main()
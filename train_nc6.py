@@ -1,11 +1,15 @@
 from ultralytics import YOLO
 
+from train_profiler import attach_profiler
+
 DATA_YAML = "/Users/juanpablogarza/Desktop/traffic_sign_dataset/data.yaml"
 
 # COCO-pretrained YOLOv8n, will adapt head to nc=6
 model = YOLO("yolov8n.pt")
+attach_profiler(model)  # per-batch timing -> <run>/profile.csv
 
 # Phase 1: warmup, freeze backbone
+# (head_training.py does the same from cached backbone features, much faster per epoch)
 model.train(
     data=DATA_YAML,
     imgsz=640,
@@ -22,6 +26,7 @@ model.train(
 # Phase 2: unfreeze, full fine-tune
 head_best = "/Users/juanpablogarza/runs/traffic_signs_nc6_v1_head/weights/best.pt"
 model = YOLO(head_best)
+attach_profiler(model)  # per-batch timing -> <run>/profile.csv
 
 model.train(
     data=DATA_YAML,
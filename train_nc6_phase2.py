@@ -1,10 +1,13 @@
 from ultralytics import YOLO
 
+from train_profiler import attach_profiler
+
 DATA_YAML = "/Users/juanpablogarza/Desktop/traffic_sign_dataset/data.yaml"
 
 head_best = "/Users/juanpablogarza/runs/traffic_signs_nc6_v1_head/weights/best.pt"
 
 model = YOLO(head_best)
+attach_profiler(model)  # per-batch timing -> <run>/profile.csv
 
 model.train(
     data=DATA_YAML,
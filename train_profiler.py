@@ -0,0 +1,186 @@
+import argparse
+import csv
+import resource
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Per-batch timing for ultralytics training runs. attach_profiler(model) adds
+# trainer callbacks that write <save_dir>/profile.csv next to results.csv:
+#   kind=batch  wait_ms = time blocked on the dataloader before the batch
+#               step_ms = forward + backward + optimizer step
+#   kind=val    step_ms = validation (+ checkpoint save) after the epoch
+#   kind=epoch  step_ms = wall time of the whole epoch
+# plus images/sec and peak RSS of the training process.
+#
+#   python train_profiler.py runs/x/profile.csv [runs/y/profile.csv ...]
+# summarizes each run, names the stage that dominates and compares runs
+# side by side (e.g. workers=0 vs workers=8, or with/without the image cache).
+
+FIELDS = ["kind", "epoch", "batch", "t", "wait_ms", "step_ms", "img_s", "rss_mb"]
+
+
+def peak_rss_mb():
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r / 2**20 if sys.platform == "darwin" else r / 1024  # bytes on macOS, KB on Linux
+
+
+def _sync(device):
+    """Wait for queued GPU work so step time is not just kernel launch time."""
+    if device.type == "cuda":
+        import torch
+        torch.cuda.synchronize(device)
+    elif device.type == "mps":
+        import torch
+        torch.mps.synchronize()
+
+
+class TrainProfiler:
+    def __init__(self, sync=True, flush_every=50):
+        self.sync = sync
+        self.flush_every = flush_every
+        self.f = None
+        self.writer = None
+
+    def _row(self, kind, trainer, batch, wait, step, img_s):
+        self.writer.writerow([kind, trainer.epoch + 1, batch, round(time.perf_counter() - self.t0, 3),
+                              round(wait * 1000, 2), round(step * 1000, 2), round(img_s, 1),
+                              round(peak_rss_mb(), 1)])
+
+    def on_train_start(self, trainer):
+        self.path = Path(trainer.save_dir) / "profile.csv"
+        self.f = open(self.path, "w", newline="")
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(FIELDS)
+        self.t0 = time.perf_counter()
+
+    def on_train_epoch_start(self, trainer):
+        self.epoch_t = self.last = time.perf_counter()
+        self.i = 0
+
+    def on_train_batch_start(self, trainer):
+        now = time.perf_counter()
+        self.wait = now - self.last
+        self.step_t = now
+
+    def on_train_batch_end(self, trainer):
+        if self.sync:
+            _sync(trainer.device)
+        now = time.perf_counter()
+        step = now - self.step_t
+        self._row("batch", trainer, self.i, self.wait, step,
+                  trainer.batch_size / max(step + self.wait, 1e-9))
+        self.i += 1
+        if self.i % self.flush_every == 0:
+            self.f.flush()
+        self.last = time.perf_counter()
+
+    def on_train_epoch_end(self, trainer):
+        self.val_t = time.perf_counter()
+
+    def on_fit_epoch_end(self, trainer):
+        now = time.perf_counter()
+        self._row("val", trainer, "", 0.0, now - self.val_t, 0.0)
+        self._row("epoch", trainer, "", 0.0, now - self.epoch_t, 0.0)
+        self.f.flush()
+
+    def on_train_end(self, trainer):
+        if self.f:
+            self.f.close()
+            print(f"Profile written to {self.path}")
+
+
+def attach_profiler(model, sync=True):
+    """Register the profiling callbacks on a YOLO model before model.train()."""
+    prof = TrainProfiler(sync=sync)
+    for event in ("on_train_start", "on_train_epoch_start", "on_train_batch_start",
+                  "on_train_batch_end", "on_train_epoch_end", "on_fit_epoch_end", "on_train_end"):
+        model.add_callback(event, getattr(prof, event))
+    return prof
+
+
+# ---- summarizer -------------------------------------------------------------
+
+def load_profile(path):
+    cols = {k: [] for k in FIELDS}
+    with open(path, "r") as f:
+        for row in csv.DictReader(f):
+            for k in FIELDS:
+                cols[k].append(row[k])
+    kind = np.array(cols["kind"])
+    num = {k: np.array([float(v or 0) for v in cols[k]]) for k in FIELDS[1:]}
+    return kind, num
+
+
+def summarize(path):
+    kind, num = load_profile(path)
+    b, v, e = kind == "batch", kind == "val", kind == "epoch"
+    wait, step = num["wait_ms"][b] / 1000, num["step_ms"][b] / 1000
+    val = num["step_ms"][v] / 1000
+    # the last epoch may have been interrupted before its epoch row
+    total = num["step_ms"][e].sum() / 1000 if e.any() else wait.sum() + step.sum() + val.sum()
+    stages = {"data": float(wait.sum()), "compute": float(step.sum()), "val": float(val.sum())}
+    stages["other"] = max(0.0, float(total) - sum(stages.values()))
+    n_img = float((num["img_s"][b] * (wait + step)).sum())
+    return {
+        "run": str(path),
+        "epochs": int(e.sum()),
+        "batches": int(b.sum()),
+        "total_s": round(float(total), 1),
+        "share": {k: round(s / total, 3) if total else 0.0 for k, s in stages.items()},
+        "wait_ms_p50": round(float(np.median(wait) * 1000), 1) if b.any() else 0.0,
+        "wait_ms_p95": round(float(np.percentile(wait, 95) * 1000), 1) if b.any() else 0.0,
+        "step_ms_p50": round(float(np.median(step) * 1000), 1) if b.any() else 0.0,
+        "val_s_mean": round(float(val.mean()), 1) if v.any() else 0.0,
+        "img_s": round(n_img / max(float(wait.sum() + step.sum()), 1e-9), 1),
+        "peak_rss_mb": round(float(num["rss_mb"].max()), 0) if len(kind) else 0.0,
+        "bottleneck": max(stages, key=stages.get),
+    }
+
+
+ADVICE = {
+    "data": "the GPU waits on the dataloader: raise workers, enable cache=ram/disk or "
+            "use build_image_cache.py shards",
+    "compute": "forward/backward dominates: smaller imgsz/model or a faster device; "
+               "more workers will not help",
+    "val": "validation dominates: validate less often (val=False + final val) or on a "
+           "smaller split",
+    "other": "time outside batches and val (plots, checkpoint saves, warmup); check save_period/plots",
+}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Summarize / compare training profiles (profile.csv).")
+    ap.add_argument("profiles", nargs="+", help="profile.csv files or run folders")
+    args = ap.parse_args()
+
+    runs = []
+    for p in args.profiles:
+        p = Path(p)
+        runs.append(summarize(p / "profile.csv" if p.is_dir() else p))
+
+    for s in runs:
+        sh = s["share"]
+        print(f"\n{s['run']}")
+        print(f"  {s['epochs']} epochs, {s['batches']} batches, {s['total_s']} s, "
+              f"{s['img_s']} img/s, peak RSS {s['peak_rss_mb']:.0f} MB")
+        print(f"  data {sh['data']:.0%}  compute {sh['compute']:.0%}  val {sh['val']:.0%}  "
+              f"other {sh['other']:.0%}")
+        print(f"  wait p50/p95 {s['wait_ms_p50']}/{s['wait_ms_p95']} ms, "
+              f"step p50 {s['step_ms_p50']} ms, val {s['val_s_mean']} s/epoch")
+        print(f"  [NOTE] bottleneck: {s['bottleneck']} - {ADVICE[s['bottleneck']]}")
+
+    if len(runs) > 1:
+        base = runs[0]
+        print(f"\n{'run':<40}{'img/s':>9}{'x base':>8}{'data':>7}{'comp':>7}{'val':>7}{'RSS MB':>9}")
+        for s in runs:
+            name = Path(s["run"]).parent.name or s["run"]
+            ratio = s["img_s"] / base["img_s"] if base["img_s"] else 0.0
+            print(f"{name[:39]:<40}{s['img_s']:>9.1f}{ratio:>8.2f}{s['share']['data']:>7.0%}"
+                  f"{s['share']['compute']:>7.0%}{s['share']['val']:>7.0%}{s['peak_rss_mb']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
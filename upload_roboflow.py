@@ -0,0 +1,420 @@
+import argparse
+import asyncio
+import hashlib
+import http.client
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import quote, urlencode, urlparse
+
+from yolo_io import detect_layout, find_splits, list_images, list_labels, load_names, split_dirs
+
+# Concurrent, resumable upload of a YOLO dataset (images + label txt).
+#
+#   python upload_roboflow.py push <root> --backend roboflow --project ws/traffic-signs
+#   python upload_roboflow.py push <root> --backend http --url http://127.0.0.1:8770
+#   python upload_roboflow.py mock <store> --port 8770 --fail-rate 0.1
+#
+# Uploads run as asyncio tasks bounded by --concurrency, with a token bucket
+# for --rate requests/s. The HTTP calls themselves run on a pool of
+# keep-alive http.client connections (one per worker thread), stdlib only.
+# 429 / 5xx / connection errors are retried with exponential backoff and
+# jitter (Retry-After is honoured).
+#
+# <root>/.upload_journal.jsonl gets one line per finished image (target,
+# split/stem, image + label sha256, remote id), flushed as it goes. A re-run
+# skips images whose content hashes match the journal; when only the label
+# changed, only the label is re-sent against the stored id. The image id is
+# journaled (without a label hash) as soon as the image is accepted, so a
+# label that failed to upload is retried alone on the next run.
+#
+# Backends:
+#   roboflow  Roboflow upload API (image multipart, then the annotation with
+#             the data.yaml names as labelmap). Key from $ROBOFLOW_API_KEY.
+#   http      generic: PUT <url>/images/<split>/<file> and
+#             PUT <url>/labels/<split>/<stem>.txt, JSON {"id": ...} back.
+#             `mock` serves exactly that into a folder, with optional
+#             injected failures, so the whole flow can be tested locally.
+
+JOURNAL = ".upload_journal.jsonl"
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    def __init__(self, msg, retry_after=None):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+class UploadError(Exception):
+    pass
+
+
+# ---- transport --------------------------------------------------------------
+
+class ConnectionPool:
+    """Keep-alive connection per worker thread, keyed by (scheme, host, port)."""
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _conn(self, u):
+        conns = self.local.__dict__.setdefault("conns", {})
+        key = (u.scheme, u.hostname, u.port)
+        if key not in conns:
+            cls = http.client.HTTPSConnection if u.scheme == "https" else http.client.HTTPConnection
+            conns[key] = cls(u.hostname, u.port, timeout=self.timeout)
+        return key, conns[key]
+
+    def request(self, method, url, body=None, headers=None):
+        """(status, headers, body bytes); connection errors become RetryableError."""
+        u = urlparse(url)
+        key, conn = self._conn(u)
+        path = u.path + (f"?{u.query}" if u.query else "")
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            resp = conn.getresponse()
+            data = resp.read()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            self.local.conns.pop(key, None)
+            raise RetryableError(f"{type(e).__name__}: {e}")
+        if resp.status in RETRY_STATUS:
+            ra = resp.getheader("Retry-After")
+            raise RetryableError(f"HTTP {resp.status}", float(ra) if ra and ra.isdigit() else None)
+        if resp.status >= 400:
+            raise UploadError(f"HTTP {resp.status}: {data[:200].decode(errors='replace')}")
+        return resp.status, dict(resp.getheaders()), data
+
+
+class TokenBucket:
+    """At most `rate` acquisitions per second (bursts up to `burst`)."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.t = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.t) * self.rate)
+                self.t = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# ---- backends ---------------------------------------------------------------
+
+class Backend:
+    """upload_image -> remote id; upload_label attaches a label txt to that id."""
+
+    name = "base"
+
+    def target(self):
+        raise NotImplementedError
+
+    def upload_image(self, pool, split, file_name, data):
+        raise NotImplementedError
+
+    def upload_label(self, pool, split, stem, image_id, text):
+        raise NotImplementedError
+
+
+class HTTPBackend(Backend):
+    name = "http"
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def target(self):
+        return self.url
+
+    def upload_image(self, pool, split, file_name, data):
+        _, _, body = pool.request("PUT", f"{self.url}/images/{split}/{quote(file_name)}", data,
+                                  {"Content-Type": "application/octet-stream",
+                                   "X-Content-SHA256": hashlib.sha256(data).hexdigest()})
+        return json.loads(body)["id"]
+
+    def upload_label(self, pool, split, stem, image_id, text):
+        pool.request("PUT", f"{self.url}/labels/{split}/{quote(stem)}.txt", text.encode(),
+                     {"Content-Type": "text/plain", "X-Image-Id": str(image_id)})
+
+
+class RoboflowBackend(Backend):
+    name = "roboflow"
+    API = "https://api.roboflow.com"
+
+    def __init__(self, project, api_key, names, batch_name=None):
+        self.project = project
+        self.api_key = api_key
+        self.labelmap = {str(i): n for i, n in enumerate(names)}
+        self.batch_name = batch_name
+
+    def target(self):
+        return f"roboflow:{self.project}"
+
+    def upload_image(self, pool, split, file_name, data):
+        q = {"api_key": self.api_key, "name": file_name, "split": split}
+        if self.batch_name:
+            q["batch"] = self.batch_name
+        boundary = uuid.uuid4().hex
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; "
+                f"filename=\"{file_name}\"\r\nContent-Type: application/octet-stream\r\n\r\n").encode() \
+            + data + f"\r\n--{boundary}--\r\n".encode()
+        _, _, resp = pool.request("POST", f"{self.API}/dataset/{self.project}/upload?{urlencode(q)}", body,
+                                  {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        out = json.loads(resp)
+        if not (out.get("success") or out.get("duplicate")) or "id" not in out:
+            raise UploadError(f"upload of {file_name} rejected: {out}")
+        return out["id"]
+
+    def upload_label(self, pool, split, stem, image_id, text):
+        q = {"api_key": self.api_key, "name": f"{stem}.txt", "overwrite": "true"}
+        body = json.dumps({"annotationFile": text, "labelmap": self.labelmap}).encode()
+        _, _, resp = pool.request("POST", f"{self.API}/dataset/{self.project}/annotate/{image_id}?{urlencode(q)}",
+                                  body, {"Content-Type": "application/json"})
+        out = json.loads(resp)
+        if not out.get("success", True) or out.get("error"):
+            raise UploadError(f"annotation of {stem} rejected: {out}")
+
+
+# ---- journal ----------------------------------------------------------------
+
+def load_journal(path, target):
+    """{split/stem: last record} for this target."""
+    done = {}
+    if Path(path).exists():
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line of an interrupted run
+                if rec.get("target") == target:
+                    done[rec["key"]] = rec
+    return done
+
+
+def sha256_file(path):
+    if path is None:
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def collect_items(root, splits=None):
+    """(split, stem, image path, label path or None) for every image."""
+    root = Path(root)
+    layout = detect_layout(root)
+    if layout is None:
+        raise RuntimeError(f"Could not find images/labels folders under {root}")
+    items = []
+    for sp in splits or find_splits(root, layout):
+        img_dir, lbl_dir = split_dirs(root, sp, layout)
+        imgs, lbls = list_images(img_dir), list_labels(lbl_dir)
+        items += [(sp, s, imgs[s], lbls.get(s)) for s in sorted(imgs)]
+    return items
+
+
+# ---- upload -----------------------------------------------------------------
+
+async def with_retries(loop, executor, bucket, fn, *args, retries=5, base=0.5, cap=30.0):
+    for attempt in range(retries + 1):
+        await bucket.acquire()
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        except RetryableError as e:
+            if attempt == retries:
+                raise UploadError(f"gave up after {retries} retries: {e}")
+            delay = e.retry_after or min(cap, base * 2 ** attempt) * (0.5 + random.random())
+            await asyncio.sleep(delay)
+        except UploadError:
+            raise
+        except Exception as e:
+            # e.g. a malformed response body; fail this item, not the whole gather
+            raise UploadError(f"{type(e).__name__}: {e}") from e
+
+
+async def upload_all(items, backend, journal_path, concurrency=8, rate=0.0, retries=5, dry_run=False):
+    """Upload items, skipping journaled ones. Returns a Counter-like dict of outcomes."""
+    target = backend.target()
+    done = load_journal(journal_path, target)
+    pool = ConnectionPool()
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(concurrency, thread_name_prefix="upload")
+    bucket = TokenBucket(rate)
+    sem = asyncio.Semaphore(concurrency)
+    stats = {"uploaded": 0, "label_only": 0, "skipped": 0, "failed": 0}
+    failed = []
+    jf = open(journal_path, "a")
+    t0 = time.perf_counter()
+
+    def journal(key, img_sha, lbl_sha, image_id):
+        jf.write(json.dumps({"target": target, "key": key, "img": img_sha, "lbl": lbl_sha,
+                             "id": image_id, "t": round(time.time(), 3)}) + "\n")
+        jf.flush()
+
+    async def one(split, stem, img, lbl):
+        key = f"{split}/{stem}"
+        async with sem:
+            img_sha, lbl_sha = await asyncio.gather(loop.run_in_executor(executor, sha256_file, img),
+                                                    loop.run_in_executor(executor, sha256_file, lbl))
+            rec = done.get(key)
+            if rec and rec["img"] == img_sha and rec["lbl"] == lbl_sha:
+                stats["skipped"] += 1
+                return
+            if dry_run:
+                stats["label_only" if rec and rec["img"] == img_sha else "uploaded"] += 1
+                return
+            try:
+                if rec and rec["img"] == img_sha:
+                    image_id, outcome = rec["id"], "label_only"
+                else:
+                    data = await loop.run_in_executor(executor, Path(img).read_bytes)
+                    image_id = await with_retries(loop, executor, bucket, backend.upload_image, pool,
+                                                  split, Path(img).name, data, retries=retries)
+                    outcome = "uploaded"
+                    if lbl is not None:
+                        # image is on the server: a re-run after a label failure only re-sends the label
+                        journal(key, img_sha, None, image_id)
+                if lbl is not None:
+                    text = await loop.run_in_executor(executor, Path(lbl).read_text)
+                    await with_retries(loop, executor, bucket, backend.upload_label, pool, split, stem,
+                                       image_id, text, retries=retries)
+            except (UploadError, OSError) as e:
+                stats["failed"] += 1
+                failed.append((key, str(e)))
+                return
+            stats[outcome] += 1
+            journal(key, img_sha, lbl_sha, image_id)
+        n = sum(stats.values())
+        if n % 100 == 0:
+            print(f"  {n}/{len(items)}  {n / (time.perf_counter() - t0):.1f} img/s")
+
+    try:
+        await asyncio.gather(*(one(*it) for it in items))
+    finally:
+        jf.close()
+        executor.shutdown(wait=False)
+    for key, err in failed[:20]:
+        print(f"[WARN] {key}: {err}")
+    return stats
+
+
+# ---- mock server ------------------------------------------------------------
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Generic-backend server storing into server.store, failing server.fail_rate of requests."""
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, code, obj, headers=None):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if random.random() < self.server.fail_rate:
+            code = random.choice([429, 500, 503])
+            self._send(code, {"error": "injected"}, {"Retry-After": "0"} if code == 429 else None)
+            return
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] not in ("images", "labels"):
+            self._send(404, {"error": "not found"})
+            return
+        dest = Path(self.server.store) / parts[0] / parts[1] / Path(parts[2]).name
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        dest.write_bytes(data)
+        with self.server.lock:
+            self.server.requests += 1
+        self._send(200, {"id": hashlib.sha256(data).hexdigest()[:16] if parts[0] == "images" else None})
+
+
+def serve_mock(store, host="127.0.0.1", port=8770, fail_rate=0.0):
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.store, server.fail_rate = store, fail_rate
+    server.lock, server.requests = threading.Lock(), 0
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent, resumable YOLO dataset uploader.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("push", help="Upload a dataset root")
+    p.add_argument("root", help="Dataset root with data.yaml")
+    p.add_argument("--backend", choices=["roboflow", "http"], default="roboflow")
+    p.add_argument("--project", default=None, help="Roboflow project, e.g. my-workspace/traffic-signs")
+    p.add_argument("--batch-name", default=None, help="Roboflow upload batch name")
+    p.add_argument("--url", default=None, help="Base URL for --backend http")
+    p.add_argument("--splits", nargs="+", default=None)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--rate", type=float, default=0.0, help="Max requests/s (0 = unlimited)")
+    p.add_argument("--retries", type=int, default=5)
+    p.add_argument("--dry-run", action="store_true", help="Only report what would be sent")
+    m = sub.add_parser("mock", help="Local server for --backend http")
+    m.add_argument("store", help="Folder to store uploads in")
+    m.add_argument("--host", default="127.0.0.1")
+    m.add_argument("--port", type=int, default=8770)
+    m.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered 429/5xx")
+    args = ap.parse_args()
+
+    if args.cmd == "mock":
+        server = serve_mock(args.store, args.host, args.port, args.fail_rate)
+        print(f"✅ Mock upload server on http://{args.host}:{args.port} -> {args.store}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    root = Path(args.root)
+    if args.backend == "roboflow":
+        key = os.environ.get("ROBOFLOW_API_KEY")
+        if not key or not args.project:
+            raise SystemExit("roboflow backend needs --project and $ROBOFLOW_API_KEY")
+        names, _ = load_names(root / "data.yaml")
+        backend = RoboflowBackend(args.project, key, names, args.batch_name)
+    else:
+        if not args.url:
+            raise SystemExit("http backend needs --url")
+        backend = HTTPBackend(args.url)
+
+    items = collect_items(root, args.splits)
+    print(f"{len(items)} images -> {backend.target()}")
+    stats = asyncio.run(upload_all(items, backend, root / JOURNAL, concurrency=args.concurrency,
+                                   rate=args.rate, retries=args.retries, dry_run=args.dry_run))
+    print(f"\nuploaded {stats['uploaded']}, label only {stats['label_only']}, "
+          f"unchanged {stats['skipped']}, failed {stats['failed']}")
+    if stats["failed"]:
+        print("[NOTE] re-run to retry the failed ones; finished uploads are journaled")
+    else:
+        print("✅ DONE")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import os
+import shutil
+from pathlib import Path
+
+import yaml
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
+
+SPLITS = ["train", "valid", "test"]
+
+# The two folder layouts used by the datasets in this repo:
+#   "flat":  <root>/images/<split>, <root>/labels/<split>   (traffic_sign_dataset)
+#   "split": <root>/<split>/images, <root>/<split>/labels   (Roboflow exports)
+LAYOUT_FLAT = "flat"
+LAYOUT_SPLIT = "split"
+
+
+def detect_layout(root: Path):
+    """
+    Figure out which of the two YOLO folder layouts `root` uses.
+    Returns LAYOUT_FLAT, LAYOUT_SPLIT, or None if neither is present.
+    """
+    root = Path(root)
+    if (root / "images").is_dir() or (root / "labels").is_dir():
+        return LAYOUT_FLAT
+    if any((root / sp / "images").is_dir() or (root / sp / "labels").is_dir()
+           for sp in SPLITS + ["val"]):
+        return LAYOUT_SPLIT
+    return None
+
+
+def split_dirs(root: Path, split: str, layout: str):
+    """Return (img_dir, lbl_dir) for a split in the given layout."""
+    root = Path(root)
+    if layout == LAYOUT_SPLIT:
+        return root / split / "images", root / split / "labels"
+    return root / "images" / split, root / "labels" / split
+
+
+def find_splits(root: Path, layout: str, candidates=None):
+    """
+    List the splits that exist under `root`. If both 'valid' and 'val' exist,
+    'valid' wins (same rule as filter_yolo_dataset.py).
+    """
+    candidates = candidates or SPLITS + ["val"]
+    found = []
+    for sp in candidates:
+        img_dir, lbl_dir = split_dirs(root, sp, layout)
+        if img_dir.is_dir() or lbl_dir.is_dir():
+            found.append(sp)
+    if "val" in found and "valid" in found:
+        found.remove("val")
+    return found
+
+
+def list_images(img_dir: Path):
+    """Map stem -> image path for every image in a folder (one directory scan)."""
+    out = {}
+    if not Path(img_dir).is_dir():
+        return out
+    with os.scandir(img_dir) as it:
+        for e in it:
+            if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_EXTS:
+                out[os.path.splitext(e.name)[0]] = Path(e.path)
+    return out
+
+
+def list_labels(lbl_dir: Path):
+    """Map stem -> label path for every .txt in a folder (one directory scan)."""
+    out = {}
+    if not Path(lbl_dir).is_dir():
+        return out
+    with os.scandir(lbl_dir) as it:
+        for e in it:
+            if e.is_file() and e.name.endswith(".txt"):
+                out[e.name[:-4]] = Path(e.path)
+    return out
+
+
+def parse_rows(text: str):
+    """
+    Split label text into (class_id, coord_tokens) rows.
+    Blank lines and rows whose class id is not an int are dropped, the same
+    way the remap/filter scripts have always treated them.
+    """
+    rows = []
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        try:
+            cid = int(parts[0])
+        except ValueError:
+            continue
+        rows.append((cid, parts[1:]))
+    return rows
+
+
+def format_rows(rows):
+    return "".join(f"{cid} {' '.join(coords)}\n" for cid, coords in rows)
+
+
+def write_atomic(path: Path, text: str):
+    """Write a file via a temp file + rename so readers never see half a label."""
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.tmp{os.getpid()}")
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def load_names(data_yaml: Path):
+    """Read class names from data.yaml. names can be a list or a {id: name} dict."""
+    with open(data_yaml, "r") as f:
+        y = yaml.safe_load(f) or {}
+    names = y.get("names")
+    if isinstance(names, dict):
+        names = [names[k] for k in sorted(names.keys(), key=lambda x: int(x))]
+    return names, y
+
+
+def write_data_yaml(root: Path, y: dict, layout: str, splits, names, yaml_path: Path = None):
+    """Point data.yaml at the split image folders of `root` and set nc/names."""
+    root = Path(root)
+    y = dict(y)
+    y["train"] = str(split_dirs(root, "train", layout)[0])
+    val_split = "valid" if "valid" in splits else "val"
+    y["val"] = str(split_dirs(root, val_split, layout)[0])
+    if "test" in splits:
+        y["test"] = str(split_dirs(root, "test", layout)[0])
+    else:
+        y.pop("test", None)
+    y["nc"] = len(names)
+    y["names"] = list(names)
+    yaml_path = yaml_path or root / "data.yaml"
+    with open(yaml_path, "w") as f:
+        yaml.safe_dump(y, f, sort_keys=False)
+    return yaml_path
+
+
+def place_file(src, dst, mode="copy"):
+    """
+    Put `src` at `dst`.
+      copy: shutil.copy2
+      link: hardlink, falling back to a symlink (e.g. across filesystems),
+            and to a copy if neither is allowed
+    An existing `dst` is unlinked first, so a copy never writes through a
+    hardlink left by an earlier linked run. Use link for images only; label
+    txt files get rewritten in place by other tools.
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    if mode == "copy":
+        shutil.copy2(src, dst)
+        return "copy"
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.abspath(src), dst)
+        return "symlink"
+    except OSError:
+        shutil.copy2(src, dst)
+        return "copy"